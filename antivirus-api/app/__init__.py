@@ -7,24 +7,31 @@
 - main.py - FastAPI приложение
 """
 
-from database import Base, engine, get_db, create_tables, init_db
-from dbengine import call_files_iud_function, get_file_info_json, get_all_files_json, delete_file_id, call_signatures_iud_function, get_actual_signatures_json
-from dbengine import get_signatures_by_guids, get_signatures_by_status, scan_file_with_rabin_karp, get_signatures_history, get_audit_logs
+from database import Base, engine, get_db, get_async_db, create_tables, init_db, init_async_db
+from dbengine import call_files_iud_function, call_files_bulk_insert, get_file_info_json, get_file_content_meta, iter_file_content, get_all_files_json, delete_file_id, purge_file_contents, call_signatures_iud_function, get_actual_signatures_json
+from dbengine import get_signatures_by_guids, get_signatures_by_status, scan_file_with_rabin_karp, scan_archive_members, get_signatures_history, get_audit_logs
 
 __all__ = [
     'Base',
     'engine',
     'get_db',
+    'get_async_db',
     'init_db',
+    'init_async_db',
     'create_tables',
     'call_files_iud_function',
+    'call_files_bulk_insert',
     'get_file_info_json',
+    'get_file_content_meta',
+    'iter_file_content',
     'get_all_files_json',
     'delete_file_id',
+    'purge_file_contents',
     'call_signatures_iud_function',
     'get_actual_signatures_json',
     'get_signatures_by_status',
     'scan_file_with_rabin_karp',
+    'scan_archive_members',
     'get_signatures_history',
     'get_audit_logs'
 ]
@@ -0,0 +1,230 @@
+"""
+Модуль для работы с архивами (zip/tar/gzip)
+Позволяет перебирать файлы внутри архива в памяти, без распаковки на диск.
+Все чтения ограничены лимитами, чтобы архив-бомба не исчерпала память процесса
+"""
+
+import bz2
+import gzip
+import io
+import lzma
+import tarfile
+import zipfile
+import zlib
+from typing import Iterator, List, Optional, Tuple
+
+# Размер блока при потоковом чтении элемента архива
+_CHUNK_SIZE = 64 * 1024
+
+# Для определения типа достаточно начала содержимого (заголовки tar/gzip/zip)
+# и конца (запись End of Central Directory zip с комментарием до 64 КБ - в том числе у самораспаковывающихся архивов)
+ARCHIVE_SNIFF_HEAD = 4096
+ARCHIVE_SNIFF_TAIL = 22 + 65535
+
+
+class ArchiveLimitError(ValueError):
+    """Превышен один из лимитов распаковки архива (глубина, размер, количество)"""
+
+
+class ArchiveLimits:
+    """
+    Лимиты распаковки архива и счетчики, общие для всех уровней вложенности
+    :param max_depth: Максимальная глубина вложенности архивов
+    :param max_members: Максимальное общее количество элементов (каталоги и ссылки тоже считаются)
+    :param max_member_size: Максимальный размер одного элемента после распаковки
+    :param max_total_size: Максимальный суммарный размер всех распакованных элементов
+    """
+    def __init__(
+        self,
+        max_depth: int = 1,
+        max_members: Optional[int] = None,
+        max_member_size: Optional[int] = None,
+        max_total_size: Optional[int] = None
+    ):
+        self.max_depth = max_depth
+        self.max_members = max_members
+        self.max_member_size = max_member_size
+        self.max_total_size = max_total_size
+        self.members = 0
+        self.total_size = 0
+
+    def add_member(self):
+        self.members += 1
+        if self.max_members is not None and self.members > self.max_members:
+            raise ArchiveLimitError(f"Превышено количество элементов архива: {self.max_members}")
+
+    def add_bytes(self, size: int):
+        self.total_size += size
+        if self.max_total_size is not None and self.total_size > self.max_total_size:
+            raise ArchiveLimitError(f"Превышен суммарный размер распаковки: {self.max_total_size} байт")
+
+
+"""
+Читает элемент архива блоками, прерываясь при превышении лимитов
+(заявленному в заголовке размеру не доверяем)
+"""
+def _read_limited(stream, limits: ArchiveLimits) -> bytes:
+    chunks = []
+    size = 0
+    while True:
+        chunk = stream.read(_CHUNK_SIZE)
+        if not chunk:
+            break
+        size += len(chunk)
+        if limits.max_member_size is not None and size > limits.max_member_size:
+            raise ArchiveLimitError(f"Превышен размер элемента архива: {limits.max_member_size} байт")
+        limits.add_bytes(len(chunk))
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+"""
+Проверяет, что блок - корректный заголовок tar (контрольная сумма сходится, блок не нулевой)
+"""
+def _is_tar_header(block: bytes) -> bool:
+    try:
+        tarfile.TarInfo.frombuf(block[:tarfile.BLOCKSIZE], tarfile.ENCODING, "surrogateescape")
+        return True
+    except tarfile.HeaderError:
+        return False
+
+"""
+Распаковывает начало сжатого потока (gzip, bzip2, xz), чтобы проверить заголовок tar внутри
+:return: Первый блок распакованных данных или пустая строка, если это не сжатый поток
+"""
+def _decompressed_head(head: bytes) -> bytes:
+    if head[:2] == b"\x1f\x8b":
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    elif head[:3] == b"BZh":
+        decompressor = bz2.BZ2Decompressor()
+    elif head[:6] == b"\xfd7zXZ\x00":
+        decompressor = lzma.LZMADecompressor()
+    else:
+        return b""
+    try:
+        return decompressor.decompress(head, tarfile.BLOCKSIZE)
+    except (zlib.error, OSError, EOFError, lzma.LZMAError):
+        return b""
+
+"""
+Определяет тип контейнера по началу и концу содержимого, не читая его целиком
+:param head: Начало содержимого (до ARCHIVE_SNIFF_HEAD байт)
+:param tail: Конец содержимого (до ARCHIVE_SNIFF_TAIL байт)
+:return: 'zip', 'tar', 'gzip' или None если это не архив
+"""
+def sniff_archive_type(head: bytes, tail: bytes) -> Optional[str]:
+    if head[:4] in (b"PK\x03\x04", b"PK\x05\x06") or zipfile.is_zipfile(io.BytesIO(tail)):
+        return "zip"
+    # tar - только с корректным первым заголовком: нулевые блоки и произвольные данные архивом не считаются
+    if _is_tar_header(head) or _is_tar_header(_decompressed_head(head)):
+        return "tar"
+    if head[:2] == b"\x1f\x8b":
+        return "gzip"
+    return None
+
+"""
+Определяет тип контейнера по содержимому
+:return: 'zip', 'tar', 'gzip' или None если это не архив
+"""
+def archive_type(data: bytes) -> Optional[str]:
+    return sniff_archive_type(data[:ARCHIVE_SNIFF_HEAD], data[-ARCHIVE_SNIFF_TAIL:])
+
+"""
+Перебирает файлы внутри zip/tar/gzip архива (каталоги и ссылки пропускаются)
+:param data: Содержимое архива
+:param limits: Лимиты распаковки (по умолчанию без ограничений)
+:param skipped: Список для элементов, которые нельзя прочитать: (путь, 'encrypted' или 'unsupported');
+                такие элементы пропускаются, обход продолжается. None - прервать обход с ValueError
+:return: Итератор пар (путь внутри архива, содержимое файла)
+"""
+def iter_archive_members(
+    data: bytes,
+    limits: Optional[ArchiveLimits] = None,
+    skipped: Optional[List[Tuple[str, str]]] = None
+) -> Iterator[Tuple[str, bytes]]:
+    if limits is None:
+        limits = ArchiveLimits()
+    kind = archive_type(data)
+
+    if kind == "zip":
+        with zipfile.ZipFile(io.BytesIO(data)) as archive:
+            for info in archive.infolist():
+                limits.add_member()
+                if info.is_dir():
+                    continue
+                try:
+                    with archive.open(info) as member:
+                        content = _read_limited(member, limits)
+                except (RuntimeError, NotImplementedError) as e:
+                    # Зашифрованный элемент (пароль не известен) или неподдерживаемый метод сжатия
+                    reason = "encrypted" if info.flag_bits & 0x1 else "unsupported"
+                    if skipped is None:
+                        raise ValueError(f"Элемент архива {info.filename} не может быть прочитан ({reason}): {e}")
+                    skipped.append((info.filename, reason))
+                    continue
+                yield info.filename, content
+
+    elif kind == "tar":
+        with tarfile.open(fileobj=io.BytesIO(data), mode="r:*") as archive:
+            # Лимит считается по каждому заголовку: архив из одних каталогов или ссылок тоже упирается в max_members.
+            # Прочитанные заголовки не накапливаются в archive.members (ссылки не раскрываются, список не нужен)
+            while True:
+                member = archive.next()
+                if member is None:
+                    break
+                archive.members.clear()
+                limits.add_member()
+                if not member.isfile():
+                    continue
+                extracted = archive.extractfile(member)
+                if extracted is None:
+                    continue
+                yield member.name, _read_limited(extracted, limits)
+
+    elif kind == "gzip":
+        limits.add_member()
+        try:
+            with gzip.GzipFile(fileobj=io.BytesIO(data)) as member:
+                content = _read_limited(member, limits)
+        except (OSError, EOFError) as e:
+            raise ValueError(f"Повреждённый gzip: {e}")
+        yield "", content
+
+    else:
+        raise ValueError("Файл не является zip, tar или gzip архивом")
+
+"""
+Рекурсивно обходит архив и вложенные в него архивы
+Вложенный архив возвращается как обычный элемент, а затем раскрывается его содержимое
+:param data: Содержимое архива
+:param limits: Лимиты распаковки, общие для всех уровней
+:param prefix: Путь контейнера (используется при рекурсии)
+:param depth: Текущая глубина вложенности
+:param skipped: Список для нечитаемых элементов всех уровней (см. iter_archive_members), пути полные
+:return: Итератор пар (полный путь элемента через '/', содержимое)
+"""
+def walk_archive(
+    data: bytes,
+    limits: ArchiveLimits,
+    prefix: str = "",
+    depth: int = 1,
+    skipped: Optional[List[Tuple[str, str]]] = None
+) -> Iterator[Tuple[str, bytes]]:
+    if depth > limits.max_depth:
+        return
+
+    join = lambda name: "/".join(part for part in (prefix, name) if part)
+    level_skipped = [] if skipped is not None else None
+    for name, content in iter_archive_members(data, limits, level_skipped):
+        if level_skipped:
+            skipped.extend((join(skipped_name), reason) for skipped_name, reason in level_skipped)
+            level_skipped.clear()
+        # У gzip нет имени элемента, подставляем условное
+        path = join(name or "<gzip>")
+        yield path, content
+        if archive_type(content) is not None and depth < limits.max_depth:
+            yield from walk_archive(content, limits, path, depth + 1, skipped)
+    if level_skipped:
+        skipped.extend((join(skipped_name), reason) for skipped_name, reason in level_skipped)
+
+
+__all__ = ['ArchiveLimitError', 'ArchiveLimits', 'ARCHIVE_SNIFF_HEAD', 'ARCHIVE_SNIFF_TAIL', 'sniff_archive_type', 'archive_type', 'iter_archive_members', 'walk_archive']
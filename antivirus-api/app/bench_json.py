@@ -0,0 +1,69 @@
+"""
+Замер стоимости сериализации ответа /signatures на 10 000 сигнатур
+Сравниваются стандартный JSONResponse (json из стандартной библиотеки), ORJSONResponse
+и отдача готового JSON-текста из PostgreSQL (json_agg) без сериализации в Python.
+База данных не нужна: данные генерируются в памяти в том виде, в каком их возвращает драйвер.
+Запуск: python bench_json.py [количество сигнатур] [повторы]
+"""
+
+import json
+import sys
+import timeit
+from datetime import datetime, timedelta
+from uuid import uuid4
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, ORJSONResponse
+
+
+"""
+Генерирует список сигнатур в формате ответа /signatures
+"""
+def make_signatures(count: int) -> list:
+    now = datetime.now()
+    return [
+        {
+            "id": uuid4(),
+            "threat_name": f"Threat.Generic.{i}",
+            "first_bytes": "4D5A9000",
+            "remainder_hash": "d41d8cd98f00b204e9800998ecf8427e",
+            "remainder_length": 128 + i % 512,
+            "file_type": "exe",
+            "offset_start": i % 64,
+            "offset_end": None,
+            "status": "ACTUAL",
+            "updated_at": now - timedelta(seconds=i)
+        }
+        for i in range(count)
+    ]
+
+"""
+Замеряет лучшее время одного вызова в миллисекундах
+"""
+def measure(func, repeat: int) -> float:
+    return min(timeit.repeat(func, number=1, repeat=repeat)) * 1000
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    signatures = make_signatures(count)
+    # Так список выглядит после json_agg: уже сериализованный текст
+    raw = json.dumps(jsonable_encoder(signatures))
+
+    cases = {
+        # Путь FastAPI до перехода на ORJSONResponse: jsonable_encoder + json.dumps
+        "JSONResponse (jsonable_encoder + json)": lambda: JSONResponse(content=jsonable_encoder(signatures)).body,
+        # Путь FastAPI с ORJSONResponse по умолчанию: jsonable_encoder + orjson
+        "ORJSONResponse (jsonable_encoder + orjson)": lambda: ORJSONResponse(content=jsonable_encoder(signatures)).body,
+        # ORJSONResponse, возвращённый из обработчика напрямую: UUID и datetime сериализуются orjson
+        "ORJSONResponse (orjson only)": lambda: ORJSONResponse(content=signatures).body,
+        # Текущий /signatures: JSON собран в PostgreSQL, Python только передаёт байты
+        "json_agg passthrough": lambda: raw.encode("utf-8"),
+    }
+
+    print(f"Signatures: {count}, best of {repeat} runs")
+    baseline = None
+    for name, func in cases.items():
+        elapsed = measure(func, repeat)
+        baseline = baseline or elapsed
+        print(f"{name:45} {elapsed:9.2f} ms  x{baseline / elapsed:6.1f}")
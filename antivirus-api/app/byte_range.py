@@ -0,0 +1,47 @@
+"""
+Разбор заголовка HTTP Range для отдачи содержимого файлов (RFC 9110, 14.2)
+Поддерживается один диапазон в байтах; всё, что нельзя разобрать, игнорируется - файл отдаётся целиком
+"""
+
+import re
+from typing import Optional, Tuple
+
+# Один диапазон: bytes=start-end, bytes=start- или bytes=-suffix (только цифры ASCII)
+_RANGE_RE = re.compile(r"bytes=\s*([0-9]*)-([0-9]*)\s*")
+
+"""
+Разбирает заголовок Range
+Синтаксически неверный заголовок (bytes=5-x, bytes=x-5, bytes=5-3, несколько диапазонов, другие единицы)
+игнорируется - возвращается None, файл отдаётся целиком с кодом 200
+:param range_header: Значение заголовка Range или None
+:param size: Размер содержимого в байтах
+:return: Пара (start, end) включительно или None если заголовок не задан или не разобран
+:raises ValueError: Корректный диапазон не пересекается с содержимым, в том числе любой диапазон
+                    пустого содержимого (ответ 416)
+"""
+def parse_range(range_header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    if not range_header:
+        return None
+    match = _RANGE_RE.fullmatch(range_header.strip())
+    if match is None:
+        return None
+    start_str, end_str = match.groups()
+
+    if not start_str:
+        if not end_str:
+            return None
+        suffix = int(end_str)
+        if suffix == 0 or size == 0:
+            raise ValueError("Range not satisfiable")
+        return max(size - suffix, 0), size - 1
+
+    start = int(start_str)
+    end = int(end_str) if end_str else None
+    if end is not None and end < start:
+        return None
+    if start >= size:
+        raise ValueError("Range not satisfiable")
+    return start, size - 1 if end is None else min(end, size - 1)
+
+
+__all__ = ['parse_range']
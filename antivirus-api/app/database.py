@@ -3,17 +3,25 @@
 Содержит настройку подключения и базовые модели SQLAlchemy
 """
 
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine, text, event
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy.exc import SQLAlchemyError, ProgrammingError, OperationalError
+from sqlalchemy.exc import SQLAlchemyError, ProgrammingError, OperationalError, IntegrityError
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
 from config import settings
+from migrations import apply_migrations
+import asyncio
 import logging
+import threading
+import time
 
 # Настройка логгера SQLAlchemy
 logging.basicConfig()
 sql_logger = logging.getLogger('sqlalchemy.engine')
-sql_logger.setLevel(logging.INFO)  # Уровень логирования SQL запросов
+# Уровень логирования SQL запросов (все запросы только при DB_ECHO)
+sql_logger.setLevel(logging.INFO if settings.DB_ECHO else logging.WARNING)
+logger = logging.getLogger(__name__)
 
 # Создаем базовый класс для моделей
 Base = declarative_base()
@@ -30,6 +38,22 @@ def get_db_url():
         f"postgresql://{settings.DB_USER}:{settings.DB_PASSWORD}@"
         f"{settings.DB_HOST}:{settings.DB_PORT}/{settings.DB_NAME}"
     )
+
+# Адрес базы для асинхронного драйвера asyncpg (используется обработчиками API)
+def get_async_db_url():
+    return (
+        f"postgresql+asyncpg://{settings.DB_USER}:{settings.DB_PASSWORD}@"
+        f"{settings.DB_HOST}:{settings.DB_PORT}/{settings.DB_NAME}"
+    )
+
+# Адреса реплик для чтения из DB_REPLICA_URLS, приведённые к драйверу asyncpg
+def get_replica_urls() -> list:
+    urls = []
+    for url in settings.DB_REPLICA_URLS.split(","):
+        url = url.strip()
+        if url:
+            urls.append("postgresql+asyncpg://" + url.split("://", 1)[-1])
+    return urls
     
 # Проверяет существование базы данных PostgreSQL и создает ее при отсутствии    
 def check_and_create_postgres_db() -> bool:
@@ -48,7 +72,13 @@ def check_and_create_postgres_db() -> bool:
             
             if not result:
                 # Создаем базу данных, если ее нет
-                conn.execute(text(f"CREATE DATABASE {settings.DB_NAME}"))
+                try:
+                    conn.execute(text(f"CREATE DATABASE {settings.DB_NAME}"))
+                except (ProgrammingError, IntegrityError) as e:
+                    # База создана другим процессом, запущенным одновременно
+                    # (duplicate_database или unique_violation в pg_database)
+                    if getattr(e.orig, "pgcode", None) not in ("42P04", "23505"):
+                        raise
                 return True
             return True
             
@@ -65,13 +95,66 @@ def check_and_create_postgres_db() -> bool:
         if 'temp_engine' in locals():
             temp_engine.dispose()
 
+# Счётчики пула соединений (для подбора DB_POOL_SIZE под нагрузкой)
+_pool_stats_lock = threading.Lock()
+_pool_stats = {
+    "connects": 0,           # Открыто физических соединений
+    "checkouts": 0,          # Выдано соединений из пула
+    "checkins": 0,           # Возвращено соединений в пул
+    "invalidations": 0,      # Соединений признано неработоспособными
+    "timeouts": 0,           # Превышений DB_POOL_TIMEOUT при ожидании соединения
+    "wait_count": 0,         # Измеренных ожиданий соединения
+    "wait_total_ms": 0.0,    # Суммарное время ожидания соединения
+    "wait_max_ms": 0.0       # Максимальное время ожидания соединения
+}
+
+def _increment_pool_stat(name: str):
+    with _pool_stats_lock:
+        _pool_stats[name] += 1
+
+# Подписывается на события пула, чтобы считать выдачу и возврат соединений
+def _register_pool_events(engine):
+    event.listen(engine, "connect", lambda *args: _increment_pool_stat("connects"))
+    event.listen(engine, "checkout", lambda *args: _increment_pool_stat("checkouts"))
+    event.listen(engine, "checkin", lambda *args: _increment_pool_stat("checkins"))
+    event.listen(engine, "invalidate", lambda *args: _increment_pool_stat("invalidations"))
+
+# Учитывает время ожидания соединения из пула
+def _record_pool_wait(seconds: float):
+    wait_ms = seconds * 1000
+    with _pool_stats_lock:
+        _pool_stats["wait_count"] += 1
+        _pool_stats["wait_total_ms"] += wait_ms
+        _pool_stats["wait_max_ms"] = max(_pool_stats["wait_max_ms"], wait_ms)
+
+# Возвращает текущее состояние пула и накопленные счётчики
+# (пул асинхронного движка, через который идут запросы API)
+def get_pool_stats() -> dict:
+    with _pool_stats_lock:
+        stats = dict(_pool_stats)
+    stats["wait_avg_ms"] = stats["wait_total_ms"] / stats["wait_count"] if stats["wait_count"] else 0.0
+    if _async_engine is not None:
+        pool = _async_engine.sync_engine.pool
+        stats.update({
+            "pool_size": pool.size(),
+            "checked_in": pool.checkedin(),
+            "checked_out": pool.checkedout(),
+            "overflow": pool.overflow(),
+            "max_overflow": settings.DB_MAX_OVERFLOW
+        })
+    return stats
+
 # Возвращает engine для работы с указанной базой данных
 def get_database_engine():
     try:
         engine = create_engine(
             get_db_url(),
             pool_pre_ping=True,
-            echo=True,
+            pool_size=settings.DB_POOL_SIZE,
+            max_overflow=settings.DB_MAX_OVERFLOW,
+            pool_timeout=settings.DB_POOL_TIMEOUT,
+            pool_recycle=settings.DB_POOL_RECYCLE,
+            echo=settings.DB_ECHO,
             isolation_level="READ COMMITTED"  # Явно устанавливаем уровень изоляции
         )
         # Проверяем соединение без создания транзакции
@@ -88,6 +171,8 @@ def get_database_engine():
 
 _engine = None
 SessionLocal = None
+_async_engine = None
+AsyncSessionLocal = None
 
 def init_db():
     global _engine, SessionLocal
@@ -98,581 +183,228 @@ def init_db():
 def get_engine():
     return _engine
 
-# Создает объекты в базе данных через raw SQL
-def create_tables():
+# Создаёт асинхронный engine (asyncpg) с настройками пула из config, без подключения
+def _create_async_engine(url: str):
+    return create_async_engine(
+        url,
+        pool_pre_ping=True,
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        pool_timeout=settings.DB_POOL_TIMEOUT,
+        pool_recycle=settings.DB_POOL_RECYCLE,
+        echo=settings.DB_ECHO,
+        isolation_level="READ COMMITTED"
+    )
+
+# Возвращает асинхронный engine (asyncpg) с настройками пула из config
+async def get_async_database_engine():
+    try:
+        engine = _create_async_engine(get_async_db_url())
+        _register_pool_events(engine.sync_engine)
+        async with engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+        return engine
+    except Exception as e:
+        print(f"Ошибка подключения к базе данных (asyncpg): {e}")
+        return None
+
+# Создаёт асинхронный движок и фабрику сессий для обработчиков API
+async def init_async_db():
+    global _async_engine, AsyncSessionLocal
+    _async_engine = await get_async_database_engine()
+    if _async_engine is None:
+        raise RuntimeError("Async database engine not initialized")
+    # expire_on_commit=False: после commit объекты не перечитываются неявным (синхронным) запросом
+    AsyncSessionLocal = async_sessionmaker(_async_engine, expire_on_commit=False, autoflush=False)
+    init_replicas()
+    return _async_engine
+
+# Закрывает соединения асинхронного пула при остановке приложения
+async def close_async_db():
+    global _async_engine, AsyncSessionLocal
+    if _async_engine is not None:
+        await _async_engine.dispose()
+    for replica in _replicas:
+        await replica["engine"].dispose()
+    _replicas.clear()
+    _async_engine = None
+    AsyncSessionLocal = None
+
+# Реплики для чтения: engine, фабрика сессий и результат последней проверки отставания
+_replicas = []
+_replica_next = 0
+_replica_stats = {
+    "replica_reads": 0,      # Сессий чтения, открытых на реплике
+    "primary_reads": 0,      # Сессий чтения, отправленных на основной сервер (нет подходящей реплики)
+    "lag_checks": 0,         # Проверок отставания реплик
+    "lag_check_errors": 0    # Проверок, завершившихся ошибкой (реплика недоступна)
+}
+
+# Отставание реплики в секундах: 0, если реплика применила весь полученный WAL
+# (иначе простаивающий основной сервер выглядел бы как растущее отставание);
+# сервер не в режиме восстановления считается актуальным
+REPLICA_LAG_SQL = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+"""
+
+# Создаёт движки реплик из DB_REPLICA_URLS; подключение откладывается до первой проверки,
+# поэтому недоступная реплика не мешает запуску приложения
+def init_replicas():
+    for url in get_replica_urls():
+        engine = _create_async_engine(url)
+        _replicas.append({
+            "name": f"{engine.url.host}:{engine.url.port or 5432}/{engine.url.database}",
+            "engine": engine,
+            "sessionmaker": async_sessionmaker(engine, expire_on_commit=False, autoflush=False),
+            "healthy": False,
+            "lag": None,
+            "checked_at": None,
+            "lock": asyncio.Lock()
+        })
+
+def _increment_replica_stat(name: str):
+    with _pool_stats_lock:
+        _replica_stats[name] += 1
+
+# Измеряет отставание реплики, если с прошлой проверки прошло больше DB_REPLICA_CHECK_INTERVAL
+# Пока одна проверка выполняется, остальные запросы используют её предыдущий результат
+async def _check_replica(replica: dict):
+    checked_at = replica["checked_at"]
+    if checked_at is not None and time.monotonic() - checked_at < settings.DB_REPLICA_CHECK_INTERVAL:
+        return
+    if replica["lock"].locked():
+        return
+    async with replica["lock"]:
+        _increment_replica_stat("lag_checks")
+        try:
+            lag = await asyncio.wait_for(_fetch_replica_lag(replica["engine"]), settings.DB_REPLICA_CHECK_TIMEOUT)
+            replica["lag"] = float(lag)
+            replica["healthy"] = replica["lag"] <= settings.DB_REPLICA_MAX_LAG
+            if not replica["healthy"]:
+                logger.warning(f"Реплика {replica['name']} отстаёт на {replica['lag']:.1f} с, чтение с основного сервера")
+        except Exception as e:
+            _increment_replica_stat("lag_check_errors")
+            replica["lag"] = None
+            replica["healthy"] = False
+            logger.warning(f"Реплика {replica['name']} недоступна: {e}")
+        replica["checked_at"] = time.monotonic()
+
+async def _fetch_replica_lag(engine):
+    async with engine.connect() as conn:
+        return (await conn.execute(text(REPLICA_LAG_SQL))).scalar()
+
+# Выбирает реплику по кругу среди доступных и не отстающих больше DB_REPLICA_MAX_LAG
+async def _pick_replica():
+    global _replica_next
+    for offset in range(len(_replicas)):
+        index = (_replica_next + offset) % len(_replicas)
+        replica = _replicas[index]
+        await _check_replica(replica)
+        if replica["healthy"]:
+            _replica_next = (index + 1) % len(_replicas)
+            return replica
+    return None
+
+# Открывает асинхронную сессию только для чтения: на реплике, а если подходящей нет
+# (не настроены, недоступны или отстают) - на основном сервере
+async def new_async_read_session() -> AsyncSession:
+    replica = await _pick_replica() if _replicas else None
+    if replica is not None:
+        db = replica["sessionmaker"]()
+        db.info["replica"] = replica["name"]
+        try:
+            await db.connection()
+            _increment_replica_stat("replica_reads")
+            return db
+        except (OperationalError, OSError) as e:
+            # Реплика стала недоступна после проверки: исключаем её до следующей проверки
+            await db.close()
+            replica["healthy"] = False
+            replica["checked_at"] = time.monotonic()
+            logger.warning(f"Реплика {replica['name']} недоступна: {e}")
+    _increment_replica_stat("primary_reads")
+    return new_async_session()
+
+# Признак сессии, открытой на реплике (данные могут отставать от основного сервера)
+def is_replica_session(db: AsyncSession) -> bool:
+    return "replica" in db.info
+
+# Возвращает состояние реплик и счётчики маршрутизации чтения
+def get_replica_stats() -> dict:
+    with _pool_stats_lock:
+        stats = dict(_replica_stats)
+    now = time.monotonic()
+    stats["replicas"] = [
+        {
+            "name": replica["name"],
+            "healthy": replica["healthy"],
+            "lag_seconds": replica["lag"],
+            "checked_seconds_ago": None if replica["checked_at"] is None else now - replica["checked_at"]
+        }
+        for replica in _replicas
+    ]
+    return stats
+
+# Создает объекты в базе данных: применяет недостающие миграции схемы (migrations.py)
+def create_tables() -> int:
 
     engine = get_engine()
     if engine is None:
         raise RuntimeError("Database engine not initialized")
-    
-    tables_sql = [
-        """
-        -- Добавляем расширение работы с UUID
-        CREATE EXTENSION IF NOT EXISTS "uuid-ossp";
-        """,
-        """
-        -- Добавляем расширение криптографические функции
-        CREATE EXTENSION IF NOT EXISTS "pgcrypto";
-        """,
-        """
-        -- 1. Создание схемы (если не существует)
-        DO $$
-        BEGIN
-            IF NOT EXISTS (
-                SELECT 1 FROM information_schema.schemata
-                WHERE schema_name = 'antivirus'
-            ) THEN
-                CREATE SCHEMA antivirus;
-                COMMENT ON SCHEMA antivirus IS 'Схема для антивирусного API';
-                RAISE NOTICE 'Схема antivirus создана';
-            ELSE
-                RAISE NOTICE 'Схема antivirus уже существует';
-            END IF;
-        END
-        $$;
-        """,
-        """
-        -- 2. Создание таблицы файлов
-        CREATE TABLE IF NOT EXISTS antivirus.files (
-            id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
-            name TEXT NOT NULL,
-            content BYTEA NOT NULL,
-            size INT NOT NULL,
-            scan_result JSONB,
-            created_at TIMESTAMP NOT NULL DEFAULT NOW(),
-            updated_at TIMESTAMP NOT NULL DEFAULT NOW()
-        );
-        COMMENT ON TABLE antivirus.files IS 'Загруженные файлы';
-        COMMENT ON COLUMN antivirus.files.id IS 'Id файла в формате UUID';
-        COMMENT ON COLUMN antivirus.files.name IS 'Имя файла';
-        COMMENT ON COLUMN antivirus.files.content IS 'Содержание файла';
-        COMMENT ON COLUMN antivirus.files.size IS 'Размер файла';
-        COMMENT ON COLUMN antivirus.files.scan_result IS 'Результат сканирования с разными сигнатурами';
-        COMMENT ON COLUMN antivirus.files.created_at IS 'Дата и время добавления файла';
-        COMMENT ON COLUMN antivirus.files.updated_at IS 'Дата и время изменения файла';
-        """,
-        """
-        -- 3. Создание таблицы сигнатур
-        CREATE TABLE IF NOT EXISTS antivirus.signatures (
-            id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
-            threat_name TEXT NOT NULL,
-            first_bytes VARCHAR(8) NOT NULL,
-            remainder_hash VARCHAR(64) NOT NULL,
-            remainder_length INT NOT NULL,
-            file_type TEXT NOT NULL,
-            offset_start INT,
-            offset_end INT,
-            digital_signature BYTEA DEFAULT NULL,
-            status TEXT NOT NULL DEFAULT 'ACTUAL',
-            updated_at TIMESTAMP NOT NULL DEFAULT NOW()
-        );
-        COMMENT ON TABLE antivirus.signatures IS 'Антивирусные сигнатуры';
-        COMMENT ON COLUMN antivirus.signatures.id IS 'id сигнатуры в формате UUID';
-        COMMENT ON COLUMN antivirus.signatures.threat_name IS 'Название угрозы';
-        COMMENT ON COLUMN antivirus.signatures.first_bytes IS 'Первые 8 байт';
-        COMMENT ON COLUMN antivirus.signatures.remainder_hash IS 'Хэш хвоста';
-        COMMENT ON COLUMN antivirus.signatures.remainder_length IS 'Длина хвоста';
-        COMMENT ON COLUMN antivirus.signatures.file_type IS 'Тип файла';
-        COMMENT ON COLUMN antivirus.signatures.offset_start IS 'Смещение начала сигнатуры';
-        COMMENT ON COLUMN antivirus.signatures.offset_end IS 'Смещение конца сигнатуры';
-        COMMENT ON COLUMN antivirus.signatures.digital_signature IS 'ЭЦП';
-        COMMENT ON COLUMN antivirus.signatures.status IS 'Статус записи';
-        COMMENT ON COLUMN antivirus.signatures.updated_at IS 'Время изменения записи';
-        """,
-        """
-        -- 4. Создаем таблицу history
-        CREATE TABLE IF NOT EXISTS antivirus.history (
-            history_id BIGSERIAL PRIMARY KEY,
-            version_created_at  TIMESTAMP NOT NULL
-        ) INHERITS (antivirus.signatures);
-        
-        COMMENT ON TABLE antivirus.history IS 'Изменения таблицы antivirus.signatures';
-        COMMENT ON COLUMN antivirus.history.history_id  IS 'Уникальный идентификатор записи в истории';
-        COMMENT ON COLUMN antivirus.history.version_created_at  IS 'Момент времени, когда появилась эта версия';
-        """,
-        """
-        -- 5. Создаем таблицу audit
-        CREATE TABLE IF NOT EXISTS antivirus.audit
-        (
-            audit_id SERIAL PRIMARY KEY,
-            signature_id UUID NOT NULL REFERENCES antivirus.signatures(id) MATCH SIMPLE ON UPDATE CASCADE ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED,
-            changed_by	TEXT NOT NULL DEFAULT SESSION_USER,
-            change_type	TEXT,
-            changed_at TIMESTAMP NOT NULL DEFAULT Now(),
-            fields_changed JSONB
-        );
-        COMMENT ON TABLE antivirus.audit IS 'Таблица аудита';
-        COMMENT ON COLUMN antivirus.audit.audit_id IS 'Уникальный идентификатор записи в аудите';
-        COMMENT ON COLUMN antivirus.audit.signature_id IS 'Ссылка на запись в таблице сигнатур';
-        COMMENT ON COLUMN antivirus.audit.changed_by IS 'Указатель на пользователя, совершившего изменение';
-        COMMENT ON COLUMN antivirus.audit.change_type IS 'Тип изменения (CREATED, UPDATED, DELETED, CORRUPTED и т.д.)';
-        COMMENT ON COLUMN antivirus.audit.changed_at IS 'Время, когда произошло изменение';
-        COMMENT ON COLUMN antivirus.audit.fields_changed IS 'Список изменённых полей, можно хранить в виде JSON';
-        """,
-        """
-        CREATE OR REPLACE FUNCTION antivirus.files_iud( _name TEXT DEFAULT NULL, _content BYTEA DEFAULT NULL, _scan_result JSON DEFAULT NULL, _id UUID DEFAULT NULL)
-          RETURNS uuid AS
-        $BODY$
-            DECLARE
-            uid UUID;
-        BEGIN
-                if _id isnull then
-                    if _name isnull and _content isnull then
-                        raise exception 'Не указано имя файла или его содержимое';
-                    end if;
-                    insert into antivirus.files(name, content, size)
-                        values(_name, _content, octet_length(_content))
-                    returning id into uid;
-                    return uid;
-                end if;
-
-                if _name notnull then
-                    update antivirus.files set
-                        name = CASE
-                                WHEN _name isnull or _name = name THEN name
-                                ELSE _name END
-                    where id = _id;
-                end if;
-
-                if _content notnull then
-                    update antivirus.files set
-                        content = CASE
-                                WHEN _content isnull or _content = content THEN content
-                                ELSE _content END,
-                        size = CASE
-                                WHEN _content isnull THEN size
-                                ELSE octet_length(_content) END
-                    where id = _id;
-                end if;
-
-                if _scan_result notnull then
-                    update antivirus.files set
-                        scan_result = CASE
-                                      WHEN _scan_result isnull or _scan_result = scan_result THEN scan_result
-                                      ELSE _scan_result END
-                    where id = _id;
-                end if;
-
-                if _name isnull and _content isnull and _scan_result isnull then
-                    delete from antivirus.files where id = _id;
-                end if;
-
-                return _id;
-        END
-        $BODY$
-        LANGUAGE plpgsql VOLATILE
-        COST 100;
-
-        COMMENT ON FUNCTION antivirus.files_iud(TEXT, BYTEA, JSON, UUID) IS 'Функция записи/обновления/удаления файла';
-        """,
-        """
-        -- DROP FUNCTION IF EXISTS antivirus.scan_file_with_rabin_karp(UUID,UUID);
-        CREATE OR REPLACE FUNCTION antivirus.scan_file_with_rabin_karp(
-            p_file_id UUID,                  -- id файла для сканирования
-            p_signature_id UUID DEFAULT NULL -- id сигнатуры для сканирования, если NULL, то сканируем всеми сигнатурами
-        ) RETURNS JSONB AS $$
-        DECLARE
-            v_file_content BYTEA;               -- Содержимое файла в бинарном формате
-            v_file_size INT;                    -- Размер файла в байтах
-            v_scan_result JSONB := '[]'::JSONB; -- Результаты сканирования
-            v_signature_record RECORD;          -- Данные текущей сигнатуры
-            v_base BIGINT := 256;               -- Основание для полиномиального хэша
-            v_mod BIGINT := 1000000007;         -- Модуль для хэш-функции
-            v_power BIGINT := 1;                -- base^(window_size-1) mod mod
-            v_target_hash BIGINT;               -- Хэш первых байт сигнатуры
-            v_current_hash BIGINT := 0;         -- Текущий хэш скользящего окна
-            v_window_size INT;                  -- Размер окна сравнения (определяется динамически)
-            v_i INT;                            -- Счетчики циклов
-            v_j INT;
-            v_match_found BOOLEAN;              -- Флаг совпадения
-            v_remainder_content BYTEA;          -- Хвост сигнатуры из файла
-            v_remainder_hash TEXT;              -- MD5 хэш хвоста
-            v_offset_start INT;                 -- Смещение начала сигнатуры
-            v_offset_end INT;                   -- Смещение конца сигнатуры
-            v_result_entry JSONB;               -- Запись результата
-            v_file_info_json JSONB;               -- Возврат результата
-            v_cursor CURSOR FOR                 -- Курсор для выборки сигнатур
-                SELECT * FROM ONLY antivirus.signatures
-                WHERE status = 'ACTUAL'
-                AND (p_signature_id IS NULL OR id = p_signature_id);
-        BEGIN
-            -- Получаем содержимое файла
-            SELECT content, size INTO v_file_content, v_file_size
-            FROM antivirus.files
-            WHERE id = p_file_id;
-
-            IF NOT FOUND THEN
-                RAISE EXCEPTION 'Файл с ID % не найден', p_file_id;
-            END IF;
-
-            -- Перебираем все сигнатуры (или конкретную)
-            FOR v_signature_record IN v_cursor LOOP
-                -- Определяем размер окна по длине first_bytes
-                v_window_size := length(v_signature_record.first_bytes);
-
-                -- Пересчитываем power для текущего размера окна
-                v_power := 1;
-                FOR i IN 1..(v_window_size-1) LOOP
-                    v_power := (v_power * v_base) % v_mod;
-                END LOOP;
-
-                -- Вычисляем хэш первых байт сигнатуры
-                v_target_hash := 0;
-                FOR i IN 1..v_window_size LOOP
-                    IF i <= length(v_signature_record.first_bytes) THEN
-                        v_target_hash := (v_target_hash * v_base + ascii(substring(v_signature_record.first_bytes from i for 1))) % v_mod;
-                    END IF;
-                END LOOP;
-
-                -- Ищем вхождение первых байт в файле
-                v_offset_start := position(v_signature_record.first_bytes::bytea in v_file_content);
-
-                IF v_offset_start > 0 THEN
-                    -- Проверяем остаток сигнатуры
-                    v_remainder_content := substring(v_file_content
-                        from v_offset_start + v_window_size
-                        for v_signature_record.remainder_length);
-
-                    v_remainder_hash := md5(v_remainder_content);
-
-                    -- Проверяем совпадение хэша остатка
-                    v_match_found := (v_remainder_hash = v_signature_record.remainder_hash);
-
-                    -- Проверяем смещения
-                    IF v_match_found AND v_signature_record.offset_start IS NOT NULL THEN
-                        v_offset_start := v_offset_start - 1; -- преобразуем в 0-based индекс
-                        v_offset_end := v_offset_start + v_window_size + v_signature_record.remainder_length - 1;
-
-                        IF v_offset_start < v_signature_record.offset_start OR
-                           (v_signature_record.offset_end IS NOT NULL AND
-                            v_offset_end > v_signature_record.offset_end) THEN
-                            v_match_found := FALSE;
-                        END IF;
-                    END IF;
-                ELSE
-                    v_match_found := FALSE;
-                END IF;
-
-                -- Формируем запись результата
-                v_result_entry := jsonb_build_object(
-                    'signatureId', v_signature_record.id,
-                    'threatName', v_signature_record.threat_name,
-                    'offsetFromStart', CASE WHEN v_match_found THEN (v_offset_start) ELSE NULL END,
-                    'offsetFromEnd', CASE WHEN v_match_found THEN
-                        (v_offset_start + v_window_size + v_signature_record.remainder_length)
-                        ELSE NULL END,
-                    'matched', v_match_found
-                );
-
-                -- Добавляем запись в результаты
-                v_scan_result := v_scan_result || v_result_entry;
-            END LOOP;
-
-            -- Сохраняем результаты сканирования
-            UPDATE antivirus.files
-            SET scan_result = v_scan_result,
-                updated_at = NOW()
-            WHERE id = p_file_id;
-            -- Получения данных таблицы для возврата результата из функции
-            SELECT
-                json_build_object(
-                    'id', id,
-                    'name', name,
-                    'size', size,
-                    'scan_result', scan_result,
-                    'created_at', created_at,
-                    'updated_at', updated_at
-                ) as file_info INTO v_file_info_json
-            FROM antivirus.files
-            WHERE id = p_file_id;
-
-            RETURN v_file_info_json;
-        END;
-        $$ LANGUAGE plpgsql
-        COST 100;
-
-        COMMENT ON FUNCTION antivirus.scan_file_with_rabin_karp(UUID, UUID) IS 'Функция сканирования файлов с алгоритмом Рабина-Карпа';
-        """,
-        """
-        -- DROP FUNCTION IF EXISTS antivirus.signatures_iud(JSON);
-        CREATE OR REPLACE FUNCTION antivirus.signatures_iud(p_data JSON)
-        RETURNS UUID AS $$
-        DECLARE
-            v_id UUID;
-            v_threat_name TEXT;
-            v_first_bytes VARCHAR(8);
-            v_remainder_hash VARCHAR(64);
-            v_remainder_length INT;
-            v_file_type TEXT;
-            v_offset_start INT;
-            v_offset_end INT;
-            v_digital_signature BYTEA;
-            v_status TEXT;
-            v_record_exists BOOLEAN;
-            v_keys TEXT[];
-        BEGIN
-            -- Извлекаем ID из JSON (может быть NULL для новой записи)
-            v_id := (p_data->>'id')::UUID;
-
-            -- Проверяем, существует ли запись с таким ID
-            IF v_id IS NOT NULL THEN
-                SELECT EXISTS(SELECT 1 FROM ONLY antivirus.signatures WHERE id = v_id) INTO v_record_exists;
-            ELSE
-                v_record_exists := FALSE;
-            END IF;
-
-            -- Получаем ключи JSON как массив
-            SELECT array_agg(key) INTO v_keys FROM jsonb_object_keys(p_data::jsonb) AS key;
-
-            -- Если ID не указан или запись не существует - создаем новую
-            IF v_id IS NULL OR NOT v_record_exists THEN
-                -- Проверяем обязательные поля для создания новой записи
-                IF NOT (p_data::jsonb ? 'threat_name' AND
-                        p_data::jsonb ? 'first_bytes' AND
-                        p_data::jsonb ? 'remainder_hash' AND
-                        p_data::jsonb ? 'remainder_length' AND
-                        p_data::jsonb ? 'file_type') THEN
-                    RAISE EXCEPTION 'Для создания новой сигнатуры необходимо указать threat_name, first_bytes, remainder_hash, remainder_length и file_type';
-                END IF;
-
-                -- Извлекаем значения из JSON
-                v_threat_name := p_data->>'threat_name';
-                v_first_bytes := p_data->>'first_bytes';
-                v_remainder_hash := p_data->>'remainder_hash';
-                v_remainder_length := (p_data->>'remainder_length')::INT;
-                v_file_type := p_data->>'file_type';
-                v_offset_start := (p_data->>'offset_start')::INT;
-                v_offset_end := (p_data->>'offset_end')::INT;
-                v_status := COALESCE(p_data->>'status', 'ACTUAL');
-
-                -- Вставляем новую запись
-                INSERT INTO antivirus.signatures (
-                    id,
-                    threat_name,
-                    first_bytes,
-                    remainder_hash,
-                    remainder_length,
-                    file_type,
-                    offset_start,
-                    offset_end,
-                    status,
-                    updated_at
-                ) VALUES (
-                    COALESCE(v_id, gen_random_uuid()),
-                    v_threat_name,
-                    v_first_bytes,
-                    v_remainder_hash,
-                    v_remainder_length,
-                    v_file_type,
-                    v_offset_start,
-                    v_offset_end,
-                    v_status,
-                    NOW()
-                ) RETURNING id INTO v_id;
-
-            -- Если указан только ID - удаляем запись
-            ELSEIF array_length(v_keys, 1) = 1 AND v_keys[1] = 'id' THEN
-                DELETE FROM ONLY antivirus.signatures WHERE id = v_id;
-
-            -- Если запись существует и есть поля для обновления
-            ELSE
-                -- Формируем динамический UPDATE с учетом только переданных полей
-                EXECUTE format('
-                    UPDATE ONLY antivirus.signatures SET
-                        threat_name = COALESCE(%L, threat_name),
-                        first_bytes = COALESCE(%L, first_bytes),
-                        remainder_hash = COALESCE(%L, remainder_hash),
-                        remainder_length = COALESCE(%L, remainder_length),
-                        file_type = COALESCE(%L, file_type),
-                        offset_start = COALESCE(%L, offset_start),
-                        offset_end = COALESCE(%L, offset_end),
-                        status = COALESCE(%L, status),
-                        updated_at = NOW()
-                    WHERE id = %L
-                    RETURNING id',
-                    p_data->>'threat_name',
-                    p_data->>'first_bytes',
-                    p_data->>'remainder_hash',
-                    (p_data->>'remainder_length')::INT,
-                    p_data->>'file_type',
-                    (p_data->>'offset_start')::INT,
-                    (p_data->>'offset_end')::INT,
-                    p_data->>'status',
-                    v_id
-                ) INTO v_id;
-            END IF;
-
-            RETURN v_id;
-        END;
-        $$ LANGUAGE plpgsql;
-
-        COMMENT ON FUNCTION antivirus.signatures_iud(JSON) IS 'Функция для добавления/изменения/удаления записей в таблице signatures на основе входного JSON';
-        """,
-        """
-        --DROP FUNCTION IF EXISTS antivirus.trf_signatures_history_biud() CASCADE;
-        CREATE OR REPLACE FUNCTION antivirus.trf_signatures_history_biud()
-          RETURNS trigger AS
-        $BODY$
-        DECLARE
-        BEGIN
-
-        IF TG_OP = 'DELETE' THEN
-            -- при удалении не удаляем запись, а обновляем status на DELETED, пишем новое время действия
-            UPDATE ONLY antivirus.signatures
-                SET status = 'DELETED',
-                    updated_at = clock_timestamp()
-            WHERE id = OLD.id;
-            -- с текущей записью больше ничего не делаем
-            RETURN NULL;
-        ELSIF TG_OP = 'UPDATE' THEN
-            IF NEW.status = 'DELETED' AND OLD.status = 'DELETED' THEN
-                RAISE EXCEPTION 'Невозможно обновить удалённую запись без восстановления.';
-            END IF;
-            -- предотвращаем срабатывание триггера на пустые обновления
-            IF  NEW.id IS DISTINCT FROM OLD.id OR
-                NEW.threat_name IS DISTINCT FROM OLD.threat_name OR
-                NEW.first_bytes IS DISTINCT FROM OLD.first_bytes OR
-                NEW.remainder_hash IS DISTINCT FROM OLD.remainder_hash OR
-                NEW.remainder_length IS DISTINCT FROM OLD.remainder_length OR
-                NEW.file_type IS DISTINCT FROM OLD.file_type OR
-                NEW.offset_start IS DISTINCT FROM OLD.offset_start OR
-                NEW.offset_end IS DISTINCT FROM OLD.offset_end OR
-                NEW.digital_signature IS DISTINCT FROM OLD.digital_signature OR
-                NEW.status IS DISTINCT FROM OLD.status
-            THEN
-                -- при обновлении пишем новое время действия
-                NEW.updated_at := clock_timestamp();
-                -- вставляем в history предыдущее состояние
-                -- поле version_created_at - время предыдущего действия, поэтому берём его из OLD.updated_at
-                INSERT INTO antivirus.history (id, threat_name, first_bytes, remainder_hash, remainder_length, file_type
-                                        , offset_start, offset_end, digital_signature, status, updated_at, version_created_at)
-                SELECT OLD.id, OLD.threat_name, OLD.first_bytes, OLD.remainder_hash, OLD.remainder_length, OLD.file_type
-                     , OLD.offset_start, OLD.offset_end, OLD.digital_signature, OLD.status, OLD.updated_at, OLD.updated_at;
-                -- записываем новое состояние
-                RETURN NEW;
-            END IF;
-
-            RETURN NULL;
-        ELSIF TG_OP = 'INSERT' THEN
-            -- при вставке предыдущего значения нет в history ничего не пишем
-            RETURN NEW;
-        END IF;
-
-        END;
-        $BODY$
-          LANGUAGE plpgsql VOLATILE
-          COST 100;
-
-        COMMENT ON FUNCTION antivirus.trf_signatures_history_biud() IS 'Триггерная функция версионировании записей таблицы antivirus.signatures';
-        """,
-        """
-        DROP TRIGGER IF EXISTS tr_signatures_history_biud ON antivirus.signatures;
-        CREATE TRIGGER tr_signatures_history_biud
-          BEFORE INSERT OR UPDATE OR DELETE
-          ON antivirus.signatures
-          FOR EACH ROW
-          EXECUTE PROCEDURE antivirus.trf_signatures_history_biud();
-          
-        COMMENT ON TRIGGER tr_signatures_history_biud ON antivirus.signatures IS 'Триггер версионировании записей таблицы antivirus.signatures';
-        """,
-        """
-        --DROP FUNCTION IF EXISTS antivirus.trf_signatures_history_biud() CASCADE;
-        CREATE OR REPLACE FUNCTION antivirus.trf_audit_aiu()
-          RETURNS trigger AS
-        $BODY$
-        DECLARE
-            new_row jsonb := '{}';
-            old_row jsonb := '{}';
-        BEGIN
-
-        IF TG_OP = 'UPDATE' THEN
-            -- обрабатываем удаление записи
-            IF NEW.status = 'DELETED' THEN
-                INSERT INTO antivirus.audit (signature_id, changed_by, change_type, changed_at, fields_changed)
-                VALUES (NEW.id, DEFAULT, 'DELETED', NEW.updated_at, json_build_object('NEW', null, 'OLD', row_to_json(NEW)));
-            ELSE
-                -- добавляем только изменённые поля
-                IF NEW.id IS DISTINCT FROM OLD.id THEN
-                    SELECT old_row || jsonb_build_object('id', OLD.id), new_row || jsonb_build_object('id', NEW.id) INTO old_row, new_row;
-                END IF;
-                IF NEW.threat_name IS DISTINCT FROM OLD.threat_name THEN
-                    SELECT old_row || jsonb_build_object('threat_name', OLD.threat_name), new_row || jsonb_build_object('threat_name', NEW.threat_name) INTO old_row, new_row;
-                END IF;
-                IF NEW.first_bytes IS DISTINCT FROM OLD.first_bytes THEN
-                    SELECT old_row || jsonb_build_object('first_bytes', OLD.first_bytes), new_row || jsonb_build_object('first_bytes', NEW.first_bytes) INTO old_row, new_row;
-                END IF;
-                IF NEW.remainder_hash IS DISTINCT FROM OLD.remainder_hash THEN
-                    SELECT old_row || jsonb_build_object('remainder_hash', OLD.remainder_hash), new_row || jsonb_build_object('remainder_hash', NEW.remainder_hash) INTO old_row, new_row;
-                END IF;
-                IF NEW.remainder_length IS DISTINCT FROM OLD.remainder_length THEN
-                    SELECT old_row || jsonb_build_object('remainder_length', OLD.remainder_length), new_row || jsonb_build_object('remainder_length', NEW.remainder_length) INTO old_row, new_row;
-                END IF;
-                IF NEW.file_type IS DISTINCT FROM OLD.file_type THEN
-                    SELECT old_row || jsonb_build_object('file_type', OLD.file_type), new_row || jsonb_build_object('file_type', NEW.file_type) INTO old_row, new_row;
-                END IF;
-                IF NEW.offset_start IS DISTINCT FROM OLD.offset_start THEN
-                    SELECT old_row || jsonb_build_object('offset_start', OLD.offset_start), new_row || jsonb_build_object('offset_start', NEW.offset_start) INTO old_row, new_row;
-                END IF;
-                IF NEW.offset_end IS DISTINCT FROM OLD.offset_end THEN
-                    SELECT old_row || jsonb_build_object('offset_end', OLD.offset_end), new_row || jsonb_build_object('offset_end', NEW.offset_end) INTO old_row, new_row;
-                END IF;
-                IF NEW.digital_signature IS DISTINCT FROM OLD.digital_signature THEN
-                    SELECT old_row || jsonb_build_object('digital_signature', OLD.digital_signature), new_row || jsonb_build_object('digital_signature', NEW.digital_signature) INTO old_row, new_row;
-                END IF;
-                IF NEW.status IS DISTINCT FROM OLD.status THEN
-                    SELECT old_row || jsonb_build_object('status', OLD.status), new_row || jsonb_build_object('status', NEW.status) INTO old_row, new_row;
-                END IF;
-                IF NEW.updated_at IS DISTINCT FROM OLD.updated_at THEN
-                    SELECT old_row || jsonb_build_object('updated_at', OLD.updated_at), new_row || jsonb_build_object('updated_at', NEW.updated_at) INTO old_row, new_row;
-                END IF;
-                -- обрали изменённые данные, пишем в audit
-                INSERT INTO antivirus.audit (signature_id, changed_by, change_type, changed_at, fields_changed)
-                VALUES (OLD.id, DEFAULT, 'UPDATED', OLD.updated_at, json_build_object('NEW', new_row, 'OLD', old_row));
-            END IF;
-
-        ELSIF TG_OP = 'INSERT' THEN
-            -- пишем audit
-            INSERT INTO antivirus.audit (signature_id, changed_by, change_type, changed_at, fields_changed)
-            VALUES (NEW.id, DEFAULT, 'CREATED', NEW.updated_at, json_build_object('NEW', row_to_json(NEW), 'OLD', null));
-            -- обрабатываем вставку удалённой записи
-            IF NEW.status = 'DELETED' THEN
-                INSERT INTO antivirus.audit (signature_id, changed_by, change_type, changed_at, fields_changed)
-                VALUES (NEW.id, DEFAULT, 'DELETED', NEW.updated_at, json_build_object('NEW', null, 'OLD', row_to_json(NEW)));
-            END IF;
-        END IF;
-
-        RETURN NEW;
-        END;
-        $BODY$
-          LANGUAGE plpgsql VOLATILE
-          COST 100;
-
-        COMMENT ON FUNCTION antivirus.trf_audit_aiu() IS 'Триггерная функция аудита записей таблицы antivirus.signatures';
-        """,
-        """
-        DROP TRIGGER IF EXISTS tr_audit_aiu ON antivirus.signatures;
-        CREATE TRIGGER tr_audit_aiu
-          AFTER INSERT OR UPDATE
-          ON antivirus.signatures
-          FOR EACH ROW
-          EXECUTE PROCEDURE antivirus.trf_audit_aiu();
-
-        COMMENT ON TRIGGER tr_audit_aiu ON antivirus.signatures IS 'Триггер аудита записей таблицы antivirus.signatures';
-        """
-    ]
 
-    with engine.connect() as conn:
-        for sql in tables_sql:
-            conn.execute(text(sql))
-        conn.commit()
+    return apply_migrations(engine)
         
-# Генератор сессий для Dependency Injection
+# Генератор сессий для Dependency Injection (одна сессия на запрос)
 def get_db():
     db = SessionLocal()
     try:
+        # Берём соединение сразу, чтобы измерить ожидание свободного соединения в пуле
+        started = time.perf_counter()
+        try:
+            db.connection()
+        except PoolTimeoutError:
+            _increment_pool_stat("timeouts")
+            raise
+        _record_pool_wait(time.perf_counter() - started)
         yield db
     finally:
         db.close()
 
+# Открывает новую асинхронную сессию (для функций, вызываемых вне запроса)
+def new_async_session() -> AsyncSession:
+    if AsyncSessionLocal is None:
+        raise RuntimeError("Async database engine not initialized")
+    return AsyncSessionLocal()
+
+# Асинхронный генератор сессий для Dependency Injection (одна сессия на запрос)
+async def get_async_db():
+    db = new_async_session()
+    try:
+        # Берём соединение сразу, чтобы измерить ожидание свободного соединения в пуле
+        started = time.perf_counter()
+        try:
+            await db.connection()
+        except PoolTimeoutError:
+            _increment_pool_stat("timeouts")
+            raise
+        _record_pool_wait(time.perf_counter() - started)
+        yield db
+    finally:
+        await db.close()
+
+# Асинхронный генератор сессий только для чтения (реплика или основной сервер)
+async def get_async_read_db():
+    db = await new_async_read_session()
+    try:
+        yield db
+    finally:
+        await db.close()
+
 # Экспортируем Base для использования в моделях
-__all__ = ['Base', 'engine', 'get_db', 'create_tables', 'init_db']
+__all__ = ['Base', 'engine', 'get_db', 'get_async_db', 'new_async_session', 'init_async_db', 'close_async_db',
+           'get_async_read_db', 'new_async_read_session', 'is_replica_session', 'get_replica_stats',
+           'get_pool_stats', 'create_tables', 'init_db']
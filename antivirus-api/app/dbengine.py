@@ -1,23 +1,35 @@
 # dbengine.py
 # Модуль для работы с функциями в базе данных 
+# Все функции асинхронные (SQLAlchemy asyncio + asyncpg) и не блокируют цикл событий
 
 from pathlib import Path
-from typing import Optional, Union
-from uuid import UUID
-from sqlalchemy.orm import Session
+from typing import AsyncIterator, Optional, Union, Tuple
+from uuid import UUID, uuid4
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import text
-from database import get_db
-from sqlalchemy.exc import SQLAlchemyError, ProgrammingError, OperationalError
+from starlette.concurrency import run_in_threadpool
+from database import new_async_session, new_async_read_session, is_replica_session
+from archive import ArchiveLimits, ARCHIVE_SNIFF_HEAD, ARCHIVE_SNIFF_TAIL, sniff_archive_type, walk_archive
+from signature_cache import get_signature_snapshot, get_signature_snapshot_as_of, cached_signatures_json, scan_content_cached
+from sqlalchemy.exc import SQLAlchemyError, ProgrammingError, OperationalError, DBAPIError
 from sqlalchemy.dialects import postgresql
 from sqlalchemy.sql import compiler
 from psycopg2.extensions import adapt, quote_ident
 from psycopg2.sql import SQL, Identifier, Literal, Composed, Composable
 from sqlalchemy.sql import compiler
+import aiofiles
 import logging
 import json
+import os
+import re
+import tarfile
+import zipfile
+import zlib
 from typing import List
 from datetime import datetime
 
+logger = logging.getLogger(__name__)
+
 
 """
 Тестовая функция, показывает подготовленный SQL запрос к БД
@@ -52,21 +64,58 @@ def log_final_query(query, params):
 
     except Exception as e:
         print(f"SQL formatting error: {str(e)}")
+
+# Пустой результат списка: (JSON-массив, количество строк, ключ последней строки)
+EMPTY_JSON_LIST = ("[]", 0, None)
+
+"""
+Выполняет запрос списка и собирает строки в JSON-массив на стороне PostgreSQL (json_agg)
+Строки не декодируются в Python: готовый текст массива отдаётся в HTTP-ответ как есть
+Порядок ORDER BY подзапроса внешним агрегатам не передаётся, поэтому json_agg и ключ последней строки
+упорядочиваются по тому же ключу сортировки явно
+:param query: Запрос, возвращающий колонку item (json) и колонки ключа сортировки, с ORDER BY по keys
+:param keys: Колонки ключа сортировки (для курсора следующей страницы)
+:param descending: Направление сортировки всех колонок ключа в query
+:return: (JSON-массив текстом, количество строк, ключ последней строки списком или None)
+"""
+async def _fetch_json_list(
+    db: AsyncSession,
+    query: str,
+    params: dict,
+    keys: Tuple[str, ...],
+    descending: bool = False
+) -> Tuple[str, int, Optional[list]]:
+    last_key = ", ".join(f"page.{key}" for key in keys)
+    page_order = ", ".join(f"page.{key} {'DESC' if descending else 'ASC'}" for key in keys)
+    reverse_order = ", ".join(f"page.{key} {'ASC' if descending else 'DESC'}" for key in keys)
+    result = await db.execute(text(f"""
+        SELECT
+            coalesce(json_agg(page.item ORDER BY {page_order}), '[]')::text AS items,
+            count(*) AS row_count,
+            (array_agg(json_build_array({last_key}) ORDER BY {reverse_order}))[1]::text AS last_key
+        FROM ({query}) AS page
+    """), params)
+    row = result.one()
+    return row.items, row.row_count, json.loads(row.last_key) if row.last_key else None
 """
 Вызывает функцию antivirus.files_iud в PostgreSQL с автоматическим чтением файла если задан
 :param name: Имя файла
 :param file_path: Путь к файлу на диске (будет прочитан как bytes)
 :param scan_result: Результат сканирования в виде словаря
 :param file_id: UUID файла для обновления (None для создания нового)
+:param db: Сессия запроса (None - открыть собственную сессию)
 :return: UUID созданного или обновленного файла
 """
-def call_files_iud_function(
+async def call_files_iud_function(
     name: str = None,
     file_path: str = None,
     scan_result: dict = None,
-    file_id: UUID = None
+    file_id: UUID = None,
+    db: Optional[AsyncSession] = None
 ) -> UUID:
-    db = next(get_db())
+    own_session = db is None
+    if own_session:
+        db = new_async_session()
     try:
         # Читаем файл если передан путь
         content = None
@@ -77,8 +126,8 @@ def call_files_iud_function(
             if not file_path.is_file():
                 raise ValueError(f"Указанный путь не является файлом: {file_path}")
                 
-            with open(file_path, 'rb') as f:
-                content = f.read()
+            async with aiofiles.open(file_path, 'rb') as f:
+                content = await f.read()
 
         # Подготавливаем параметры (None значения передаются как есть)
         params = {
@@ -99,30 +148,87 @@ def call_files_iud_function(
         """)
 
         # Выполняем запрос
-        result = db.execute(query, params)
+        result = await db.execute(query, params)
         file_uuid = result.scalar()
-        db.commit()
+        await db.commit()
         print("File post DB: "+str(file_path)+" UUID Row: ", str(file_uuid))
         return file_uuid
         
     except SQLAlchemyError as e:
-        db.rollback()
+        await db.rollback()
+        raise SQLAlchemyError(f"Database error: {e}")
+    except Exception as e:
+        await db.rollback()
+        raise e
+    finally:
+        if own_session:
+            await db.close()
+"""
+Пакетно записывает файлы в antivirus.files одной транзакцией
+Строки вставляются пачками через unnest массивов, без вызова files_iud для каждого файла
+:param files: Список пар (имя файла, содержимое)
+:param batch_size: Количество строк в одном INSERT
+:param db: Сессия запроса (None - открыть собственную сессию)
+:return: Список UUID созданных файлов в порядке входного списка
+"""
+async def call_files_bulk_insert(
+    files: List[Tuple[str, bytes]],
+    batch_size: int = 500,
+    db: Optional[AsyncSession] = None
+) -> List[UUID]:
+    if not files:
+        return []
+    own_session = db is None
+    if own_session:
+        db = new_async_session()
+    try:
+        # UUID генерируем заранее, чтобы порядок результата совпадал с порядком файлов
+        file_ids = [uuid4() for _ in files]
+
+        query = text("""
+            INSERT INTO antivirus.files (id, name, content, size, content_hash)
+            SELECT t.id, t.name, t.content, octet_length(t.content), digest(t.content, 'sha256')
+            FROM unnest(
+                CAST(:ids AS uuid[]),
+                CAST(:names AS text[]),
+                CAST(:contents AS bytea[])
+            ) AS t(id, name, content)
+        """)
+
+        for start in range(0, len(files), batch_size):
+            batch = files[start:start + batch_size]
+            await db.execute(query, {
+                "ids": [str(file_id) for file_id in file_ids[start:start + batch_size]],
+                "names": [name for name, _ in batch],
+                "contents": [content for _, content in batch]
+            })
+
+        await db.commit()
+        logger.info(f"Bulk files inserted: {len(file_ids)}")
+        return file_ids
+
+    except SQLAlchemyError as e:
+        await db.rollback()
         raise SQLAlchemyError(f"Database error: {e}")
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise e
     finally:
-        db.close()
+        if own_session:
+            await db.close()
 """
 Получает информацию о файле (без содержимого) в виде JSON
 Args: file_id: UUID файла
+:param db: Сессия запроса (None - открыть собственную сессию чтения, на реплике, если она доступна)
 Returns: Словарь с информацией о файле или None если файл не найден
 """
-def get_file_info_json(file_id: UUID) -> Optional[dict]:
-    db = next(get_db())
+async def get_file_info_json(file_id: UUID, db: Optional[AsyncSession] = None) -> Optional[dict]:
+    own_session = db is None
+    if own_session:
+        db = await new_async_read_session()
     print("Input get_file_info_json")
     try:
-        result = db.execute(
+        result = await db.execute(
             text("""
                 SELECT 
                     json_build_object(
@@ -139,52 +245,201 @@ def get_file_info_json(file_id: UUID) -> Optional[dict]:
             {"id": file_id}
         )
         row = result.fetchone()
+        if row is None and is_replica_session(db):
+            # Файл мог быть загружен только что и ещё не дошёл до реплики: перечитываем с основного сервера
+            async with new_async_session() as primary:
+                return await get_file_info_json(file_id, primary)
         print("Get file: ", file_id)
         return row[0] if row else None
     except SQLAlchemyError as e:
-        db.rollback()
+        await db.rollback()
         raise
     finally:
-        db.close()
+        if own_session:
+            await db.close()
 """
-Получает информацию о всех файлах (без содержимого) в виде JSON
-"""        
-def get_all_files_json() -> Optional[List[dict]]:
-    db = next(get_db())
-    print("Input get_all_files_json")
+Получает время последнего изменения файла для ETag без чтения остальных полей
+:param file_id: UUID файла
+:param db: Сессия запроса (None - открыть собственную сессию чтения, на реплике, если она доступна)
+:return: updated_at в том же текстовом виде, что и в get_file_info_json, или None если файл не найден
+"""
+async def get_file_updated_at(file_id: UUID, db: Optional[AsyncSession] = None) -> Optional[str]:
+    own_session = db is None
+    if own_session:
+        db = await new_async_read_session()
     try:
-        result = db.execute(
+        result = await db.execute(
+            text("SELECT to_json(updated_at) #>> '{}' FROM antivirus.files WHERE id = :id"),
+            {"id": file_id}
+        )
+        row = result.fetchone()
+        if row is None and is_replica_session(db):
+            # Файл мог быть загружен только что и ещё не дошёл до реплики: перечитываем с основного сервера
+            async with new_async_session() as primary:
+                return await get_file_updated_at(file_id, primary)
+        return row[0] if row else None
+    except SQLAlchemyError as e:
+        await db.rollback()
+        raise
+    finally:
+        if own_session:
+            await db.close()
+"""
+Получает метаданные для отдачи содержимого файла (без чтения самого содержимого в Python)
+Args: file_id: UUID файла
+:param db: Сессия запроса (None - открыть собственную сессию)
+Returns: Словарь с именем, размером, SHA-256 содержимого (для ETag) и временем очистки содержимого
+         или None если файл не найден
+"""
+async def get_file_content_meta(file_id: UUID, db: Optional[AsyncSession] = None) -> Optional[dict]:
+    own_session = db is None
+    if own_session:
+        db = new_async_session()
+    try:
+        result = await db.execute(
             text("""
-                SELECT 
-                    json_build_object(
-                        'id', id::text,
-                        'name', name,
-                        'size', size,
-                        'scan_result', scan_result,
-                        'created_at', created_at,
-                        'updated_at', updated_at
-                    ) as file_info
+                SELECT name, size, encode(content_hash, 'hex') AS content_hash, content_purged_at
                 FROM antivirus.files
-                ORDER BY created_at DESC
-            """)
+                WHERE id = :id
+            """),
+            {"id": file_id}
         )
-        rows = result.fetchall()
-        return [row[0] for row in rows] if rows else None
+        row = result.fetchone()
+        if row is None:
+            return None
+        return {
+            "name": row.name,
+            "size": row.size,
+            "content_hash": row.content_hash,
+            "content_purged_at": row.content_purged_at
+        }
+    except SQLAlchemyError:
+        await db.rollback()
+        raise
+    finally:
+        if own_session:
+            await db.close()
+"""
+Открывает снимок REPEATABLE READ для отдачи содержимого файла и читает в нём метаданные
+Метаданные (размер, SHA-256 для ETag) и все блоки содержимого (iter_file_content) читаются из одного снимка,
+поэтому заголовки ответа соответствуют отдаваемым байтам, даже если файл заменяют во время отдачи
+:param file_id: UUID файла
+:return: (сессия со снимком, метаданные как у get_file_content_meta или None если файл не найден);
+         сессию закрывает iter_file_content или вызывающий код, если содержимое не отдаётся
+"""
+async def open_file_content_snapshot(file_id: UUID) -> Tuple[AsyncSession, Optional[dict]]:
+    db = new_async_session()
+    try:
+        await db.execute(text("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ"))
+        return db, await get_file_content_meta(file_id, db=db)
+    except BaseException:
+        await db.close()
+        raise
+
+"""
+Читает содержимое файла блоками через substring(), не загружая весь BYTEA в память процесса
+Все блоки читаются в снимке open_file_content_snapshot - том же, из которого взяты размер и ETag ответа
+:param db: Сессия из open_file_content_snapshot (закрывается после чтения)
+:param file_id: UUID файла
+:param start: Смещение первого байта (0-based)
+:param length: Количество байт для чтения
+:param chunk_size: Размер одного блока
+:return: Асинхронный генератор блоков содержимого
+"""
+async def iter_file_content(
+    db: AsyncSession,
+    file_id: UUID,
+    start: int,
+    length: int,
+    chunk_size: int = 1024 * 1024
+) -> AsyncIterator[bytes]:
+    try:
+        query = text("""
+            SELECT substring(content from :offset for :length)
+            FROM antivirus.files
+            WHERE id = :id
+        """)
+        offset = start
+        end = start + length
+        while offset < end:
+            size = min(chunk_size, end - offset)
+            result = await db.execute(query, {"id": file_id, "offset": offset + 1, "length": size})
+            chunk = result.scalar()
+            if not chunk:
+                break
+            yield bytes(chunk)
+            offset += len(chunk)
+        await db.commit()
+    except SQLAlchemyError:
+        await db.rollback()
+        raise
+    finally:
+        await db.close()
+"""
+Получает информацию о всех файлах (без содержимого) в виде JSON
+Порядок стабильный: (created_at, id) по убыванию
+:param limit: Размер страницы (None - все файлы)
+:param after: Ключ (created_at, id) последнего файла предыдущей страницы
+:param db: Сессия запроса (None - открыть собственную сессию чтения, на реплике, если она доступна)
+:return: (JSON-массив текстом, количество строк, ключ последней строки или None)
+"""
+async def get_all_files_json(
+    limit: Optional[int] = None,
+    after: Optional[Tuple[datetime, UUID]] = None,
+    db: Optional[AsyncSession] = None
+) -> Tuple[str, int, Optional[list]]:
+    own_session = db is None
+    if own_session:
+        db = await new_async_read_session()
+    print("Input get_all_files_json")
+    try:
+        query = """
+            SELECT 
+                json_build_object(
+                    'id', id::text,
+                    'name', name,
+                    'size', size,
+                    'scan_result', scan_result,
+                    'created_at', created_at,
+                    'updated_at', updated_at
+                ) AS item,
+                created_at,
+                id
+            FROM antivirus.files
+        """
+
+        # Следующая страница начинается сразу после ключа курсора
+        params = {}
+        if after is not None:
+            query += " WHERE (created_at, id) < (:after_created_at, :after_id)"
+            params["after_created_at"], params["after_id"] = after
+
+        query += " ORDER BY created_at DESC, id DESC"
+
+        if limit is not None:
+            query += " LIMIT :limit"
+            params["limit"] = limit
+
+        return await _fetch_json_list(db, query, params, ("created_at", "id"), descending=True)
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         print(f"Database error: {str(e)}")
         raise
     finally:
-        db.close()
+        if own_session:
+            await db.close()
 """
 Удаляет файл
 Args: file_id: UUID файла
+:param db: Сессия запроса (None - открыть собственную сессию)
 Returns: :return: UUID удаленного файла
 """
-def delete_file_id(file_id: UUID) -> Optional[UUID]:
-    db = next(get_db())
+async def delete_file_id(file_id: UUID, db: Optional[AsyncSession] = None) -> Optional[UUID]:
+    own_session = db is None
+    if own_session:
+        db = new_async_session()
     try:
-        result = db.execute(
+        result = await db.execute(
             text("""
                 DELETE FROM antivirus.files 
                 WHERE id = :id
@@ -193,22 +448,219 @@ def delete_file_id(file_id: UUID) -> Optional[UUID]:
             {"id": file_id}
         )
         deleted_id = result.scalar()
-        db.commit()
+        await db.commit()
         print("File Delete from DB: ", str(deleted_id))
         return deleted_id  # Вернёт None если файл не найден
     except SQLAlchemyError as e:
-        db.rollback()
+        await db.rollback()
         raise SQLAlchemyError(f"Database error: {e}")
     finally:
-        db.close()
+        if own_session:
+            await db.close()
         
+"""
+Удаляет содержимое одной пачки просканированных файлов по политике хранения (antivirus.files_purge_content)
+Метаданные и scan_result сохраняются, содержимое заменяется пустым значением
+:param clean_after_days: Через сколько дней после чистого сканирования удалять содержимое (None - не удалять)
+:param infected_after_days: Через сколько дней удалять содержимое заражённых файлов (None - хранить)
+:param batch_size: Максимальное количество файлов в пачке
+:return: Количество очищенных файлов
+"""
+async def purge_file_contents(
+    clean_after_days: Optional[int] = None,
+    infected_after_days: Optional[int] = None,
+    batch_size: int = 100
+) -> int:
+    db = new_async_session()
+    try:
+        query = text("""
+            SELECT antivirus.files_purge_content(
+                make_interval(days => CAST(:clean_after_days AS INT)),
+                make_interval(days => CAST(:infected_after_days AS INT)),
+                :batch_size
+            ) AS purged
+        """)
+        result = await db.execute(query, {
+            "clean_after_days": clean_after_days,
+            "infected_after_days": infected_after_days,
+            "batch_size": batch_size
+        })
+        purged = result.scalar()
+        await db.commit()
+        return purged or 0
+
+    except SQLAlchemyError as e:
+        await db.rollback()
+        raise SQLAlchemyError(f"Database error: {e}")
+    finally:
+        await db.close()
+
+# Имя месячной секции history или audit: <таблица>_pYYYY_MM
+PARTITION_NAME_RE = re.compile(r"^(history|audit)_p[0-9]{4}_[0-9]{2}$")
+
+"""
+Создаёт недостающие месячные секции history и audit и отсоединяет секции старше срока хранения
+Выполняется одной транзакцией под advisory-блокировкой: при нескольких воркерах обслуживание
+выполняет один из них, остальные пропускают проход
+:param months_ahead: На сколько месяцев вперёд должны существовать секции
+:param keep_months: Срок хранения по таблицам {"history": N, "audit": N} (None - не отсоединять)
+:param lock_id: Ключ advisory-блокировки
+:return: Словарь {"created": количество созданных секций, "detached": имена отсоединённых} или None, если блокировка занята
+"""
+async def maintain_partitions(months_ahead: int, keep_months: dict, lock_id: int) -> Optional[dict]:
+    db = new_async_session()
+    try:
+        locked = (await db.execute(
+            text("SELECT pg_try_advisory_xact_lock(:lock_id)"), {"lock_id": lock_id}
+        )).scalar()
+        if not locked:
+            await db.rollback()
+            return None
+        # Создание и отсоединение секций блокируют родительскую таблицу: не ждём дольше, повторим на следующем проходе
+        await db.execute(text("SET LOCAL lock_timeout = '10s'"))
+
+        created = 0
+        detached = []
+        for table, keep in keep_months.items():
+            created += (await db.execute(text("""
+                SELECT antivirus.create_monthly_partitions(
+                    :table, CURRENT_DATE, (CURRENT_DATE + make_interval(months => :months_ahead))::DATE
+                )
+            """), {"table": table, "months_ahead": months_ahead})).scalar()
+            if keep is not None:
+                result = await db.execute(
+                    text("SELECT antivirus.detach_expired_partitions(:table, :keep) AS name"),
+                    {"table": table, "keep": keep}
+                )
+                detached.extend(result.scalars().all())
+        await db.commit()
+        return {"created": created, "detached": detached}
+
+    except SQLAlchemyError as e:
+        await db.rollback()
+        raise SQLAlchemyError(f"Database error: {e}")
+    finally:
+        await db.close()
+
+"""
+Начало периода, за который хранятся секции history или audit - по времени сервера БД,
+та же граница, что у antivirus.detach_expired_partitions
+:param keep_months: Срок хранения, месяцев (кроме текущего)
+:param db: Сессия запроса (None - открыть собственную сессию)
+:return: Начало месяца (локальное время сервера БД, без часового пояса)
+"""
+async def get_partition_retention_start(keep_months: int, db: Optional[AsyncSession] = None) -> datetime:
+    own_session = db is None
+    if own_session:
+        db = new_async_session()
+    try:
+        result = await db.execute(
+            text("SELECT CAST(date_trunc('month', now()) - make_interval(months => CAST(:keep AS INT)) AS TIMESTAMP)"),
+            {"keep": keep_months}
+        )
+        return result.scalar()
+    finally:
+        if own_session:
+            await db.close()
+
+"""
+Возвращает отсоединённые секции history и audit, ожидающие выгрузки
+:return: Список имён таблиц в схеме antivirus
+"""
+async def list_detached_partitions() -> List[str]:
+    db = new_async_session()
+    try:
+        result = await db.execute(text("""
+            SELECT c.relname
+            FROM pg_class c
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE n.nspname = 'antivirus'
+              AND c.relkind = 'r'
+              AND NOT c.relispartition
+              AND c.relname ~ '^(history|audit)_p[0-9]{4}_[0-9]{2}$'
+            ORDER BY c.relname
+        """))
+        return list(result.scalars().all())
+
+    except SQLAlchemyError as e:
+        await db.rollback()
+        raise SQLAlchemyError(f"Database error: {e}")
+    finally:
+        await db.close()
+
+"""
+Выгружает отсоединённую секцию в CSV со сжатием gzip и удаляет её
+COPY выполняется драйвером asyncpg, данные сжимаются по мере чтения; файл пишется во временный
+<archive_path>.part и переименовывается после полной выгрузки, таблица удаляется в той же транзакции
+:param name: Имя отсоединённой секции (antivirus.<таблица>_pYYYY_MM)
+:param archive_path: Путь к файлу .csv.gz (None - удалить секцию без выгрузки)
+:return: True - секция выгружена и удалена, False - секцию обрабатывает другой процесс или её уже нет
+"""
+async def archive_partition(name: str, archive_path: Optional[str] = None) -> bool:
+    if not PARTITION_NAME_RE.match(name):
+        raise ValueError(f"Invalid partition name: {name}")
+    db = new_async_session()
+    part_path = archive_path + ".part" if archive_path else None
+    try:
+        exists = (await db.execute(
+            text("SELECT to_regclass(:name) IS NOT NULL"), {"name": f"antivirus.{name}"}
+        )).scalar()
+        if not exists:
+            await db.rollback()
+            return False
+        # Секцию выгружает тот процесс, который первым её заблокировал
+        try:
+            await db.execute(text(f"LOCK TABLE antivirus.{name} IN ACCESS EXCLUSIVE MODE NOWAIT"))
+        except DBAPIError as e:
+            if getattr(e.orig, "pgcode", None) == "55P03":
+                await db.rollback()
+                return False
+            raise
+
+        if archive_path:
+            os.makedirs(os.path.dirname(archive_path) or ".", exist_ok=True)
+            compressor = zlib.compressobj(wbits=31)  # формат gzip
+            async with aiofiles.open(part_path, "wb") as archive:
+                async def write_chunk(chunk: bytes):
+                    await archive.write(compressor.compress(chunk))
+
+                connection = await db.connection()
+                raw_connection = await connection.get_raw_connection()
+                await raw_connection.driver_connection.copy_from_table(
+                    name,
+                    schema_name="antivirus",
+                    output=write_chunk,
+                    format="csv",
+                    header=True
+                )
+                await archive.write(compressor.flush())
+            os.replace(part_path, archive_path)
+
+        await db.execute(text(f"DROP TABLE antivirus.{name}"))
+        await db.commit()
+        return True
+
+    except SQLAlchemyError as e:
+        await db.rollback()
+        raise SQLAlchemyError(f"Database error: {e}")
+    except Exception as e:
+        await db.rollback()
+        raise e
+    finally:
+        await db.close()
+        if part_path and os.path.exists(part_path):
+            os.remove(part_path)
+
 """
 Вызывает функцию antivirus.signatures_iud в PostgreSQL для добавления/изменения/удаления сигнатур
 :param signature_data: JSON-данные сигнатуры (dict)
+:param db: Сессия запроса (None - открыть собственную сессию)
 :return: UUID обработанной сигнатуры
 """
-def call_signatures_iud_function(signature_data: dict) -> UUID:
-    db = next(get_db())
+async def call_signatures_iud_function(signature_data: dict, db: Optional[AsyncSession] = None) -> UUID:
+    own_session = db is None
+    if own_session:
+        db = new_async_session()
     try:
         # Преобразуем данные в JSON строку
         json_data = json.dumps(signature_data)
@@ -219,31 +671,173 @@ def call_signatures_iud_function(signature_data: dict) -> UUID:
         """)
         
         # Выполняем запрос
-        result = db.execute(query, {"json_data": json_data})
+        result = await db.execute(query, {"json_data": json_data})
         signature_uuid = result.scalar()
-        db.commit()
+        await db.commit()
         
         # logger.debug(f"Processed signature with ID: {signature_uuid}")
         return signature_uuid
         
     except SQLAlchemyError as e:
-        db.rollback()
+        await db.rollback()
         # logger.error(f"Database error in signatures_iud: {str(e)}", exc_info=True)
         raise SQLAlchemyError(f"Database error: {e}")
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         # logger.critical(f"Unexpected error in signatures_iud: {str(e)}", exc_info=True)
         raise e
     finally:
-        db.close()
+        if own_session:
+            await db.close()
+
+# Временная таблица загрузки для antivirus.signatures_import (удаляется при commit/rollback)
+SIGNATURE_IMPORT_STAGE_SQL = """
+    CREATE TEMP TABLE signatures_import_stage (
+        ord INT NOT NULL,
+        id UUID PRIMARY KEY,
+        only_id BOOLEAN NOT NULL,
+        threat_name TEXT,
+        first_bytes TEXT,
+        remainder_hash TEXT,
+        remainder_length INT,
+        file_type TEXT,
+        offset_start INT,
+        offset_end INT,
+        status TEXT,
+        action TEXT NOT NULL DEFAULT 'INSERT',
+        old_status TEXT,
+        changed BOOLEAN NOT NULL DEFAULT TRUE
+    ) ON COMMIT DROP
+"""
+SIGNATURE_IMPORT_COLUMNS = (
+    "ord", "id", "only_id", "threat_name", "first_bytes", "remainder_hash", "remainder_length",
+    "file_type", "offset_start", "offset_end", "status"
+)
+SIGNATURE_REQUIRED_FIELDS = ("threat_name", "first_bytes", "remainder_hash", "remainder_length", "file_type")
+
+"""
+Проверяет элементы импорта и преобразует их в строки таблицы загрузки
+Формат элемента тот же, что у signatures_iud: без id или с новым id - создание,
+только id - удаление, id и поля - изменение переданных полей; прочие ключи игнорируются
+:param items: Список сигнатур (словари)
+:return: (строки для COPY, UUID сигнатур в порядке элементов)
+:raises ValueError: Элемент не является объектом, поле имеет неверный тип или длину, id повторяется
+"""
+def _prepare_signature_import(items: List[dict]) -> Tuple[List[tuple], List[UUID]]:
+    records = []
+    signature_ids = []
+    seen = set()
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            raise ValueError(f"Элемент {index}: ожидается объект JSON")
+        try:
+            if item.get("id") is not None:
+                signature_id = UUID(str(item["id"]))
+            else:
+                missing = [field for field in SIGNATURE_REQUIRED_FIELDS if item.get(field) is None]
+                if missing:
+                    raise ValueError(f"для создания новой сигнатуры необходимо указать {', '.join(missing)}")
+                # UUID новых сигнатур генерируем заранее, чтобы вернуть их в порядке элементов
+                signature_id = uuid4()
+            if signature_id in seen:
+                raise ValueError(f"сигнатура {signature_id} указана несколько раз")
+            seen.add(signature_id)
+
+            values = {}
+            for field in ("threat_name", "first_bytes", "remainder_hash", "file_type", "status"):
+                values[field] = None if item.get(field) is None else str(item[field])
+            for field in ("remainder_length", "offset_start", "offset_end"):
+                values[field] = None if item.get(field) is None else int(item[field])
+            if values["first_bytes"] is not None and len(values["first_bytes"]) > 8:
+                raise ValueError("first_bytes длиннее 8 символов")
+            if values["remainder_hash"] is not None and len(values["remainder_hash"]) > 64:
+                raise ValueError("remainder_hash длиннее 64 символов")
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"Элемент {index}: {e}")
+
+        records.append((
+            index, signature_id, set(item) == {"id"},
+            values["threat_name"], values["first_bytes"], values["remainder_hash"], values["remainder_length"],
+            values["file_type"], values["offset_start"], values["offset_end"], values["status"]
+        ))
+        signature_ids.append(signature_id)
+    return records, signature_ids
+
+"""
+Массово импортирует сигнатуры одной транзакцией
+Элементы загружаются командой COPY во временную таблицу, после чего antivirus.signatures_import
+применяет вставки, изменения и удаления (перевод в статус DELETED) одним оператором каждого вида;
+history и audit пишут триггеры уровня оператора
+Повторное удаление и изменения, не меняющие значений, пропускаются
+:param items: Список сигнатур в формате /signatures/manage
+:param db: Сессия запроса (None - открыть собственную сессию)
+:return: Словарь со счётчиками created, updated, deleted, unchanged и списком signature_ids в порядке элементов
+:raises ValueError: Неверный элемент импорта (в том числе изменение удалённой записи без восстановления)
+"""
+async def call_signatures_bulk_import(items: List[dict], db: Optional[AsyncSession] = None) -> dict:
+    records, signature_ids = await run_in_threadpool(_prepare_signature_import, items)
+    if not records:
+        return {"created": 0, "updated": 0, "deleted": 0, "unchanged": 0, "signature_ids": []}
+    own_session = db is None
+    if own_session:
+        db = new_async_session()
+    try:
+        await db.execute(text(SIGNATURE_IMPORT_STAGE_SQL))
+        # COPY выполняется драйвером asyncpg на соединении сессии, внутри её транзакции
+        connection = await db.connection()
+        raw_connection = await connection.get_raw_connection()
+        await raw_connection.driver_connection.copy_records_to_table(
+            "signatures_import_stage",
+            records=records,
+            columns=SIGNATURE_IMPORT_COLUMNS,
+            schema_name="pg_temp"
+        )
+        result = await db.execute(text("SELECT * FROM antivirus.signatures_import()"))
+        counts = dict(result.mappings().one())
+        await db.commit()
+        logger.info(f"Signatures imported: {counts}")
+        return {**counts, "signature_ids": signature_ids}
+
+    except DBAPIError as e:
+        await db.rollback()
+        # invalid_parameter_value - ошибка в данных импорта (RAISE в signatures_import)
+        if getattr(e.orig, "pgcode", None) == "22023":
+            raise ValueError(str(e.orig.__cause__ or e.orig))
+        raise SQLAlchemyError(f"Database error: {e}")
+    except SQLAlchemyError as e:
+        await db.rollback()
+        raise SQLAlchemyError(f"Database error: {e}")
+    except Exception as e:
+        await db.rollback()
+        raise e
+    finally:
+        if own_session:
+            await db.close()
         
 """
 Получает список актуальных сигнатур с возможностью фильтрации по дате обновления
+Порядок стабильный: (updated_at, id) по убыванию
 :param since: Необязательная дата для фильтрации (только записи, обновленные после этой даты)
-:return: Список словарей с информацией о сигнатурах или None если сигнатур не найдено
+:param limit: Размер страницы (None - все сигнатуры)
+:param after: Ключ (updated_at, id) последней сигнатуры предыдущей страницы
+:param db: Сессия запроса (None - открыть собственную сессию чтения, на реплике, если она доступна)
+:return: (JSON-массив текстом, количество строк, ключ последней строки или None)
+Если кэш сигнатур загружен и актуален, список формируется из памяти без запроса к БД
 """
-def get_actual_signatures_json(since: Optional[datetime] = None) -> Optional[List[dict]]:
-    db = next(get_db())
+async def get_actual_signatures_json(
+    since: Optional[datetime] = None,
+    limit: Optional[int] = None,
+    after: Optional[Tuple[datetime, UUID]] = None,
+    db: Optional[AsyncSession] = None
+) -> Tuple[str, int, Optional[list]]:
+    snapshot = await get_signature_snapshot()
+    if snapshot is not None:
+        cached = cached_signatures_json(snapshot, "ACTUAL", since, limit, after)
+        if cached is not None:
+            return cached
+    own_session = db is None
+    if own_session:
+        db = await new_async_read_session()
     try:
         # Базовый запрос
         query = """
@@ -259,7 +853,9 @@ def get_actual_signatures_json(since: Optional[datetime] = None) -> Optional[Lis
                     'offset_end', offset_end,
                     'status', status,
                     'updated_at', updated_at
-                ) as signature_info
+                ) AS item,
+                updated_at,
+                id
             FROM ONLY antivirus.signatures
             WHERE status = 'ACTUAL'
         """
@@ -269,36 +865,138 @@ def get_actual_signatures_json(since: Optional[datetime] = None) -> Optional[Lis
         if since is not None:
             query += " AND updated_at >= :since"
             params["since"] = since
+
+        # Следующая страница начинается сразу после ключа курсора
+        if after is not None:
+            query += " AND (updated_at, id) < (:after_updated_at, :after_id)"
+            params["after_updated_at"], params["after_id"] = after
         
-        query += " ORDER BY updated_at DESC"
-        
-        result = db.execute(text(query), params)
-        rows = result.fetchall()
+        query += " ORDER BY updated_at DESC, id DESC"
+
+        if limit is not None:
+            query += " LIMIT :limit"
+            params["limit"] = limit
         
-        return [row[0] for row in rows] if rows else None
+        return await _fetch_json_list(db, query, params, ("updated_at", "id"), descending=True)
         
     except SQLAlchemyError as e:
-        db.rollback()
+        await db.rollback()
         raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise
     finally:
-        db.close()
+        if own_session:
+            await db.close()
         
+"""
+Получает текущую версию набора сигнатур (наибольшая signatures.version, чтение по индексу ix_signatures_version)
+:param db: Сессия запроса (None - открыть собственную сессию чтения, на реплике, если она доступна)
+:return: Версия набора (0 - набор пуст)
+"""
+async def get_signatures_version(db: Optional[AsyncSession] = None) -> int:
+    own_session = db is None
+    if own_session:
+        db = await new_async_read_session()
+    try:
+        result = await db.execute(text("SELECT COALESCE(max(version), 0) FROM ONLY antivirus.signatures"))
+        return result.scalar()
+    except SQLAlchemyError as e:
+        await db.rollback()
+        raise
+    finally:
+        if own_session:
+            await db.close()
+
+"""
+Получает изменения набора сигнатур после версии since_version одним компактным ответом
+Каждая сигнатура входит в ответ один раз, в последнем состоянии: удалённые - только id в списке deleted,
+остальные - целиком в списке upserts. Запрос и текущая версия читаются одним оператором (один снимок данных),
+поэтому to_version согласована с содержимым ответа. Реплика, отстающая от версии клиента, не используется
+:param since_version: Версия, полученная клиентом ранее (0 - весь набор)
+:param limit: Максимальное количество изменений в ответе; если изменений больше, has_more = true
+              и следующую порцию нужно запросить с since_version = to_version
+:param db: Сессия запроса (None - открыть собственную сессию чтения, на реплике, если она доступна)
+:return: (JSON-объект текстом, текущая версия набора, количество изменений в ответе)
+"""
+async def get_signatures_delta(
+    since_version: int,
+    limit: int,
+    db: Optional[AsyncSession] = None
+) -> Tuple[str, int, int]:
+    own_session = db is None
+    if own_session:
+        db = await new_async_read_session()
+    try:
+        result = await db.execute(text("""
+            WITH current_version AS (
+                SELECT COALESCE(max(version), 0) AS version FROM ONLY antivirus.signatures
+            ),
+            page AS (
+                SELECT id, threat_name, first_bytes, remainder_hash, remainder_length, file_type,
+                       offset_start, offset_end, status, updated_at, version
+                FROM ONLY antivirus.signatures
+                WHERE version > CAST(:since_version AS BIGINT)
+                ORDER BY version
+                LIMIT :limit
+            )
+            SELECT
+                cv.version AS current_version,
+                count(p.id) AS row_count,
+                json_build_object(
+                    'from_version', CAST(:since_version AS BIGINT),
+                    'to_version', COALESCE(max(p.version), CAST(:since_version AS BIGINT)),
+                    'current_version', cv.version,
+                    'has_more', COALESCE(max(p.version), CAST(:since_version AS BIGINT)) < cv.version,
+                    'upserts', COALESCE(json_agg(json_build_object(
+                        'id', p.id::text,
+                        'threat_name', p.threat_name,
+                        'first_bytes', p.first_bytes,
+                        'remainder_hash', p.remainder_hash,
+                        'remainder_length', p.remainder_length,
+                        'file_type', p.file_type,
+                        'offset_start', p.offset_start,
+                        'offset_end', p.offset_end,
+                        'status', p.status,
+                        'updated_at', p.updated_at,
+                        'version', p.version
+                    ) ORDER BY p.version) FILTER (WHERE p.status <> 'DELETED'), '[]'),
+                    'deleted', COALESCE(json_agg(p.id::text ORDER BY p.version) FILTER (WHERE p.status = 'DELETED'), '[]')
+                )::text AS body
+            FROM current_version cv
+            LEFT JOIN page p ON TRUE
+            GROUP BY cv.version
+        """), {"since_version": since_version, "limit": limit})
+        row = result.one()
+        if row.current_version < since_version and is_replica_session(db):
+            # Клиент получил версию с основного сервера, а реплика ещё не догнала её: перечитываем с основного
+            async with new_async_session() as primary:
+                return await get_signatures_delta(since_version, limit, primary)
+        return row.body, row.current_version, row.row_count
+
+    except SQLAlchemyError as e:
+        await db.rollback()
+        raise
+    finally:
+        if own_session:
+            await db.close()
+
 """
 Получает сигнатуры по списку GUID
 :param guid_list: Список UUID сигнатур
-:return: Список словарей с информацией о сигнатурах или None если сигнатуры не найдены
+:param db: Сессия запроса (None - открыть собственную сессию чтения, на реплике, если она доступна)
+:return: (JSON-массив текстом, количество строк, ключ последней строки или None)
 """
-def get_signatures_by_guids(guid_list: List[UUID]) -> Optional[List[dict]]:
-    db = next(get_db())
+async def get_signatures_by_guids(guid_list: List[UUID], db: Optional[AsyncSession] = None) -> Tuple[str, int, Optional[list]]:
+    own_session = db is None
+    if own_session:
+        db = await new_async_read_session()
     try:
         # Проверяем, что список не пустой
         if not guid_list:
-            return []
+            return EMPTY_JSON_LIST
             
-        query = text("""
+        query = """
             SELECT 
                 json_build_object(
                     'id', id::text,
@@ -311,39 +1009,207 @@ def get_signatures_by_guids(guid_list: List[UUID]) -> Optional[List[dict]]:
                     'offset_end', offset_end,
                     'status', status,
                     'updated_at', updated_at
-                ) as signature_info
+                ) AS item,
+                updated_at,
+                id
             FROM ONLY antivirus.signatures
             WHERE id = ANY(:guid_list)
-            ORDER BY updated_at DESC
-        """)
-        
-        result = db.execute(query, {"guid_list": guid_list})
-        rows = result.fetchall()
+            ORDER BY updated_at DESC, id DESC
+        """
         
-        return [row[0] for row in rows] if rows else []
+        return await _fetch_json_list(db, query, {"guid_list": guid_list}, ("updated_at", "id"), descending=True)
         
     except SQLAlchemyError as e:
-        db.rollback()
+        await db.rollback()
         raise SQLAlchemyError(f"Database error: {e}")
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise e
     finally:
-        db.close()
+        if own_session:
+            await db.close()
         
+# Временная таблица запрошенных GUID (удаляется при commit/rollback)
+GUID_LOOKUP_STAGE_SQL = """
+    CREATE TEMP TABLE guid_lookup_stage (
+        ord INT NOT NULL,
+        id UUID NOT NULL
+    ) ON COMMIT DROP
+"""
+GUID_LOOKUP_COLUMNS = ("ord", "id")
+
+# GUID в форматах, которые принимает UUID() (32 шестнадцатеричные цифры, с дефисами или без, в фигурных скобках)
+GUID_LOOKUP_PATTERN = re.compile(
+    r"\s*\{?([0-9a-fA-F]{8}-?[0-9a-fA-F]{4}-?[0-9a-fA-F]{4}-?[0-9a-fA-F]{4}-?[0-9a-fA-F]{12})\}?\s*"
+)
+
+"""
+Отбирает допустимые GUID без повторов (первое вхождение) и преобразует их в строки таблицы загрузки
+Одно регулярное выражение на строку вместо создания UUID: значение в тип uuid переводит COPY
+:param guids: GUID строками в порядке запроса
+:return: Строки (порядковый номер, GUID) для COPY
+"""
+def _prepare_guid_lookup(guids: list) -> List[tuple]:
+    records = []
+    seen = set()
+    for index, guid in enumerate(guids):
+        match = GUID_LOOKUP_PATTERN.fullmatch(guid) if isinstance(guid, str) else None
+        if match is None:
+            continue
+        key = match.group(1).replace("-", "").lower()
+        if key not in seen:
+            seen.add(key)
+            records.append((index, key))
+    return records
+
+"""
+Проверяет список GUID для поиска через временную таблицу (неверные и повторные пропускаются)
+Разбор идёт в пуле потоков: на больших списках он занимает заметное время
+:param guids: GUID сигнатур строками в порядке запроса
+:return: Строки для COPY в guid_lookup_stage; пустой список - допустимых GUID нет
+"""
+async def prepare_guid_lookup(guids: list) -> List[tuple]:
+    return await run_in_threadpool(_prepare_guid_lookup, guids)
+
+"""
+Загружает список GUID во временную таблицу командой COPY для поиска соединением с signatures и history
+Используется для больших списков: вместо одного параметра-массива planner получает таблицу со статистикой;
+таблица живёт до конца транзакции сессии и удаляется при commit/rollback
+:param db: Сессия на основном сервере (временные таблицы нельзя создать на реплике)
+:param records: Строки из prepare_guid_lookup
+"""
+async def _stage_guid_lookup(db: AsyncSession, records: List[tuple]):
+    await db.execute(text(GUID_LOOKUP_STAGE_SQL))
+    # COPY выполняется драйвером asyncpg на соединении сессии, внутри её транзакции
+    connection = await db.connection()
+    raw_connection = await connection.get_raw_connection()
+    await raw_connection.driver_connection.copy_records_to_table(
+        "guid_lookup_stage",
+        records=records,
+        columns=GUID_LOOKUP_COLUMNS,
+        schema_name="pg_temp"
+    )
+    # Временные таблицы не анализирует autovacuum: без статистики planner считает их маленькими
+    await db.execute(text("ANALYZE pg_temp.guid_lookup_stage"))
+
+"""
+Загружает список GUID во временную таблицу и читает результат запроса к ней через серверный курсор пачками строк
+Сессия открывается при первом чтении генератора и закрывается в нём же: если ответ не начал передаваться
+(клиент отключился раньше), соединение из пула не занимается
+:param records: Строки из prepare_guid_lookup
+:param query: Запрос, возвращающий одну колонку - JSON записи текстом
+:param batch_size: Количество записей, читаемых из курсора за один раз
+:return: Асинхронный генератор списков строк JSON
+"""
+async def _iter_staged_guid_rows(records: List[tuple], query: str, batch_size: int) -> AsyncIterator[List[str]]:
+    db = new_async_session()
+    try:
+        await _stage_guid_lookup(db, records)
+        result = await db.stream(text(query), execution_options={"yield_per": batch_size})
+        async for rows in result.partitions(batch_size):
+            yield [row[0] for row in rows]
+        await db.commit()
+    except SQLAlchemyError:
+        await db.rollback()
+        raise
+    finally:
+        await db.close()
+
+"""
+Отдаёт сигнатуры по загруженному списку GUID JSON-массивом по частям - тот же формат и порядок
+(updated_at, id) по убыванию, что у get_signatures_by_guids; весь массив в памяти не собирается
+:param records: Строки из prepare_guid_lookup
+:param batch_size: Количество записей, читаемых из курсора за один раз
+:return: Асинхронный генератор блоков JSON-массива
+"""
+async def iter_guid_lookup_json(records: List[tuple], batch_size: int = 1000) -> AsyncIterator[bytes]:
+    query = f"""
+        SELECT 
+            json_build_object(
+                'id', s.id::text,
+                'threat_name', s.threat_name,
+                'first_bytes', s.first_bytes,
+                'remainder_hash', s.remainder_hash,
+                'remainder_length', s.remainder_length,
+                'file_type', s.file_type,
+                'offset_start', s.offset_start,
+                'offset_end', s.offset_end,
+                'status', s.status,
+                'updated_at', s.updated_at
+            )::text AS item
+        FROM pg_temp.guid_lookup_stage AS r
+        JOIN ONLY antivirus.signatures AS s ON s.id = r.id
+        ORDER BY s.updated_at DESC, s.id DESC
+    """
+    separator = "["
+    async for items in _iter_staged_guid_rows(records, query, batch_size):
+        yield (separator + ", ".join(items)).encode("utf-8")
+        separator = ", "
+    yield b"[]" if separator == "[" else b"]"
+
+"""
+Сверка списка GUID для офлайн-агентов: на каждый допустимый GUID - одна строка NDJSON в порядке запроса
+Найденная сигнатура отдаётся целиком с версией набора (signatures.version), числом версий в history
+и временем последней из них; неизвестный GUID - строкой {"id": ..., "status": "NOT_FOUND"}
+:param records: Строки из prepare_guid_lookup
+:param batch_size: Количество записей, читаемых из курсора за один раз
+:return: Асинхронный генератор блоков NDJSON
+"""
+async def iter_guid_reconcile_ndjson(records: List[tuple], batch_size: int = 1000) -> AsyncIterator[bytes]:
+    query = f"""
+        WITH versions AS (
+            SELECT h.id, count(*) AS history_versions, max(h.recorded_at) AS last_recorded_at
+            FROM antivirus.history AS h
+            WHERE h.id IN (SELECT id FROM pg_temp.guid_lookup_stage)
+            GROUP BY h.id
+        )
+        SELECT 
+            CASE WHEN s.id IS NULL THEN
+                json_build_object('id', r.id::text, 'status', 'NOT_FOUND')
+            ELSE
+                json_build_object(
+                    'id', s.id::text,
+                    'threat_name', s.threat_name,
+                    'first_bytes', s.first_bytes,
+                    'remainder_hash', s.remainder_hash,
+                    'remainder_length', s.remainder_length,
+                    'file_type', s.file_type,
+                    'offset_start', s.offset_start,
+                    'offset_end', s.offset_end,
+                    'status', s.status,
+                    'updated_at', s.updated_at,
+                    'version', s.version,
+                    'history_versions', COALESCE(v.history_versions, 0),
+                    'last_recorded_at', v.last_recorded_at
+                )
+            END::text AS item
+        FROM pg_temp.guid_lookup_stage AS r
+        LEFT JOIN ONLY antivirus.signatures AS s ON s.id = r.id
+        LEFT JOIN versions AS v ON v.id = r.id
+        ORDER BY r.ord
+    """
+    async for items in _iter_staged_guid_rows(records, query, batch_size):
+        yield ("\n".join(items) + "\n").encode("utf-8")
+
 """
 Получает сигнатуры по статусу (ACTUAL или DELETED)
 :param status: Статус сигнатур для фильтрации
-:return: Список словарей с информацией о сигнатурах или пустой список если не найдено
+:param db: Сессия запроса (None - открыть собственную сессию чтения, на реплике, если она доступна)
+:return: (JSON-массив текстом, количество строк, ключ последней строки или None)
 """
-def get_signatures_by_status(status: str) -> List[dict]:
-    db = next(get_db())
+async def get_signatures_by_status(status: str, db: Optional[AsyncSession] = None) -> Tuple[str, int, Optional[list]]:
+    # Проверяем допустимые значения статуса
+    if status not in ('ACTUAL', 'DELETED'):
+        return EMPTY_JSON_LIST
+    snapshot = await get_signature_snapshot()
+    if snapshot is not None:
+        return cached_signatures_json(snapshot, status)
+    own_session = db is None
+    if own_session:
+        db = await new_async_read_session()
     try:
-        # Проверяем допустимые значения статуса
-        if status not in ('ACTUAL', 'DELETED'):
-            return []
             
-        query = text("""
+        query = """
             SELECT 
                 json_build_object(
                     'id', id::text,
@@ -356,30 +1222,418 @@ def get_signatures_by_status(status: str) -> List[dict]:
                     'offset_end', offset_end,
                     'status', status,
                     'updated_at', updated_at
-                ) as signature_info
+                ) AS item,
+                updated_at,
+                id
             FROM ONLY antivirus.signatures
             WHERE status = :status
-            ORDER BY updated_at DESC
-        """)
+            ORDER BY updated_at DESC, id DESC
+        """
         
-        result = db.execute(query, {"status": status})
-        rows = result.fetchall()
-        return [row[0] for row in rows]
+        return await _fetch_json_list(db, query, {"status": status}, ("updated_at", "id"), descending=True)
         
     except SQLAlchemyError:
-        db.rollback()
-        return []
+        await db.rollback()
+        return EMPTY_JSON_LIST
     finally:
-        db.close()
+        if own_session:
+            await db.close()
         
+"""
+Находит избыточные сигнатуры ACTUAL: группы с одинаковым шаблоном (first_bytes, remainder_hash, remainder_length)
+по индексу ix_signatures_fingerprint. В группе сигнатура избыточна, если она:
+- DUPLICATE - совпадает с более ранней сигнатурой группы по смещениям (offset_end без offset_start не учитывается);
+- SHADOWED - её диапазон смещений целиком внутри диапазона другой сигнатуры группы (без offset_start - любое смещение),
+  то есть она срабатывает только вместе с ней
+Порядок стабильный: по отпечатку шаблона
+:param limit: Количество групп на странице (None - все группы)
+:param after: Отпечаток (first_bytes, remainder_hash, remainder_length) последней группы предыдущей страницы
+:param db: Сессия запроса (None - открыть собственную сессию чтения, на реплике, если она доступна)
+:return: (JSON-массив групп текстом, количество групп, ключ последней группы или None)
+"""
+async def get_signature_duplicates(
+    limit: Optional[int] = None,
+    after: Optional[Tuple[str, str, int]] = None,
+    db: Optional[AsyncSession] = None
+) -> Tuple[str, int, Optional[list]]:
+    own_session = db is None
+    if own_session:
+        db = await new_async_read_session()
+    try:
+        params = {"limit": limit}
+        after_condition = ""
+        # Следующая страница начинается сразу после отпечатка курсора
+        if after is not None:
+            after_condition = """
+                  AND (first_bytes, remainder_hash, remainder_length) > (:after_first_bytes, :after_remainder_hash, :after_remainder_length)
+            """
+            params["after_first_bytes"], params["after_remainder_hash"], params["after_remainder_length"] = after
+
+        query = f"""
+            WITH groups AS (
+                SELECT first_bytes, remainder_hash, remainder_length,
+                       count(*) AS signature_count,
+                       array_agg(DISTINCT threat_name ORDER BY threat_name) AS threat_names
+                FROM ONLY antivirus.signatures
+                WHERE status = 'ACTUAL'
+                {after_condition}
+                GROUP BY first_bytes, remainder_hash, remainder_length
+                HAVING count(*) > 1
+                ORDER BY first_bytes, remainder_hash, remainder_length
+                LIMIT :limit
+            ),
+            -- Смещения сигнатуры без offset_start не проверяются: offset_end такой сигнатуры не учитываем
+            members AS (
+                SELECT s.id, s.threat_name, s.offset_start,
+                       CASE WHEN s.offset_start IS NOT NULL THEN s.offset_end END AS offset_end,
+                       s.updated_at, s.first_bytes, s.remainder_hash, s.remainder_length
+                FROM groups AS g
+                JOIN ONLY antivirus.signatures AS s
+                    ON s.first_bytes = g.first_bytes
+                   AND s.remainder_hash = g.remainder_hash
+                   AND s.remainder_length = g.remainder_length
+                   AND s.status = 'ACTUAL'
+            ),
+            -- Из сигнатур с одинаковыми смещениями остаётся самая ранняя
+            ranked AS (
+                SELECT m.*,
+                       first_value(m.id) OVER (
+                           PARTITION BY m.first_bytes, m.remainder_hash, m.remainder_length, m.offset_start, m.offset_end
+                           ORDER BY m.updated_at, m.id
+                       ) AS kept_id
+                FROM members AS m
+            ),
+            redundant AS (
+                SELECT r.first_bytes, r.remainder_hash, r.remainder_length, r.id, r.kept_id AS by_id, 'DUPLICATE' AS reason
+                FROM ranked AS r
+                WHERE r.id <> r.kept_id
+                UNION ALL
+                -- Перекрывающая сигнатура - с самым широким диапазоном (из одинаковых - самая ранняя, то есть остающаяся);
+                -- ищется по индексу отпечатка для каждой сигнатуры, а не соединением всех сигнатур страницы
+                SELECT x.first_bytes, x.remainder_hash, x.remainder_length, x.id, y.id AS by_id, 'SHADOWED' AS reason
+                FROM ranked AS x
+                CROSS JOIN LATERAL (
+                    SELECT c.id
+                    FROM (
+                        SELECT s.id, s.offset_start,
+                               CASE WHEN s.offset_start IS NOT NULL THEN s.offset_end END AS offset_end,
+                               s.updated_at
+                        FROM ONLY antivirus.signatures AS s
+                        WHERE s.first_bytes = x.first_bytes
+                          AND s.remainder_hash = x.remainder_hash
+                          AND s.remainder_length = x.remainder_length
+                          AND s.status = 'ACTUAL'
+                    ) AS c
+                    WHERE (c.offset_start, c.offset_end) IS DISTINCT FROM (x.offset_start, x.offset_end)
+                      AND (c.offset_start IS NULL
+                           OR (x.offset_start >= c.offset_start
+                               AND (c.offset_end IS NULL OR x.offset_end <= c.offset_end)))
+                    ORDER BY c.offset_start NULLS FIRST, c.offset_end DESC NULLS FIRST, c.updated_at, c.id
+                    LIMIT 1
+                ) AS y
+                WHERE x.id = x.kept_id
+            ),
+            -- Списки групп собираются одним проходом и соединяются с группами по отпечатку
+            member_lists AS (
+                SELECT m.first_bytes, m.remainder_hash, m.remainder_length,
+                       json_agg(json_build_object(
+                           'id', m.id::text,
+                           'threat_name', m.threat_name,
+                           'offset_start', m.offset_start,
+                           'offset_end', m.offset_end,
+                           'updated_at', m.updated_at
+                       ) ORDER BY m.updated_at, m.id) AS signatures
+                FROM members AS m
+                GROUP BY m.first_bytes, m.remainder_hash, m.remainder_length
+            ),
+            redundant_lists AS (
+                SELECT r.first_bytes, r.remainder_hash, r.remainder_length,
+                       json_agg(json_build_object(
+                           'id', r.id::text,
+                           'by', r.by_id::text,
+                           'reason', r.reason
+                       ) ORDER BY r.id) AS redundant
+                FROM redundant AS r
+                GROUP BY r.first_bytes, r.remainder_hash, r.remainder_length
+            )
+            SELECT
+                json_build_object(
+                    'first_bytes', g.first_bytes,
+                    'remainder_hash', g.remainder_hash,
+                    'remainder_length', g.remainder_length,
+                    'signature_count', g.signature_count,
+                    'threat_names', g.threat_names,
+                    'signatures', ml.signatures,
+                    'redundant', coalesce(rl.redundant, '[]')
+                ) AS item,
+                g.first_bytes,
+                g.remainder_hash,
+                g.remainder_length
+            FROM groups AS g
+            JOIN member_lists AS ml USING (first_bytes, remainder_hash, remainder_length)
+            LEFT JOIN redundant_lists AS rl USING (first_bytes, remainder_hash, remainder_length)
+            ORDER BY g.first_bytes, g.remainder_hash, g.remainder_length
+        """
+
+        return await _fetch_json_list(db, query, params, ("first_bytes", "remainder_hash", "remainder_length"))
+
+    except SQLAlchemyError:
+        await db.rollback()
+        return EMPTY_JSON_LIST
+    finally:
+        if own_session:
+            await db.close()
+
+# Временная таблица загрузки списка хэшей (удаляется при commit/rollback)
+HASH_LIST_IMPORT_STAGE_SQL = """
+    CREATE TEMP TABLE hash_list_import_stage (
+        ord INT NOT NULL,
+        sha256 BYTEA PRIMARY KEY,
+        only_sha256 BOOLEAN NOT NULL,
+        verdict TEXT,
+        threat_name TEXT,
+        source TEXT
+    ) ON COMMIT DROP
+"""
+HASH_LIST_IMPORT_COLUMNS = ("ord", "sha256", "only_sha256", "verdict", "threat_name", "source")
+HASH_LIST_VERDICTS = ("CLEAN", "MALICIOUS")
+SHA256_HEX_PATTERN = re.compile(r"^[0-9a-fA-F]{64}$")
+
+# Вставки и изменения - одним INSERT ... ON CONFLICT (в порядке ключа, чтобы параллельные импорты
+# не взаимоблокировались), удаления - одним DELETE; записи без изменений не переписываются
+HASH_LIST_IMPORT_APPLY_SQL = """
+    WITH deleted AS (
+        DELETE FROM antivirus.hash_list AS h
+        USING pg_temp.hash_list_import_stage AS s
+        WHERE s.only_sha256 AND h.sha256 = s.sha256
+        RETURNING h.sha256
+    ),
+    upserted AS (
+        INSERT INTO antivirus.hash_list AS h (sha256, verdict, threat_name, source)
+        SELECT s.sha256, s.verdict, s.threat_name, s.source
+        FROM pg_temp.hash_list_import_stage AS s
+        WHERE NOT s.only_sha256
+        ORDER BY s.sha256
+        ON CONFLICT (sha256) DO UPDATE
+            SET verdict = EXCLUDED.verdict,
+                threat_name = EXCLUDED.threat_name,
+                source = EXCLUDED.source,
+                updated_at = NOW()
+            WHERE (h.verdict, h.threat_name, h.source) IS DISTINCT FROM (EXCLUDED.verdict, EXCLUDED.threat_name, EXCLUDED.source)
+        RETURNING xmax = 0 AS inserted
+    )
+    SELECT
+        (SELECT count(*) FROM upserted WHERE inserted) AS created,
+        (SELECT count(*) FROM upserted WHERE NOT inserted) AS updated,
+        (SELECT count(*) FROM deleted) AS deleted
+"""
+
+"""
+Проверяет элементы импорта списка хэшей и преобразует их в строки таблицы загрузки
+Элемент: sha256 (hex), verdict (CLEAN или MALICIOUS), threat_name (обязательно для MALICIOUS), source;
+только sha256 - удаление записи. Запись заменяется целиком, прочие ключи игнорируются
+:param items: Список записей (словари)
+:return: Строки для COPY
+:raises ValueError: Элемент не является объектом, неверный хэш или вердикт, хэш повторяется
+"""
+def _prepare_hash_list_import(items: List[dict]) -> List[tuple]:
+    records = []
+    seen = set()
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            raise ValueError(f"Элемент {index}: ожидается объект JSON")
+        try:
+            sha256 = item.get("sha256")
+            if not isinstance(sha256, str) or not SHA256_HEX_PATTERN.match(sha256):
+                raise ValueError("sha256 должен содержать 64 шестнадцатеричных символа")
+            sha256 = bytes.fromhex(sha256)
+            if sha256 in seen:
+                raise ValueError(f"хэш {sha256.hex()} указан несколько раз")
+            seen.add(sha256)
+
+            only_sha256 = set(item) == {"sha256"}
+            verdict = threat_name = source = None
+            if not only_sha256:
+                verdict = item.get("verdict")
+                if verdict not in HASH_LIST_VERDICTS:
+                    raise ValueError("verdict должен быть CLEAN или MALICIOUS")
+                if verdict == "MALICIOUS":
+                    if not item.get("threat_name"):
+                        raise ValueError("для MALICIOUS необходимо указать threat_name")
+                    threat_name = str(item["threat_name"])
+                source = None if item.get("source") is None else str(item["source"])
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"Элемент {index}: {e}")
+
+        records.append((index, sha256, only_sha256, verdict, threat_name, source))
+    return records
+
+"""
+Массово импортирует список известных хэшей файлов одной транзакцией
+Элементы загружаются командой COPY во временную таблицу и применяются одним INSERT ... ON CONFLICT и одним DELETE
+:param items: Список записей в формате _prepare_hash_list_import
+:param db: Сессия запроса (None - открыть собственную сессию)
+:return: Словарь со счётчиками created, updated, deleted, unchanged
+:raises ValueError: Неверный элемент импорта
+"""
+async def call_hash_list_import(items: List[dict], db: Optional[AsyncSession] = None) -> dict:
+    records = await run_in_threadpool(_prepare_hash_list_import, items)
+    if not records:
+        return {"created": 0, "updated": 0, "deleted": 0, "unchanged": 0}
+    own_session = db is None
+    if own_session:
+        db = new_async_session()
+    try:
+        await db.execute(text(HASH_LIST_IMPORT_STAGE_SQL))
+        # COPY выполняется драйвером asyncpg на соединении сессии, внутри её транзакции
+        connection = await db.connection()
+        raw_connection = await connection.get_raw_connection()
+        await raw_connection.driver_connection.copy_records_to_table(
+            "hash_list_import_stage",
+            records=records,
+            columns=HASH_LIST_IMPORT_COLUMNS,
+            schema_name="pg_temp"
+        )
+        result = await db.execute(text(HASH_LIST_IMPORT_APPLY_SQL))
+        counts = dict(result.mappings().one())
+        await db.commit()
+        counts["unchanged"] = len(records) - counts["created"] - counts["updated"] - counts["deleted"]
+        return counts
+
+    except SQLAlchemyError as e:
+        await db.rollback()
+        raise SQLAlchemyError(f"Database error: {e}")
+    except Exception as e:
+        await db.rollback()
+        raise e
+    finally:
+        if own_session:
+            await db.close()
+
+"""
+Выдаёт вердикт известным файлам по списку хэшей без сканирования сигнатурами
+Файлам, чей content_hash есть в antivirus.hash_list, записывается scan_result в формате сканирования:
+для MALICIOUS - одно совпадение без позиции (signatureId и смещения null, threatName из списка, source 'hash_list'),
+для CLEAN - пустой список. Строка files обновляется, только если сохранённый scan_result отличается: повторная
+проверка известного файла не меняет updated_at (ETag, срок хранения содержимого) и не пишет в таблицу.
+Содержимое файла не читается, поэтому вердикт выдаётся и после удаления содержимого политикой хранения
+:param file_ids: UUID файлов
+:param db: Сессия запроса (None - открыть собственную сессию)
+:return: Словарь UUID -> информация о файле (как у scan_file_with_rabin_karp) с полем hash_list
+         только для файлов, найденных в списке
+"""
+async def apply_hash_list_verdicts(file_ids: List[UUID], db: Optional[AsyncSession] = None) -> dict:
+    if not file_ids:
+        return {}
+    own_session = db is None
+    if own_session:
+        db = new_async_session()
+    try:
+        result = await db.execute(
+            text("""
+                WITH known AS (
+                    SELECT f.id, f.name, f.size, f.scan_result AS stored_scan_result, f.created_at, f.updated_at,
+                           h.sha256, h.verdict, h.threat_name,
+                           CASE
+                               WHEN h.verdict = 'MALICIOUS' THEN jsonb_build_array(jsonb_build_object(
+                                   'signatureId', NULL,
+                                   'threatName', h.threat_name,
+                                   'offsetFromStart', NULL,
+                                   'offsetFromEnd', NULL,
+                                   'matched', TRUE,
+                                   'source', 'hash_list'
+                               ))
+                               ELSE '[]'::JSONB
+                           END AS scan_result
+                    FROM antivirus.files AS f
+                    JOIN antivirus.hash_list AS h ON h.sha256 = f.content_hash
+                    WHERE f.id = ANY(CAST(:file_ids AS UUID[]))
+                ),
+                changed AS (
+                    UPDATE antivirus.files AS f
+                    SET scan_result = k.scan_result,
+                        updated_at = NOW()
+                    FROM known AS k
+                    WHERE f.id = k.id
+                      AND k.stored_scan_result IS DISTINCT FROM k.scan_result
+                    RETURNING f.id, f.updated_at
+                )
+                SELECT k.id, k.name, k.size, k.scan_result, k.created_at,
+                       COALESCE(c.updated_at, k.updated_at) AS updated_at,
+                       encode(k.sha256, 'hex') AS sha256, k.verdict, k.threat_name
+                FROM known AS k
+                LEFT JOIN changed AS c ON c.id = k.id
+            """),
+            {"file_ids": list(file_ids)}
+        )
+        rows = result.all()
+        await db.commit()
+        return {
+            row.id: {
+                "id": str(row.id),
+                "name": row.name,
+                "size": row.size,
+                "scan_result": row.scan_result,
+                "created_at": row.created_at,
+                "updated_at": row.updated_at,
+                "hash_list": {"sha256": row.sha256, "verdict": row.verdict, "threat_name": row.threat_name}
+            }
+            for row in rows
+        }
+
+    except SQLAlchemyError as e:
+        await db.rollback()
+        raise SQLAlchemyError(f"Database error: {e}")
+    finally:
+        if own_session:
+            await db.close()
+
+"""
+Добавляет накопленные в процессе срабатывания к счётчикам antivirus.hash_list одним UPDATE
+Строки обновляются в порядке ключа, чтобы воркеры не взаимоблокировались
+:param hits: Словарь SHA-256 (hex) -> количество вердиктов
+:return: Количество обновлённых записей
+"""
+async def flush_hash_list_hits(hits: dict) -> int:
+    if not hits:
+        return 0
+    keys = sorted(hits)
+    db = new_async_session()
+    try:
+        result = await db.execute(
+            text("""
+                UPDATE antivirus.hash_list AS h
+                SET hit_count = h.hit_count + u.hits,
+                    last_hit_at = NOW()
+                FROM (
+                    SELECT u.sha256, u.hits
+                    FROM unnest(CAST(:sha256 AS BYTEA[]), CAST(:hits AS BIGINT[])) AS u(sha256, hits)
+                    ORDER BY u.sha256
+                ) AS u
+                WHERE h.sha256 = u.sha256
+            """),
+            {"sha256": [bytes.fromhex(key) for key in keys], "hits": [hits[key] for key in keys]}
+        )
+        await db.commit()
+        return result.rowcount
+
+    except SQLAlchemyError as e:
+        await db.rollback()
+        raise SQLAlchemyError(f"Database error: {e}")
+    finally:
+        await db.close()
+
 """
 Вызывает функцию antivirus.scan_file_with_rabin_karp для сканирования файла
 :param file_id: UUID файла для сканирования (обязательный)
 :param signature_id: UUID сигнатуры для сканирования (опциональный)
+:param db: Сессия запроса (None - открыть собственную сессию)
 :return: Результат сканирования в виде словаря
 """
-def scan_file_with_rabin_karp(file_id: UUID, signature_id: Optional[UUID] = None) -> dict:
-    db = next(get_db())
+async def scan_file_with_rabin_karp(file_id: UUID, signature_id: Optional[UUID] = None, db: Optional[AsyncSession] = None) -> dict:
+    own_session = db is None
+    if own_session:
+        db = new_async_session()
     try:
         query = text("""
             SELECT antivirus.scan_file_with_rabin_karp(:file_id, :signature_id) as scan_result
@@ -390,28 +1644,217 @@ def scan_file_with_rabin_karp(file_id: UUID, signature_id: Optional[UUID] = None
             "signature_id": signature_id
         }
         
-        result = db.execute(query, params)
+        result = await db.execute(query, params)
         scan_result = result.scalar()
-        db.commit()
+        await db.commit()
         
         return scan_result if scan_result else {}
         
     except SQLAlchemyError:
-        db.rollback()
+        await db.rollback()
         return {}
     finally:
-        db.close()
-        
+        if own_session:
+            await db.close()
+
+"""
+Сканирует файл набором сигнатур на момент времени as_of (воспроизведение прежнего вердикта)
+Набор восстанавливается из history один раз и кэшируется (get_signature_snapshot_as_of), сканирование идёт
+в процессе тем же алгоритмом, что и antivirus.scan_content_with_rabin_karp; результат в files не сохраняется
+:param file_id: UUID файла для сканирования
+:param as_of: Момент времени, на который восстанавливается набор сигнатур
+:param signature_id: UUID сигнатуры для сканирования (опциональный)
+:param db: Сессия запроса (None - открыть собственную сессию)
+:return: Информация о файле с результатом сканирования (как у scan_file_with_rabin_karp) и as_of
+         или пустой словарь, если файл не найден или его содержимое удалено
+"""
+async def scan_file_as_of(
+    file_id: UUID,
+    as_of: datetime,
+    signature_id: Optional[UUID] = None,
+    db: Optional[AsyncSession] = None
+) -> dict:
+    own_session = db is None
+    if own_session:
+        db = new_async_session()
+    try:
+        result = await db.execute(
+            text("""
+                SELECT id, name, size, created_at, updated_at, content, content_purged_at
+                FROM antivirus.files
+                WHERE id = :id
+            """),
+            {"id": file_id}
+        )
+        row = result.one_or_none()
+        await db.commit()
+        if row is None or row.content_purged_at is not None:
+            return {}
+
+        snapshot = await get_signature_snapshot_as_of(as_of)
+        scan_result = await run_in_threadpool(scan_content_cached, snapshot, bytes(row.content), signature_id)
+        return {
+            "id": str(row.id),
+            "name": row.name,
+            "size": row.size,
+            "scan_result": scan_result,
+            "created_at": row.created_at,
+            "updated_at": row.updated_at,
+            "as_of": as_of
+        }
+
+    except SQLAlchemyError:
+        await db.rollback()
+        return {}
+    finally:
+        if own_session:
+            await db.close()
+
+"""
+Сканирует элементы архива, сохранённого в antivirus.files, функцией antivirus.scan_content_with_rabin_karp
+Элементы читаются в памяти (без распаковки на диск) и по одному передаются в базу;
+если кэш сигнатур загружен, элементы сканируются в процессе тем же алгоритмом без обращения к БД
+:param file_id: UUID файла-архива
+:param signature_id: UUID сигнатуры для сканирования (опциональный)
+:param limits: Лимиты распаковки (глубина, количество, размер)
+:param db: Сессия запроса (None - открыть собственную сессию)
+:param as_of: Сканировать набором сигнатур на этот момент времени (в процессе, см. scan_file_as_of)
+:return: Словарь с результатами по каждому элементу (members) и причиной остановки обхода (error)
+         или None если файл не найден или не является архивом.
+         Совпадения в элементах (кроме as_of) дописываются в scan_result файла записями с source = archive_member
+         и path элемента - по ним политика хранения отличает заражённый архив от чистого;
+         тогда в словаре также сохранённые scan_result и updated_at файла
+"""
+async def scan_archive_members(
+    file_id: UUID,
+    signature_id: Optional[UUID] = None,
+    limits: Optional[ArchiveLimits] = None,
+    db: Optional[AsyncSession] = None,
+    as_of: Optional[datetime] = None
+) -> Optional[dict]:
+    own_session = db is None
+    if own_session:
+        db = new_async_session()
+    try:
+        # Тип определяется по началу и концу содержимого (STORAGE EXTERNAL - срезы читаются без чтения всего значения),
+        # целиком в процесс загружаются только архивы
+        result = await db.execute(
+            text("""
+                SELECT substring(content from 1 for :head) AS head,
+                       substring(content from greatest(octet_length(content) - :tail + 1, 1)) AS tail
+                FROM antivirus.files
+                WHERE id = :id
+            """),
+            {"id": file_id, "head": ARCHIVE_SNIFF_HEAD, "tail": ARCHIVE_SNIFF_TAIL}
+        )
+        edges = result.one_or_none()
+        if edges is None or sniff_archive_type(bytes(edges.head), bytes(edges.tail)) is None:
+            return None
+        result = await db.execute(
+            text("SELECT content FROM antivirus.files WHERE id = :id"),
+            {"id": file_id}
+        )
+        content = result.scalar()
+        if content is None:
+            return None
+        content = bytes(content)
+
+        query = text("""
+            SELECT antivirus.scan_content_with_rabin_karp(:content, :signature_id) AS scan_result
+        """)
+
+        if as_of is not None:
+            snapshot = await get_signature_snapshot_as_of(as_of)
+        else:
+            snapshot = await get_signature_snapshot()
+        members = []
+        error = None
+        # Зашифрованные элементы и элементы с неподдерживаемым сжатием не прерывают обход:
+        # они попадают в результат с причиной в error и без scan_result
+        skipped = []
+        def add_skipped():
+            members.extend({"path": path, "size": None, "scan_result": None, "error": reason} for path, reason in skipped)
+            skipped.clear()
+
+        # Распаковка идёт в пуле потоков, чтобы большой архив не блокировал цикл событий
+        walker = walk_archive(content, limits or ArchiveLimits(), skipped=skipped)
+        try:
+            while True:
+                item = await run_in_threadpool(next, walker, None)
+                add_skipped()
+                if item is None:
+                    break
+                path, member_content = item
+                if snapshot is not None:
+                    scan_result = await run_in_threadpool(scan_content_cached, snapshot, member_content, signature_id)
+                else:
+                    result = await db.execute(query, {
+                        "content": member_content,
+                        "signature_id": signature_id
+                    })
+                    scan_result = result.scalar()
+                members.append({
+                    "path": path,
+                    "size": len(member_content),
+                    "scan_result": scan_result
+                })
+        except (ValueError, zipfile.BadZipFile, tarfile.TarError, zlib.error, EOFError) as e:
+            # Лимиты или повреждённый архив: возвращаем то, что успели просканировать
+            add_skipped()
+            error = str(e)
+
+        archive_result = {"members": members, "error": error}
+        matches = [
+            {**entry, "source": "archive_member", "path": member["path"]}
+            for member in members if member["scan_result"]
+            for entry in member["scan_result"] if entry["matched"]
+        ]
+        if matches and as_of is None:
+            result = await db.execute(
+                text("""
+                    UPDATE antivirus.files
+                    SET scan_result = COALESCE(scan_result, '[]'::JSONB) || CAST(:matches AS JSONB),
+                        updated_at = NOW()
+                    WHERE id = :id
+                    RETURNING scan_result, updated_at
+                """),
+                {"id": file_id, "matches": json.dumps(matches)}
+            )
+            stored = result.one()
+            archive_result["scan_result"] = stored.scan_result
+            archive_result["updated_at"] = stored.updated_at
+
+        await db.commit()
+        return archive_result
+
+    except SQLAlchemyError:
+        await db.rollback()
+        raise
+    finally:
+        if own_session:
+            await db.close()
+
 """
 Получает историю изменений сигнатур из таблицы antivirus.history
+Порядок стабильный: (recorded_at, history_id) по убыванию - по ключу секционирования,
+поэтому страница читается из последних месячных секций
 :param signature_id: UUID сигнатуры для фильтрации (опциональный)
 :param limit: Ограничение количества записей (опциональный)
-:return: Список словарей с историей изменений
+:param after: Ключ (recorded_at, history_id) последней записи предыдущей страницы
+:param db: Сессия запроса (None - открыть собственную сессию чтения, на реплике, если она доступна)
+:return: (JSON-массив текстом, количество строк, ключ последней строки или None)
 """
-def get_signatures_history(signature_id: Optional[UUID] = None, limit: Optional[int] = None) -> List[dict]:
-    db = next(get_db())
+async def get_signatures_history(
+    signature_id: Optional[UUID] = None,
+    limit: Optional[int] = None,
+    after: Optional[Tuple[datetime, int]] = None,
+    db: Optional[AsyncSession] = None
+) -> Tuple[str, int, Optional[list]]:
+    own_session = db is None
+    if own_session:
+        db = await new_async_read_session()
     try:
-        query = text("""
+        query = """
             SELECT 
                 json_build_object(
                     'history_id', history_id,
@@ -425,41 +1868,56 @@ def get_signatures_history(signature_id: Optional[UUID] = None, limit: Optional[
                     'offset_end', offset_end,
                     'status', status,
                     'version_created_at', version_created_at,
-                    'updated_at', updated_at
-                ) as history_entry
+                    'updated_at', updated_at,
+                    'recorded_at', recorded_at
+                ) AS item,
+                recorded_at,
+                history_id
             FROM antivirus.history
-            WHERE (:signature_id IS NULL OR id = :signature_id)
-            ORDER BY version_created_at DESC
-            LIMIT :limit
-        """)
+            WHERE (CAST(:signature_id AS UUID) IS NULL OR id = :signature_id)
+        """
         
         params = {
             "signature_id": signature_id,
             "limit": limit if limit is not None else 1000  # Дефолтный лимит
         }
+
+        # Следующая страница начинается сразу после ключа курсора
+        if after is not None:
+            query += " AND (recorded_at, history_id) < (:after_recorded_at, :after_history_id)"
+            params["after_recorded_at"], params["after_history_id"] = after
+
+        query += " ORDER BY recorded_at DESC, history_id DESC LIMIT :limit"
         
-        result = db.execute(query, params)
-        return [row[0] for row in result.fetchall()]
+        return await _fetch_json_list(db, query, params, ("recorded_at", "history_id"), descending=True)
         
     except SQLAlchemyError:
-        db.rollback()
-        return []
+        await db.rollback()
+        return EMPTY_JSON_LIST
     finally:
-        db.close()
+        if own_session:
+            await db.close()
         
 """
 Получает записи аудита из таблицы antivirus.audit
+Порядок стабильный: (recorded_at, audit_id) по убыванию - по ключу секционирования
 :param entity_type: Тип сущности для фильтрации (опционально)
 :param operation_type: Тип операции (опционально)
 :param limit: Ограничение количества записей (по умолчанию 100)
-:return: Список записей аудита в виде словарей
+:param after: Ключ (recorded_at, audit_id) последней записи предыдущей страницы
+:param db: Сессия запроса (None - открыть собственную сессию чтения, на реплике, если она доступна)
+:return: (JSON-массив текстом, количество строк, ключ последней строки или None)
 """
-def get_audit_logs(
+async def get_audit_logs(
     entity_type: Optional[str] = None,
     operation_type: Optional[str] = None,
-    limit: int = 100
-) -> List[dict]:
-    db = next(get_db())
+    limit: int = 100,
+    after: Optional[Tuple[datetime, int]] = None,
+    db: Optional[AsyncSession] = None
+) -> Tuple[str, int, Optional[list]]:
+    own_session = db is None
+    if own_session:
+        db = await new_async_read_session()
     try:
         s_id = None
         if entity_type:
@@ -467,7 +1925,7 @@ def get_audit_logs(
         if operation_type=="":
             operation_type=None
 
-        query = text("""
+        query = """
             SELECT 
                 json_build_object(
                     'audit_id', audit_id,
@@ -475,35 +1933,161 @@ def get_audit_logs(
                     'changed_by', changed_by,
                     'change_type', change_type,
                     'changed_at', changed_at,
-                    'fields_changed', fields_changed
-                ) as audit_entry
+                    'fields_changed', fields_changed,
+                    'recorded_at', recorded_at
+                ) AS item,
+                recorded_at,
+                audit_id
             FROM antivirus.audit
-            WHERE (:operation_type IS NULL OR change_type = :operation_type) AND
-                  (:s_id IS NULL OR signature_id = :s_id)
-            ORDER BY audit_id DESC
-            LIMIT :limit
-        """)
-        print(query)
+            WHERE (CAST(:operation_type AS TEXT) IS NULL OR change_type = :operation_type) AND
+                  (CAST(:s_id AS UUID) IS NULL OR signature_id = :s_id)
+        """
         
         params = {
             "s_id": s_id,
             "operation_type": operation_type,
             "limit": limit
         }
+
+        # Следующая страница начинается сразу после ключа курсора
+        if after is not None:
+            query += " AND (recorded_at, audit_id) < (:after_recorded_at, :after_audit_id)"
+            params["after_recorded_at"], params["after_audit_id"] = after
+
+        query += " ORDER BY recorded_at DESC, audit_id DESC LIMIT :limit"
+        print(query)
         print(params)
-        result = db.execute(query, params)
-        return [row[0] for row in result.fetchall()]
+        return await _fetch_json_list(db, query, params, ("recorded_at", "audit_id"), descending=True)
         
     except SQLAlchemyError:
-        db.rollback()
-        return []
+        await db.rollback()
+        return EMPTY_JSON_LIST
     finally:
-        db.close()
+        if own_session:
+            await db.close()
+
+"""
+Читает результат запроса через серверный курсор и отдаёт его в формате NDJSON (одна JSON-строка на запись)
+Строки собираются в JSON на стороне PostgreSQL и не декодируются в Python; в памяти одновременно
+находится не больше batch_size записей, поэтому расход памяти не зависит от размера таблицы
+Выгрузка читается с реплики, если она доступна
+:param query: Запрос, возвращающий одну колонку - JSON записи текстом
+:param params: Параметры запроса
+:param batch_size: Количество записей, читаемых из курсора за один раз
+:return: Асинхронный генератор блоков NDJSON
+"""
+async def _iter_ndjson(query: str, params: dict, batch_size: int) -> AsyncIterator[bytes]:
+    db = await new_async_read_session()
+    try:
+        # Выгрузка видит один снимок данных, даже если таблица меняется во время чтения
+        await db.execute(text("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ"))
+        result = await db.stream(text(query), params, execution_options={"yield_per": batch_size})
+        async for rows in result.partitions(batch_size):
+            yield ("\n".join(row[0] for row in rows) + "\n").encode("utf-8")
+        await db.commit()
+    except SQLAlchemyError:
+        await db.rollback()
+        raise
+    finally:
+        await db.close()
+
+"""
+Выгружает все файлы (без содержимого) в формате NDJSON в порядке (created_at, id) по убыванию
+:param batch_size: Количество записей, читаемых из курсора за один раз
+:return: Асинхронный генератор блоков NDJSON
+"""
+def iter_files_ndjson(batch_size: int = 1000) -> AsyncIterator[bytes]:
+    query = """
+        SELECT 
+            json_build_object(
+                'id', id::text,
+                'name', name,
+                'size', size,
+                'scan_result', scan_result,
+                'created_at', created_at,
+                'updated_at', updated_at
+            )::text AS item
+        FROM antivirus.files
+        ORDER BY created_at DESC, id DESC
+    """
+    return _iter_ndjson(query, {}, batch_size)
+
+"""
+Выгружает актуальные сигнатуры в формате NDJSON в порядке (updated_at, id) по убыванию
+:param since: Необязательная дата для фильтрации (только записи, обновленные после этой даты)
+:param batch_size: Количество записей, читаемых из курсора за один раз
+:return: Асинхронный генератор блоков NDJSON
+"""
+def iter_signatures_ndjson(since: Optional[datetime] = None, batch_size: int = 1000) -> AsyncIterator[bytes]:
+    query = """
+        SELECT 
+            json_build_object(
+                'id', id::text,
+                'threat_name', threat_name,
+                'first_bytes', first_bytes,
+                'remainder_hash', remainder_hash,
+                'remainder_length', remainder_length,
+                'file_type', file_type,
+                'offset_start', offset_start,
+                'offset_end', offset_end,
+                'status', status,
+                'updated_at', updated_at
+            )::text AS item
+        FROM ONLY antivirus.signatures
+        WHERE status = 'ACTUAL'
+    """
+    params = {}
+    if since is not None:
+        query += " AND updated_at >= :since"
+        params["since"] = since
+    query += " ORDER BY updated_at DESC, id DESC"
+    return _iter_ndjson(query, params, batch_size)
+
+"""
+Выгружает записи аудита в формате NDJSON в порядке (recorded_at, audit_id) по убыванию
+:param signature_id: UUID сигнатуры для фильтрации (опционально)
+:param operation_type: Тип операции (опционально)
+:param batch_size: Количество записей, читаемых из курсора за один раз
+:return: Асинхронный генератор блоков NDJSON
+"""
+def iter_audit_ndjson(
+    signature_id: Optional[UUID] = None,
+    operation_type: Optional[str] = None,
+    batch_size: int = 1000
+) -> AsyncIterator[bytes]:
+    query = """
+        SELECT 
+            json_build_object(
+                'audit_id', audit_id,
+                'signature_id', signature_id,
+                'changed_by', changed_by,
+                'change_type', change_type,
+                'changed_at', changed_at,
+                'fields_changed', fields_changed,
+                'recorded_at', recorded_at
+            )::text AS item
+        FROM antivirus.audit
+        WHERE TRUE
+    """
+    params = {}
+    if signature_id is not None:
+        query += " AND signature_id = :signature_id"
+        params["signature_id"] = signature_id
+    if operation_type:
+        query += " AND change_type = :operation_type"
+        params["operation_type"] = operation_type
+    query += " ORDER BY recorded_at DESC, audit_id DESC"
+    return _iter_ndjson(query, params, batch_size)
 
     
 
 # Экспортируем для использования в моделях
-__all__ = ['call_files_iud_function', 'get_file_info_json', 'get_all_files_json', 
-           'delete_file_id', 'call_signatures_iud_function', 'get_actual_signatures_json',
-           'get_signatures_by_guids', 'get_signatures_by_status', 'scan_file_with_rabin_karp',
-           'get_signatures_history', 'get_audit_logs']        
+__all__ = ['call_files_iud_function', 'call_files_bulk_insert', 'get_file_info_json', 'get_file_updated_at', 'get_file_content_meta',
+           'open_file_content_snapshot', 'iter_file_content', 'get_all_files_json', 
+           'delete_file_id', 'purge_file_contents', 'maintain_partitions', 'get_partition_retention_start', 'list_detached_partitions', 'archive_partition',
+           'call_signatures_iud_function', 'call_signatures_bulk_import',
+           'get_actual_signatures_json', 'get_signatures_version', 'get_signatures_delta',
+           'get_signatures_by_guids', 'prepare_guid_lookup', 'iter_guid_lookup_json', 'iter_guid_reconcile_ndjson',
+           'get_signatures_by_status', 'get_signature_duplicates', 'scan_file_with_rabin_karp', 'scan_file_as_of', 'scan_archive_members',
+           'call_hash_list_import', 'apply_hash_list_verdicts', 'flush_hash_list_hits',
+           'get_signatures_history', 'get_audit_logs', 'iter_files_ndjson', 'iter_signatures_ndjson', 'iter_audit_ndjson']        
@@ -0,0 +1,179 @@
+"""
+Проверка планов выполнения основных запросов чтения
+Для каждого запроса выполняется EXPLAIN с запретом последовательного сканирования (enable_seqscan = off)
+и проверяется, что план использует ожидаемый индекс. Если индекса нет, в плане остаётся Seq Scan
+или сканирование другого индекса с фильтром, и проверка завершается ошибкой.
+Для секционированных таблиц (history, audit) индексы секций сопоставляются с индексом родительской таблицы.
+Запуск: python explain.py (настройки подключения из .env)
+"""
+
+import json
+import sys
+from datetime import datetime
+from uuid import uuid4
+from sqlalchemy import text
+from database import init_db
+
+# Запросы повторяют условия и сортировку функций dbengine: (SQL, параметры, ожидаемый индекс)
+HOT_QUERIES = {
+    "files_page": (
+        """
+        SELECT id FROM antivirus.files
+        WHERE (created_at, id) < (:after_created_at, :after_id)
+        ORDER BY created_at DESC, id DESC
+        LIMIT 100
+        """,
+        {"after_created_at": datetime.now(), "after_id": uuid4()},
+        "ix_files_created_at_id"
+    ),
+    "actual_signatures": (
+        """
+        SELECT id FROM ONLY antivirus.signatures
+        WHERE status = 'ACTUAL'
+        ORDER BY updated_at DESC, id DESC
+        LIMIT 100
+        """,
+        {},
+        "ix_signatures_status_updated_at_id"
+    ),
+    "signatures_by_status": (
+        """
+        SELECT id FROM ONLY antivirus.signatures
+        WHERE status = :status
+        ORDER BY updated_at DESC
+        """,
+        {"status": "DELETED"},
+        "ix_signatures_status_updated_at_id"
+    ),
+    "history_by_signature": (
+        """
+        SELECT history_id FROM antivirus.history
+        WHERE id = :signature_id
+        ORDER BY recorded_at DESC, history_id DESC
+        LIMIT 100
+        """,
+        {"signature_id": uuid4()},
+        "ix_history_id_recorded_at"
+    ),
+    "history_page": (
+        """
+        SELECT history_id FROM antivirus.history
+        ORDER BY recorded_at DESC, history_id DESC
+        LIMIT 100
+        """,
+        {},
+        "ix_history_recorded_at"
+    ),
+    "audit_by_signature": (
+        """
+        SELECT audit_id FROM antivirus.audit
+        WHERE signature_id = :signature_id
+        ORDER BY recorded_at DESC, audit_id DESC
+        LIMIT 100
+        """,
+        {"signature_id": uuid4()},
+        "ix_audit_signature_id_recorded_at"
+    ),
+    "audit_by_operation": (
+        """
+        SELECT audit_id FROM antivirus.audit
+        WHERE change_type = :operation_type
+        ORDER BY recorded_at DESC, audit_id DESC
+        LIMIT 100
+        """,
+        {"operation_type": "UPDATED"},
+        "ix_audit_change_type_recorded_at"
+    ),
+    "audit_page": (
+        """
+        SELECT audit_id FROM antivirus.audit
+        WHERE (recorded_at, audit_id) < (:after_recorded_at, :after_audit_id)
+        ORDER BY recorded_at DESC, audit_id DESC
+        LIMIT 100
+        """,
+        {"after_recorded_at": datetime.now(), "after_audit_id": 2 ** 31 - 1},
+        "ix_audit_recorded_at"
+    ),
+}
+
+
+"""
+Собирает узлы плана: таблицы, читаемые последовательным сканированием, и использованные индексы
+"""
+def _walk_plan(plan: dict, seq_scans: list, indexes: list):
+    if plan.get("Node Type") == "Seq Scan":
+        seq_scans.append(plan.get("Relation Name"))
+    if "Index Name" in plan:
+        indexes.append(plan["Index Name"])
+    for child in plan.get("Plans", []):
+        _walk_plan(child, seq_scans, indexes)
+
+"""
+Заменяет индексы секций на индексы родительских таблиц, остальные имена возвращает без изменений
+"""
+def _root_index_names(conn, indexes: list) -> list:
+    if not indexes:
+        return indexes
+    rows = conn.execute(text("""
+        SELECT i.relname AS name, r.relname AS root
+        FROM pg_class i
+        JOIN pg_namespace n ON n.oid = i.relnamespace
+        JOIN pg_class r ON r.oid = COALESCE(pg_partition_root(i.oid), i.oid)
+        WHERE n.nspname = 'antivirus' AND i.relname = ANY(:names)
+    """), {"names": indexes}).fetchall()
+    roots = {row.name: row.root for row in rows}
+    return [roots.get(name, name) for name in indexes]
+
+"""
+Выполняет EXPLAIN для всех запросов из HOT_QUERIES
+:param conn: Соединение SQLAlchemy (синхронное)
+:return: Словарь {имя запроса: {"plan", "seq_scans", "indexes", "expected_index", "ok"}}
+"""
+def explain_hot_queries(conn) -> dict:
+    report = {}
+    # Настройка действует только внутри транзакции проверки
+    conn.execute(text("SET LOCAL enable_seqscan = off"))
+    for name, (sql, params, expected_index) in HOT_QUERIES.items():
+        plan_json = conn.execute(text("EXPLAIN (FORMAT JSON) " + sql), params).scalar()
+        if isinstance(plan_json, str):
+            plan_json = json.loads(plan_json)
+        plan_text = "\n".join(
+            row[0] for row in conn.execute(text("EXPLAIN " + sql), params).fetchall()
+        )
+        seq_scans, indexes = [], []
+        _walk_plan(plan_json[0]["Plan"], seq_scans, indexes)
+        indexes = _root_index_names(conn, indexes)
+        report[name] = {
+            "plan": plan_text,
+            "seq_scans": seq_scans,
+            "indexes": indexes,
+            "expected_index": expected_index,
+            "ok": not seq_scans and expected_index in indexes
+        }
+    return report
+
+
+__all__ = ['HOT_QUERIES', 'explain_hot_queries']
+
+
+if __name__ == "__main__":
+    engine = init_db()
+    if engine is None:
+        sys.exit("Не удалось подключиться к базе данных")
+    with engine.begin() as conn:
+        report = explain_hot_queries(conn)
+    failed = []
+    for name, result in report.items():
+        if result["ok"]:
+            status = "OK"
+        elif result["seq_scans"]:
+            status = "SEQ SCAN: " + ", ".join(result["seq_scans"])
+        else:
+            status = f"expected index {result['expected_index']} not used"
+        print(f"== {name}: {status}")
+        print(result["plan"])
+        print()
+        if not result["ok"]:
+            failed.append(name)
+    if failed:
+        sys.exit(f"Запросы без подходящего индекса: {', '.join(failed)}")
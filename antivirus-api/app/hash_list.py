@@ -0,0 +1,90 @@
+"""
+Список известных хэшей файлов (antivirus.hash_list): счётчики вердиктов, выданных без сканирования сигнатурами
+Доля попаданий и объём несканированных данных считаются в памяти процесса (GET /metrics/hash-list).
+Срабатывания записей копятся в памяти и раз в HASH_LIST_HIT_FLUSH_INTERVAL секунд добавляются к
+hash_list.hit_count одним UPDATE: популярный файл не превращает каждую проверку в запись одной и той же строки
+"""
+
+import asyncio
+import logging
+from typing import Iterable
+from config import settings
+from dbengine import flush_hash_list_hits
+
+logger = logging.getLogger(__name__)
+
+# SHA-256 (hex) -> количество вердиктов, ещё не добавленных к hash_list.hit_count
+_pending_hits = {}
+
+_hash_list_stats = {
+    "lookups": 0,             # Проверок файлов по списку
+    "hits_clean": 0,          # Вердиктов CLEAN без сканирования
+    "hits_malicious": 0,      # Вердиктов MALICIOUS без сканирования
+    "misses": 0,              # Файлов, отправленных на сканирование сигнатурами
+    "bytes_not_scanned": 0,   # Суммарный размер файлов, не просканированных благодаря списку
+    "flush_errors": 0         # Неудачных записей счётчиков в БД
+}
+
+"""
+Учитывает результат проверки файлов по списку хэшей
+:param lookups: Количество проверенных файлов
+:param hits: Результаты apply_hash_list_verdicts для файлов, найденных в списке
+"""
+def record_hash_list_lookups(lookups: int, hits: Iterable[dict]):
+    found = 0
+    for hit in hits:
+        found += 1
+        verdict = hit["hash_list"]["verdict"]
+        _hash_list_stats["hits_malicious" if verdict == "MALICIOUS" else "hits_clean"] += 1
+        _hash_list_stats["bytes_not_scanned"] += hit["size"] or 0
+        sha256 = hit["hash_list"]["sha256"]
+        _pending_hits[sha256] = _pending_hits.get(sha256, 0) + 1
+    _hash_list_stats["lookups"] += lookups
+    _hash_list_stats["misses"] += lookups - found
+
+"""
+Записывает накопленные срабатывания в hash_list.hit_count; при ошибке они вернутся в очередь до следующей записи
+:return: Количество обновлённых записей
+"""
+async def flush_pending_hash_list_hits() -> int:
+    global _pending_hits
+    if not _pending_hits:
+        return 0
+    hits, _pending_hits = _pending_hits, {}
+    try:
+        return await flush_hash_list_hits(hits)
+    except Exception:
+        _hash_list_stats["flush_errors"] += 1
+        for sha256, count in hits.items():
+            _pending_hits[sha256] = _pending_hits.get(sha256, 0) + count
+        raise
+
+"""
+Бесконечный цикл записи счётчиков срабатываний, запускается из startup_event
+"""
+async def hash_list_worker():
+    logger.info(f"Hash list hit counter started. Flush interval: {settings.HASH_LIST_HIT_FLUSH_INTERVAL}")
+    while True:
+        await asyncio.sleep(settings.HASH_LIST_HIT_FLUSH_INTERVAL)
+        try:
+            await flush_pending_hash_list_hits()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Hash list hit counter error: {str(e)}", exc_info=True)
+
+"""
+Возвращает счётчики проверок по списку хэшей и долю попаданий
+"""
+def get_hash_list_stats() -> dict:
+    hits = _hash_list_stats["hits_clean"] + _hash_list_stats["hits_malicious"]
+    lookups = _hash_list_stats["lookups"]
+    return {
+        **_hash_list_stats,
+        "enabled": settings.HASH_LIST_ENABLED,
+        "hit_rate": hits / lookups if lookups else None,
+        "pending_hits": sum(_pending_hits.values())
+    }
+
+
+__all__ = ['record_hash_list_lookups', 'flush_pending_hash_list_hits', 'hash_list_worker', 'get_hash_list_stats']
@@ -1,15 +1,32 @@
-﻿from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Body, Query
+﻿from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Body, Query, Header, Depends, Request
 from uuid import UUID
 from pathlib import Path
 import uvicorn
 from typing import List, Optional
-from fastapi.responses import JSONResponse
-from database import check_and_create_postgres_db, get_database_engine, create_tables, init_db
-from dbengine import call_files_iud_function, get_file_info_json, get_all_files_json, delete_file_id, call_signatures_iud_function, get_actual_signatures_json
-from dbengine import get_signatures_by_guids, get_signatures_by_status, scan_file_with_rabin_karp, get_signatures_history, get_audit_logs
+from urllib.parse import quote
+from fastapi.responses import JSONResponse, ORJSONResponse, Response, StreamingResponse
+from starlette.background import BackgroundTask
+from database import check_and_create_postgres_db, get_database_engine, create_tables, init_db, init_async_db, close_async_db, get_async_db, get_async_read_db, get_pool_stats, get_replica_stats
+from dbengine import call_files_iud_function, call_files_bulk_insert, get_file_info_json, get_file_updated_at, get_file_content_meta, open_file_content_snapshot, iter_file_content, get_all_files_json, delete_file_id, call_signatures_iud_function, call_signatures_bulk_import, get_actual_signatures_json, get_signatures_version, get_signatures_delta
+from dbengine import get_signatures_by_guids, prepare_guid_lookup, iter_guid_lookup_json, iter_guid_reconcile_ndjson, get_signatures_by_status, get_signature_duplicates, scan_file_with_rabin_karp, scan_file_as_of, scan_archive_members, get_signatures_history, get_audit_logs
+from dbengine import iter_files_ndjson, iter_signatures_ndjson, iter_audit_ndjson, call_hash_list_import, apply_hash_list_verdicts
+from archive import ArchiveLimits, iter_archive_members
+from pagination import InvalidCursorError, decode_cursor, next_page_cursor
+from config import settings
+from retention import retention_worker
+from partitions import partition_worker, history_retained_since
+from signature_cache import signature_listener, get_signature_cache_stats, get_known_signature_version, to_db_local_time
+from byte_range import parse_range
+from response_cache import etag_matches, count_not_modified, get_cached_response, store_cached_response, get_response_cache_stats
+from hash_list import record_hash_list_lookups, flush_pending_hash_list_hits, hash_list_worker, get_hash_list_stats
+import aiofiles
+import asyncio
+import orjson
 import logging
 from logging.handlers import RotatingFileHandler
 from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
 from datetime import datetime
 
 
@@ -35,7 +52,10 @@ file_handler.setFormatter(logging.Formatter(
 logger.addHandler(file_handler)
 logger.addHandler(logging.StreamHandler())
 
-app = FastAPI(title="Antivirus File Storage API")
+# ORJSONResponse по умолчанию: orjson сериализует UUID и datetime без преобразований в Python.
+# Обработчики с большими ответами возвращают ORJSONResponse сами, минуя jsonable_encoder
+# (замер: python bench_json.py)
+app = FastAPI(title="Antivirus File Storage API", default_response_class=ORJSONResponse)
 
 # Инициализация базы данных при старте приложения
 @app.on_event("startup")
@@ -55,18 +75,62 @@ async def startup_event():
         # 3. Создаём таблицы
         logger.info("Создание таблиц...")
         create_tables()
+
+        # 4. Открываем асинхронный пул соединений для обработчиков API
+        logger.info("Инициализация асинхронного пула соединений...")
+        await init_async_db()
         logger.info("База данных готова!")
+
+        # 5. Запускаем фоновую очистку содержимого по политике хранения
+        if settings.RETENTION_ENABLED:
+            app.state.retention_task = asyncio.create_task(retention_worker())
+
+        # 6. Запускаем обслуживание секций history и audit (создание заранее, выгрузка старых)
+        app.state.partition_task = asyncio.create_task(partition_worker())
+
+        # 7. Подписываемся на уведомления об изменении набора сигнатур для кэша в памяти
+        if settings.SIGNATURE_CACHE_ENABLED:
+            app.state.signature_cache_task = asyncio.create_task(signature_listener())
+
+        # 8. Запускаем запись счётчиков срабатываний списка известных хэшей
+        if settings.HASH_LIST_ENABLED:
+            app.state.hash_list_task = asyncio.create_task(hash_list_worker())
         
     except Exception as e:
         logger.critical(f"Ошибка инициализации базы: {str(e)}", exc_info=True)
         raise RuntimeError("Не удалось запустить базу данных")
+
+# Остановка фоновых задач при завершении приложения
+@app.on_event("shutdown")
+async def shutdown_event():
+    retention_task = getattr(app.state, "retention_task", None)
+    if retention_task is not None:
+        retention_task.cancel()
+    partition_task = getattr(app.state, "partition_task", None)
+    if partition_task is not None:
+        partition_task.cancel()
+    signature_cache_task = getattr(app.state, "signature_cache_task", None)
+    if signature_cache_task is not None:
+        signature_cache_task.cancel()
+    hash_list_task = getattr(app.state, "hash_list_task", None)
+    if hash_list_task is not None:
+        hash_list_task.cancel()
+        # Срабатывания, накопленные после последней записи, не теряются при остановке
+        try:
+            await flush_pending_hash_list_hits()
+        except Exception as e:
+            logger.error(f"Hash list hit counter error on shutdown: {str(e)}", exc_info=True)
+    await close_async_db()
 """
 Создает или обновляет файл в базе данных
 - **file**: Файл для загрузки (обязательно)
+Если SHA-256 файла есть в списке известных хэшей, вердикт сразу записывается в scan_result
+и возвращается в поле hash_list
 """
 @app.post("/files/upload")
 async def create_file_db(
-    file: UploadFile = File(...)
+    file: UploadFile = File(...),
+    db: AsyncSession = Depends(get_async_db)
 ):
     try:
         logger.info(f"Starting file upload. Filename: {file.filename}")
@@ -78,15 +142,16 @@ async def create_file_db(
         
         # Сохраняем временный файл
         logger.debug(f"Saving temporary file to: {file_path}")
-        with open(file_path, "wb") as buffer:
-            buffer.write(await file.read())
+        async with aiofiles.open(file_path, "wb") as buffer:
+            await buffer.write(await file.read())
         logger.info(f"Temporary file saved. Size: {file_path.stat().st_size} bytes")
 
         # Вызов функции обработки с именем файла из file.filename
         logger.debug("Calling files_iud_function")
-        result_uuid = call_files_iud_function(
+        result_uuid = await call_files_iud_function(
             name=file.filename,  # Используем имя файла из объекта UploadFile
-            file_path=str(file_path))
+            file_path=str(file_path),
+            db=db)
         logger.info(f"File successfully processed. UUID: {result_uuid}")
 
         # Удаляем временный файл
@@ -95,7 +160,17 @@ async def create_file_db(
             file_path.unlink()
             logger.debug("Temporary file removed")
 
-        return {"file_id": str(result_uuid)}
+        response = {"file_id": str(result_uuid)}
+
+        # Известный файл: вердикт из списка хэшей без сканирования сигнатурами
+        if settings.HASH_LIST_ENABLED:
+            known = await apply_hash_list_verdicts([result_uuid], db=db)
+            record_hash_list_lookups(1, known.values())
+            if result_uuid in known:
+                logger.info(f"File {result_uuid} found in hash list: {known[result_uuid]['hash_list']['verdict']}")
+                response["hash_list"] = known[result_uuid]["hash_list"]
+
+        return response
     
     except FileNotFoundError as e:
         logger.error(f"File not found error: {str(e)}")
@@ -109,13 +184,89 @@ async def create_file_db(
     except Exception as e:
         logger.critical(f"Unexpected error: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail="Internal server error")
-        
+
+"""
+Пакетная загрузка файлов одной транзакцией
+- **files**: Список файлов (multipart, несколько частей с именем files)
+- **archive**: Если true, каждая часть считается zip/tar/gzip архивом и в базу записываются файлы из него
+Возвращает список UUID созданных файлов в порядке загрузки и вердикты файлов из списка известных хэшей
+(hash_list: UUID -> вердикт), записанные в их scan_result
+"""
+@app.post("/files/upload/bulk")
+async def create_files_bulk_db(
+    files: List[UploadFile] = File(...),
+    archive: bool = Query(False),
+    db: AsyncSession = Depends(get_async_db)
+):
+    try:
+        logger.info(f"Starting bulk upload. Parts: {len(files)}, archive mode: {archive}")
+
+        # Читаем части запроса в память без временных файлов
+        items = []
+        limits = ArchiveLimits(
+            max_members=settings.BULK_UPLOAD_MAX_FILES,
+            max_member_size=settings.ARCHIVE_MAX_MEMBER_SIZE,
+            max_total_size=settings.ARCHIVE_MAX_TOTAL_SIZE
+        )
+        for upload in files:
+            content = await upload.read()
+            if archive:
+                # Распаковка в пуле потоков, чтобы не блокировать цикл событий
+                members = await run_in_threadpool(lambda: list(iter_archive_members(content, limits)))
+                for member_name, member_content in members:
+                    # У gzip нет имени элемента, берём имя самого архива
+                    items.append((member_name or Path(upload.filename or "").stem, member_content))
+            else:
+                items.append((upload.filename or "", content))
+            if len(items) > settings.BULK_UPLOAD_MAX_FILES:
+                logger.error(f"Bulk upload exceeds limit of {settings.BULK_UPLOAD_MAX_FILES} files")
+                raise HTTPException(
+                    status_code=413,
+                    detail=f"Too many files in one request (max {settings.BULK_UPLOAD_MAX_FILES})"
+                )
+
+        if not items:
+            logger.error("No files found in bulk upload")
+            raise HTTPException(status_code=400, detail="No files to upload")
+
+        file_ids = await call_files_bulk_insert(items, settings.BULK_UPLOAD_BATCH_SIZE, db=db)
+        logger.info(f"Bulk upload processed. Files stored: {len(file_ids)}")
+
+        response = {"file_ids": [str(file_id) for file_id in file_ids]}
+
+        # Известные файлы: вердикты из списка хэшей одним запросом
+        if settings.HASH_LIST_ENABLED:
+            known = await apply_hash_list_verdicts(file_ids, db=db)
+            record_hash_list_lookups(len(file_ids), known.values())
+            logger.info(f"Bulk upload files found in hash list: {len(known)}")
+            response["hash_list"] = {str(file_id): hit["hash_list"] for file_id, hit in known.items()}
+
+        return response
+
+    except ValueError as e:
+        logger.error(f"Value error: {str(e)}")
+        raise HTTPException(status_code=400, detail=str(e))
+    except SQLAlchemyError as e:
+        logger.error(f"Database error: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Database operation failed")
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.critical(f"Unexpected error: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Internal server error")
+
 """
 Получает информацию о файле по его UUID
 - **file_id**: UUID файла в базе данных
+ETag ответа - время последнего изменения файла: при совпадении с If-None-Match возвращается 304,
+неизменившийся ответ отдаётся из кэша без сборки JSON в БД
 """
 @app.get("/files/{file_id}")
-async def get_file_info(file_id: str):
+async def get_file_info(
+    file_id: str,
+    if_none_match: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_async_read_db)
+):
     try:
         logger.info(f"Request received for file info. File ID: {file_id}")
         
@@ -123,18 +274,36 @@ async def get_file_info(file_id: str):
         logger.debug(f"Validating UUID format: {file_id}")
         file_uuid = UUID(file_id)
         logger.debug("UUID format is valid")
+
+        # Версия файла читается лёгким запросом по первичному ключу
+        cache_key = ("file", file_uuid)
+        updated_at = await get_file_updated_at(file_uuid, db=db)
+        if updated_at is None:
+            logger.warning(f"File not found in database. File ID: {file_id}")
+            raise HTTPException(status_code=404, detail="File not found")
+
+        cached = _cached_response(cache_key, f'"{updated_at}"', if_none_match)
+        if cached is not None:
+            logger.info(f"File info served from cache. File ID: {file_id}, status: {cached.status_code}")
+            return cached
         
         # Получение информации о файле
         logger.debug("Fetching file info from database")
-        file_info = get_file_info_json(file_uuid)
+        file_info = await get_file_info_json(file_uuid, db=db)
         
         if not file_info:
             logger.warning(f"File not found in database. File ID: {file_id}")
             raise HTTPException(status_code=404, detail="File not found")
         
         logger.info(f"Successfully retrieved file info. File: {file_info.get('name')}, Size: {file_info.get('size')} bytes")
-        return file_info
+        # ETag по прочитанной записи: файл мог измениться между двумя запросами
+        etag = f'"{file_info["updated_at"]}"'
+        body = orjson.dumps(file_info)
+        store_cached_response(cache_key, etag, body)
+        return Response(content=body, media_type="application/json", headers={"ETag": etag})
         
+    except HTTPException:
+        raise
     except ValueError as e:
         logger.error(f"Invalid UUID format: {file_id}. Error: {str(e)}")
         raise HTTPException(status_code=400, detail="Invalid UUID format")
@@ -145,27 +314,181 @@ async def get_file_info(file_id: str):
         logger.critical(f"Unexpected error fetching file {file_id}. Error: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail="Internal server error")
         
+"""
+Отдает содержимое файла потоком с поддержкой HTTP Range и ETag
+- **file_id**: UUID файла в базе данных
+Содержимое читается из БД блоками по DOWNLOAD_CHUNK_SIZE и не загружается в память целиком
+"""
+@app.get("/files/{file_id}/content")
+async def get_file_content(
+    file_id: str,
+    range_header: Optional[str] = Header(None, alias="Range"),
+    if_none_match: Optional[str] = Header(None),
+    if_range: Optional[str] = Header(None)
+):
+    try:
+        logger.info(f"Request received for file content. File ID: {file_id}, Range: {range_header}")
+
+        file_uuid = UUID(file_id)
+        # Метаданные и содержимое читаются из одного снимка: ETag и Content-Length соответствуют отдаваемым байтам
+        content_db, meta = await open_file_content_snapshot(file_uuid)
+        streaming = False
+        try:
+            if meta is None:
+                logger.warning(f"File not found in database. File ID: {file_id}")
+                raise HTTPException(status_code=404, detail="File not found")
+
+            if meta["content_purged_at"] is not None:
+                logger.warning(f"File content purged by retention policy. File ID: {file_id}")
+                raise HTTPException(status_code=410, detail="File content was purged by retention policy")
+
+            size = meta["size"]
+            etag = f'"{meta["content_hash"]}"'
+            headers = {
+                "ETag": etag,
+                "Accept-Ranges": "bytes",
+                "Content-Disposition": f"attachment; filename*=UTF-8''{quote(meta['name'])}"
+            }
+
+            # Содержимое не изменилось с прошлого запроса клиента
+            if if_none_match and etag in [tag.strip() for tag in if_none_match.split(",")]:
+                logger.info(f"File content not modified. File ID: {file_id}")
+                return Response(status_code=304, headers=headers)
+
+            # If-Range с устаревшим ETag означает отдачу файла целиком
+            if if_range and if_range.strip() != etag:
+                range_header = None
+
+            try:
+                byte_range = parse_range(range_header, size)
+            except ValueError:
+                logger.warning(f"Range not satisfiable. File ID: {file_id}, Range: {range_header}, Size: {size}")
+                headers["Content-Range"] = f"bytes */{size}"
+                return Response(status_code=416, headers=headers)
+
+            status_code = 200
+            start, end = 0, size - 1
+            if byte_range is not None:
+                start, end = byte_range
+                status_code = 206
+                headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+            length = max(end - start + 1, 0)
+            headers["Content-Length"] = str(length)
+
+            logger.info(f"Streaming file content. File ID: {file_id}, Bytes: {start}-{end}/{size}")
+            streaming = True
+            return StreamingResponse(
+                iter_file_content(content_db, file_uuid, start, length, settings.DOWNLOAD_CHUNK_SIZE),
+                status_code=status_code,
+                media_type="application/octet-stream",
+                headers=headers,
+                # Сессия закрывается и тогда, когда клиент отключился до начала передачи содержимого
+                background=BackgroundTask(content_db.close)
+            )
+        finally:
+            # Содержимое не отдаётся (304, 404, 410, 416 или ошибка): снимок больше не нужен
+            if not streaming:
+                await content_db.close()
+
+    except ValueError as e:
+        logger.error(f"Invalid UUID format: {file_id}. Error: {str(e)}")
+        raise HTTPException(status_code=400, detail="Invalid UUID format")
+    except SQLAlchemyError as e:
+        logger.error(f"Database error while fetching content of file {file_id}. Error: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Database error")
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.critical(f"Unexpected error fetching content of file {file_id}. Error: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+"""
+Формирует ответ из JSON-массива, собранного в PostgreSQL (json_agg)
+Текст передаётся клиенту как есть, без декодирования строк и повторной сериализации в Python
+:param items: JSON-массив текстом
+:param next_cursor: Курсор следующей страницы (заголовок X-Next-Cursor)
+"""
+def _json_list_response(items: str, next_cursor: Optional[str] = None) -> Response:
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else None
+    return Response(content=items, media_type="application/json", headers=headers)
+
+"""
+Ответ на условный GET без построения: 304, если у клиента та же версия (If-None-Match),
+или готовый ответ из кэша, построенный при том же ETag
+:param cache_key: Ключ запроса в кэше ответов
+:param etag: Текущий ETag ресурса
+:param if_none_match: Заголовок If-None-Match запроса
+:return: Ответ или None - ответ нужно построить
+"""
+def _cached_response(cache_key: tuple, etag: str, if_none_match: Optional[str]) -> Optional[Response]:
+    if etag_matches(if_none_match, etag):
+        count_not_modified()
+        return Response(status_code=304, headers={"ETag": etag})
+    cached = get_cached_response(cache_key, etag)
+    if cached is None:
+        return None
+    body, headers = cached
+    return Response(content=body, media_type="application/json", headers={**headers, "ETag": etag})
+
+"""
+Строит JSON-список с ETag и сохраняет его в кэше ответов
+:param cache_key: Ключ запроса в кэше ответов
+:param etag: ETag версии данных, из которой построен список
+:param items: JSON-массив текстом
+:param next_cursor: Курсор следующей страницы (заголовок X-Next-Cursor)
+"""
+def _cached_json_list_response(cache_key: tuple, etag: str, items: str, next_cursor: Optional[str] = None) -> Response:
+    body = items.encode("utf-8")
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else {}
+    store_cached_response(cache_key, etag, body, headers)
+    return Response(content=body, media_type="application/json", headers={**headers, "ETag": etag})
+
+"""
+ETag списков сигнатур - версия набора. Версия берётся из кэша сигнатур без запроса к БД (список тогда строится
+из снимка не старше этой версии), иначе читается из сессии запроса до чтения списка, поэтому список
+никогда не старше своего ETag
+:param use_known_version: False - всегда читать версию из БД (список будет прочитан из БД)
+"""
+async def _signatures_etag(db: AsyncSession, use_known_version: bool = True) -> str:
+    version = get_known_signature_version() if use_known_version else None
+    if version is None:
+        version = await get_signatures_version(db=db)
+    return f'"signatures-{version}"'
+
 """
 Получает список всех файлов из базы данных
-Возвращает массив объектов с информацией о файлах
+- **limit**: Размер страницы (опционально, без limit и cursor возвращаются все файлы)
+- **cursor**: Курсор страницы из заголовка X-Next-Cursor предыдущего ответа (опционально)
+Возвращает массив объектов с информацией о файлах, отсортированный по (created_at, id) по убыванию
+Если есть следующая страница, её курсор передаётся в заголовке X-Next-Cursor
 """
 @app.get("/allfiles", response_model=List[dict])
-async def get_all_files():
+async def get_all_files(
+    limit: Optional[int] = Query(None, gt=0, le=1000),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_read_db)
+):
     try:
-        logger.info("Starting to fetch all files from database")
+        logger.info(f"Starting to fetch all files from database. Limit: {limit}, cursor: {cursor}")
+
+        after = None
+        if cursor is not None:
+            after = decode_cursor(cursor, datetime, UUID)
+            limit = limit or settings.PAGE_SIZE_DEFAULT
         
         # Получение списка файлов
         logger.debug("Executing get_all_files_json()")
-        files = get_all_files_json()
+        files, row_count, last_key = await get_all_files_json(limit, after, db=db)
         
-        if files is None:
+        if not row_count:
             logger.warning("No files found in database")
-            return JSONResponse(content=[], status_code=200)
         
-        logger.info(f"Successfully retrieved {len(files)} files from database")
-        logger.debug(f"First file in list: {files[0]['name'] if files else 'N/A'}")
-        return files
+        logger.info(f"Successfully retrieved {row_count} files from database")
+        return _json_list_response(files, next_page_cursor(row_count, limit, last_key))
         
+    except InvalidCursorError:
+        logger.error(f"Invalid cursor: {cursor}")
+        raise HTTPException(status_code=400, detail="Invalid cursor")
     except SQLAlchemyError as e:
         logger.error(f"Database error while fetching files: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail="Database operation failed")
@@ -178,7 +501,7 @@ async def get_all_files():
 - **file_id**: UUID файла для удаления
 """
 @app.delete("/files/{file_id}")
-async def delete_file(file_id: str):
+async def delete_file(file_id: str, db: AsyncSession = Depends(get_async_db)):
     try:
         logger.info(f"Starting file deletion process. File ID: {file_id}")
         
@@ -187,7 +510,7 @@ async def delete_file(file_id: str):
         logger.debug("UUID format is valid")
         
         logger.debug("Executing delete_file_id()")
-        deleted_id = delete_file_id(file_uuid)
+        deleted_id = await delete_file_id(file_uuid, db=db)
         print("Delete file: ", str(deleted_id))
         if deleted_id is None:
             logger.warning(f"File not found for deletion. File ID: {file_id}")
@@ -212,7 +535,7 @@ async def delete_file(file_id: str):
    либо только id для удаления)
 """
 @app.post("/signatures/manage")
-async def manage_signature(signature_data: dict):
+async def manage_signature(signature_data: dict, db: AsyncSession = Depends(get_async_db)):
     try:
         logger.info(f"Processing signature operation. Data: {signature_data}")
         
@@ -226,7 +549,7 @@ async def manage_signature(signature_data: dict):
             logger.info(f"Signature deletion requested for ID: {signature_data['id']}")
         
         # Вызов функции обработки
-        signature_id = call_signatures_iud_function(signature_data)
+        signature_id = await call_signatures_iud_function(signature_data, db=db)
         
         if not signature_id:
             logger.error("Signature operation failed - no ID returned")
@@ -244,16 +567,133 @@ async def manage_signature(signature_data: dict):
     except Exception as e:
         logger.critical(f"Unexpected error: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail="Internal server error")
+
+"""
+Массовый импорт сигнатур одной транзакцией
+Тело запроса - JSON-массив или NDJSON (Content-Type: application/x-ndjson, формат /signatures/export),
+каждый элемент в формате /signatures/manage: без id - создание, только id - удаление, id и поля - изменение
+Ошибка в любом элементе отменяет весь импорт
+Возвращает счётчики created, updated, deleted, unchanged и signature_ids в порядке элементов
+"""
+@app.post("/signatures/import")
+async def import_signatures(request: Request, db: AsyncSession = Depends(get_async_db)):
+    try:
+        body = await request.body()
+        content_type = request.headers.get("content-type", "")
+        logger.info(f"Starting signature import. Body size: {len(body)}, content type: {content_type}")
+
+        # Разбор тела в пуле потоков: на больших наборах он занимает заметное время
+        if content_type.startswith("application/x-ndjson"):
+            items = await run_in_threadpool(lambda: [orjson.loads(line) for line in body.splitlines() if line.strip()])
+        else:
+            items = await run_in_threadpool(orjson.loads, body)
+            if not isinstance(items, list):
+                raise ValueError("Ожидается JSON-массив сигнатур")
+
+        if not items:
+            logger.error("Empty signature import received")
+            raise HTTPException(status_code=400, detail="No signatures to import")
+        if len(items) > settings.SIGNATURE_IMPORT_MAX_ITEMS:
+            logger.error(f"Signature import exceeds limit of {settings.SIGNATURE_IMPORT_MAX_ITEMS} items")
+            raise HTTPException(
+                status_code=413,
+                detail=f"Too many signatures in one request (max {settings.SIGNATURE_IMPORT_MAX_ITEMS})"
+            )
+
+        result = await call_signatures_bulk_import(items, db=db)
+        logger.info(
+            f"Signature import processed. Created: {result['created']}, updated: {result['updated']}, "
+            f"deleted: {result['deleted']}, unchanged: {result['unchanged']}"
+        )
+        return ORJSONResponse(result)
+
+    except orjson.JSONDecodeError as e:
+        logger.error(f"Invalid JSON in signature import: {str(e)}")
+        raise HTTPException(status_code=400, detail="Invalid JSON")
+    except ValueError as e:
+        logger.error(f"Invalid signature import: {str(e)}")
+        raise HTTPException(status_code=400, detail=str(e))
+    except SQLAlchemyError as e:
+        logger.error(f"Database error: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Database operation failed")
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.critical(f"Unexpected error: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Internal server error")
         
+"""
+Массовый импорт списка известных хэшей файлов одной транзакцией
+Тело запроса - JSON-массив или NDJSON (Content-Type: application/x-ndjson), элемент:
+{"sha256": "<hex>", "verdict": "CLEAN" | "MALICIOUS", "threat_name": "...", "source": "..."};
+запись заменяется целиком, только sha256 - удаление. Ошибка в любом элементе отменяет весь импорт
+Возвращает счётчики created, updated, deleted, unchanged
+"""
+@app.post("/hash-list/import")
+async def import_hash_list(request: Request, db: AsyncSession = Depends(get_async_db)):
+    try:
+        body = await request.body()
+        content_type = request.headers.get("content-type", "")
+        logger.info(f"Starting hash list import. Body size: {len(body)}, content type: {content_type}")
+
+        # Разбор тела в пуле потоков: на больших списках он занимает заметное время
+        if content_type.startswith("application/x-ndjson"):
+            items = await run_in_threadpool(lambda: [orjson.loads(line) for line in body.splitlines() if line.strip()])
+        else:
+            items = await run_in_threadpool(orjson.loads, body)
+            if not isinstance(items, list):
+                raise ValueError("Ожидается JSON-массив записей")
+
+        if not items:
+            logger.error("Empty hash list import received")
+            raise HTTPException(status_code=400, detail="No hashes to import")
+        if len(items) > settings.HASH_LIST_IMPORT_MAX_ITEMS:
+            logger.error(f"Hash list import exceeds limit of {settings.HASH_LIST_IMPORT_MAX_ITEMS} items")
+            raise HTTPException(
+                status_code=413,
+                detail=f"Too many hashes in one request (max {settings.HASH_LIST_IMPORT_MAX_ITEMS})"
+            )
+
+        result = await call_hash_list_import(items, db=db)
+        logger.info(
+            f"Hash list import processed. Created: {result['created']}, updated: {result['updated']}, "
+            f"deleted: {result['deleted']}, unchanged: {result['unchanged']}"
+        )
+        return ORJSONResponse(result)
+
+    except orjson.JSONDecodeError as e:
+        logger.error(f"Invalid JSON in hash list import: {str(e)}")
+        raise HTTPException(status_code=400, detail="Invalid JSON")
+    except ValueError as e:
+        logger.error(f"Invalid hash list import: {str(e)}")
+        raise HTTPException(status_code=400, detail=str(e))
+    except SQLAlchemyError as e:
+        logger.error(f"Database error: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Database operation failed")
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.critical(f"Unexpected error: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Internal server error")
+
 """
 Получает список актуальных сигнатур с возможностью фильтрации по дате обновления
 - **since**: Необязательный параметр в формате ISO 8601 (YYYY-MM-DDTHH:MM:SS) - 
              возвращаются только сигнатуры, обновленные после указанной даты
+- **limit**: Размер страницы (опционально, без limit и cursor возвращаются все сигнатуры)
+- **cursor**: Курсор страницы из заголовка X-Next-Cursor предыдущего ответа (опционально)
+Сигнатуры отсортированы по (updated_at, id) по убыванию, курсор следующей страницы - в заголовке X-Next-Cursor
 """
 @app.get("/signatures", response_model=List[dict])
-async def get_actual_signatures(since: Optional[str] = None):
+async def get_actual_signatures(
+    since: Optional[str] = None,
+    limit: Optional[int] = Query(None, gt=0, le=1000),
+    cursor: Optional[str] = None,
+    if_none_match: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_async_read_db)
+):
     try:
-        logger.info(f"Request received for actual signatures. Since filter: {since}")
+        logger.info(f"Request received for actual signatures. Since filter: {since}, limit: {limit}, cursor: {cursor}")
         
         # Парсим параметр since если он передан
         since_dt = None
@@ -268,16 +708,32 @@ async def get_actual_signatures(since: Optional[str] = None):
                     detail="Invalid since parameter format. Use ISO 8601 format (YYYY-MM-DDTHH:MM:SS)"
                 )
         
+        after = None
+        if cursor is not None:
+            after = decode_cursor(cursor, datetime, UUID)
+            limit = limit or settings.PAGE_SIZE_DEFAULT
+
+        # Набор не изменился: 304 или готовый ответ без запроса списка
+        # (since с часовым поясом кэш сигнатур не обслуживает - версия тогда читается из БД)
+        cache_key = ("signatures", since_dt, limit, after)
+        etag = await _signatures_etag(db, use_known_version=since_dt is None or since_dt.tzinfo is None)
+        cached = _cached_response(cache_key, etag, if_none_match)
+        if cached is not None:
+            logger.info(f"Actual signatures served from cache. Status: {cached.status_code}")
+            return cached
+
         # Получаем сигнатуры из БД
-        signatures = get_actual_signatures_json(since_dt)
+        signatures, row_count, last_key = await get_actual_signatures_json(since_dt, limit, after, db=db)
         
-        if signatures is None:
+        if not row_count:
             logger.info("No actual signatures found in database")
-            return JSONResponse(content=[], status_code=200)
         
-        logger.info(f"Successfully retrieved {len(signatures)} actual signatures")
-        return signatures
+        logger.info(f"Successfully retrieved {row_count} actual signatures")
+        return _cached_json_list_response(cache_key, etag, signatures, next_page_cursor(row_count, limit, last_key))
         
+    except InvalidCursorError:
+        logger.error(f"Invalid cursor: {cursor}")
+        raise HTTPException(status_code=400, detail="Invalid cursor")
     except SQLAlchemyError as e:
         logger.error(f"Database error while fetching signatures: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail="Database operation failed")
@@ -287,15 +743,83 @@ async def get_actual_signatures(since: Optional[str] = None):
         logger.critical(f"Unexpected error while fetching signatures: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail="Internal server error")        
         
+"""
+Изменения набора сигнатур после версии клиента (синхронизация по версиям вместо меток времени)
+- **since_version**: Версия из поля to_version предыдущего ответа (0 - весь набор)
+- **limit**: Максимальное количество изменений в ответе (по умолчанию 10000)
+Возвращает {from_version, to_version, current_version, has_more, upserts, deleted}: upserts - изменённые
+и добавленные сигнатуры целиком, deleted - id удалённых. При has_more = true следующая порция запрашивается
+с since_version = to_version. Если изменений нет, возвращается 304 без тела
+Текущая версия набора передаётся в заголовке X-Signatures-Version
+"""
+@app.get("/signatures/delta")
+async def get_delta_signatures(
+    since_version: int = Query(0, ge=0),
+    limit: int = Query(10000, gt=0, le=100000),
+    db: AsyncSession = Depends(get_async_read_db)
+):
+    try:
+        logger.info(f"Request received for signatures delta. Since version: {since_version}, limit: {limit}")
+
+        delta, current_version, row_count = await get_signatures_delta(since_version, limit, db=db)
+        headers = {"X-Signatures-Version": str(current_version)}
+
+        if since_version > current_version:
+            logger.error(f"Signatures delta requested from version {since_version} ahead of current {current_version}")
+            raise HTTPException(
+                status_code=400,
+                detail="since_version is ahead of the current signatures version, resync from since_version=0"
+            )
+
+        if not row_count:
+            logger.info(f"Signatures not modified since version {since_version}")
+            return Response(status_code=304, headers=headers)
+
+        logger.info(f"Successfully retrieved {row_count} signature changes up to version {current_version}")
+        return Response(content=delta, media_type="application/json", headers=headers)
+
+    except SQLAlchemyError as e:
+        logger.error(f"Database error while fetching signatures delta: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Database operation failed")
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.critical(f"Unexpected error while fetching signatures delta: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Internal server error")
+
 """
 Получает сигнатуры по списку GUID
 - **guids**: Список GUID сигнатур в теле запроса
 Возвращает список объектов с информацией о сигнатурах
+Списки длиннее SIGNATURE_GUID_TEMP_TABLE_MIN ищутся через временную таблицу на основном сервере,
+массив отдаётся потоком в том же формате
 """
 @app.post("/signatures/guid", response_model=List[dict])
-async def get_guid_signatures(guids: List[str] = Body(...)):
+async def get_guid_signatures(guids: List[str] = Body(...), db: AsyncSession = Depends(get_async_read_db)):
     try:
         logger.info(f"Request received for signatures by GUIDs. GUIDs count: {len(guids)}")
+
+        if len(guids) > settings.SIGNATURE_GUID_LOOKUP_MAX_ITEMS:
+            logger.error(f"GUID lookup exceeds limit of {settings.SIGNATURE_GUID_LOOKUP_MAX_ITEMS} items")
+            raise HTTPException(
+                status_code=413,
+                detail=f"Too many GUIDs in one request (max {settings.SIGNATURE_GUID_LOOKUP_MAX_ITEMS})"
+            )
+
+        # Большой список: GUID проверяются и соединяются с signatures в запросе по временной таблице
+        if len(guids) > settings.SIGNATURE_GUID_TEMP_TABLE_MIN:
+            records = await prepare_guid_lookup(guids)
+            if not records:
+                logger.error("No valid GUIDs provided")
+                raise HTTPException(
+                    status_code=400,
+                    detail="No valid GUIDs provided in request"
+                )
+            logger.info(f"Streaming signatures for {len(records)} distinct valid GUIDs")
+            return StreamingResponse(
+                iter_guid_lookup_json(records, settings.EXPORT_BATCH_SIZE),
+                media_type="application/json"
+            )
         
         # Валидация GUID
         valid_guids = []
@@ -314,10 +838,10 @@ async def get_guid_signatures(guids: List[str] = Body(...)):
             )
         
         # Получаем сигнатуры из БД
-        signatures = get_signatures_by_guids(valid_guids)
+        signatures, row_count, _ = await get_signatures_by_guids(valid_guids, db=db)
         
-        logger.info(f"Successfully retrieved {len(signatures)} signatures by GUIDs")
-        return signatures
+        logger.info(f"Successfully retrieved {row_count} signatures by GUIDs")
+        return _json_list_response(signatures)
         
     except SQLAlchemyError as e:
         logger.error(f"Database error while fetching signatures by GUIDs: {str(e)}", exc_info=True)
@@ -328,13 +852,73 @@ async def get_guid_signatures(guids: List[str] = Body(...)):
         logger.critical(f"Unexpected error while fetching signatures by GUIDs: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail="Internal server error")
         
+"""
+Сверка большого списка GUID (офлайн-агенты): тело - JSON-массив GUID или GUID по одному в строке
+(Content-Type: text/plain или application/x-ndjson). Список загружается во временную таблицу командой COPY
+и соединяется с signatures и history на основном сервере
+Возвращает NDJSON потоком в порядке запроса, по строке на каждый допустимый GUID без повторов:
+сигнатура с version, history_versions и last_recorded_at или {"id": ..., "status": "NOT_FOUND"}
+Неверные GUID пропускаются
+"""
+@app.post("/signatures/guid/reconcile")
+async def reconcile_guid_signatures(request: Request):
+    try:
+        body = await request.body()
+        content_type = request.headers.get("content-type", "")
+        logger.info(f"Starting GUID reconciliation. Body size: {len(body)}, content type: {content_type}")
+
+        # Разбор тела в пуле потоков: на больших списках он занимает заметное время
+        if content_type.startswith(("text/plain", "application/x-ndjson")):
+            guids = await run_in_threadpool(lambda: [line.strip('" ') for line in body.decode("utf-8").splitlines() if line.strip()])
+        else:
+            guids = await run_in_threadpool(orjson.loads, body)
+            if not isinstance(guids, list):
+                raise ValueError("Ожидается JSON-массив GUID")
+
+        if len(guids) > settings.SIGNATURE_GUID_LOOKUP_MAX_ITEMS:
+            logger.error(f"GUID reconciliation exceeds limit of {settings.SIGNATURE_GUID_LOOKUP_MAX_ITEMS} items")
+            raise HTTPException(
+                status_code=413,
+                detail=f"Too many GUIDs in one request (max {settings.SIGNATURE_GUID_LOOKUP_MAX_ITEMS})"
+            )
+
+        records = await prepare_guid_lookup(guids)
+        if not records:
+            logger.error("No valid GUIDs provided")
+            raise HTTPException(status_code=400, detail="No valid GUIDs provided in request")
+
+        logger.info(f"Streaming reconciliation for {len(records)} distinct GUIDs")
+        return StreamingResponse(
+            iter_guid_reconcile_ndjson(records, settings.EXPORT_BATCH_SIZE),
+            media_type="application/x-ndjson"
+        )
+
+    except (orjson.JSONDecodeError, UnicodeDecodeError) as e:
+        logger.error(f"Invalid GUID reconciliation body: {str(e)}")
+        raise HTTPException(status_code=400, detail="Invalid request body")
+    except ValueError as e:
+        logger.error(f"Invalid GUID reconciliation body: {str(e)}")
+        raise HTTPException(status_code=400, detail=str(e))
+    except SQLAlchemyError as e:
+        logger.error(f"Database error during GUID reconciliation: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Database operation failed")
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.critical(f"Unexpected error during GUID reconciliation: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Internal server error")
+
 """
 Получает сигнатуры по статусу (ACTUAL или DELETED)
 - **status**: Статус сигнатур для фильтрации (обязательный параметр)
 Возвращает список объектов с информацией о сигнатурах
 """
 @app.get("/signatures/status", response_model=List[dict])
-async def get_status_signatures(status: str):
+async def get_status_signatures(
+    status: str,
+    if_none_match: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_async_read_db)
+):
     try:
         logger.info(f"Request received for signatures with status: {status}")
         
@@ -346,11 +930,19 @@ async def get_status_signatures(status: str):
                 detail="Status must be either 'ACTUAL' or 'DELETED'"
             )
         
+        # Набор не изменился: 304 или готовый ответ без запроса списка
+        cache_key = ("signatures/status", status)
+        etag = await _signatures_etag(db)
+        cached = _cached_response(cache_key, etag, if_none_match)
+        if cached is not None:
+            logger.info(f"Signatures with status {status} served from cache. Status: {cached.status_code}")
+            return cached
+
         # Получаем сигнатуры из БД
-        signatures = get_signatures_by_status(status)
+        signatures, row_count, _ = await get_signatures_by_status(status, db=db)
         
-        logger.info(f"Successfully retrieved {len(signatures)} signatures with status {status}")
-        return signatures
+        logger.info(f"Successfully retrieved {row_count} signatures with status {status}")
+        return _cached_json_list_response(cache_key, etag, signatures)
         
     except SQLAlchemyError as e:
         logger.error(f"Database error while fetching signatures by status: {str(e)}", exc_info=True)
@@ -361,16 +953,70 @@ async def get_status_signatures(status: str):
         logger.critical(f"Unexpected error while fetching signatures by status: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail="Internal server error")        
         
+"""
+Находит дубликаты среди актуальных сигнатур - группы с одинаковым шаблоном (first_bytes, remainder_hash, remainder_length)
+- **limit**: Количество групп на странице (опционально, по умолчанию 100, максимум 1000)
+- **cursor**: Курсор страницы из заголовка X-Next-Cursor предыдущего ответа (опционально)
+Возвращает группы с сигнатурами и списком избыточных (redundant): DUPLICATE - те же смещения, что у более ранней
+сигнатуры группы, SHADOWED - диапазон смещений внутри диапазона другой сигнатуры (by); такие сигнатуры
+не меняют результат сканирования, кроме threat_name, и могут быть удалены
+"""
+@app.get("/signatures/duplicates", response_model=List[dict])
+async def get_duplicate_signatures(
+    limit: Optional[int] = Query(100, gt=0, le=1000),
+    cursor: Optional[str] = None,
+    if_none_match: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_async_read_db)
+):
+    try:
+        logger.info(f"Request received for duplicate signatures. Limit: {limit}, Cursor: {cursor}")
+
+        after = decode_cursor(cursor, str, str, int) if cursor is not None else None
+
+        # Набор не изменился: 304 или готовый ответ без повторного анализа
+        cache_key = ("signatures/duplicates", limit, cursor)
+        etag = await _signatures_etag(db, use_known_version=False)
+        cached = _cached_response(cache_key, etag, if_none_match)
+        if cached is not None:
+            logger.info(f"Duplicate signatures served from cache. Status: {cached.status_code}")
+            return cached
+
+        groups, row_count, last_key = await get_signature_duplicates(limit, after, db=db)
+
+        logger.info(f"Successfully retrieved {row_count} duplicate signature groups")
+        return _cached_json_list_response(cache_key, etag, groups, next_page_cursor(row_count, limit, last_key))
+
+    except InvalidCursorError:
+        logger.error(f"Invalid cursor: {cursor}")
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    except SQLAlchemyError as e:
+        logger.error(f"Database error while fetching duplicate signatures: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Database operation failed")
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.critical(f"Unexpected error while fetching duplicate signatures: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Internal server error")
+
 """
 Сканирует файл с использованием алгоритма Рабина-Карпа
 - **file_id**: UUID файла для сканирования (обязательный)
 - **signature_id**: UUID сигнатуры для сканирования (опциональный)
-Возвращает результат сканирования
+- **expand_archives**: Сканировать элементы zip/tar/gzip архивов (по умолчанию true)
+- **as_of**: Сканировать набором сигнатур на этот момент (ISO 8601) для воспроизведения прежнего вердикта;
+             набор восстанавливается из истории один раз и кэшируется, результат в файле не сохраняется
+Возвращает результат сканирования, для архивов дополнительно archive_members с результатами по каждому элементу;
+совпадения в элементах архива сохраняются в scan_result файла (source = archive_member, path элемента)
+Файл из списка известных хэшей не сканируется: вердикт списка сохраняется и возвращается с полем hash_list
+(кроме сканирования одной сигнатурой и as_of - им нужен результат сигнатур)
 """
 @app.post("/files/scan", response_model=dict)
 async def scan_file(
     file_id: str,
-    signature_id: Optional[str] = None
+    signature_id: Optional[str] = None,
+    expand_archives: bool = True,
+    as_of: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db)
 ):
     try:
         logger.info(f"Starting file scan. File ID: {file_id}, Signature ID: {signature_id}")
@@ -396,19 +1042,79 @@ async def scan_file(
                     status_code=400,
                     detail="Invalid signature ID format"
                 )
+
+        # Момент времени для повторного сканирования (если указан)
+        as_of_dt = None
+        if as_of is not None:
+            try:
+                as_of_dt = datetime.fromisoformat(as_of)
+            except ValueError:
+                logger.error(f"Invalid as_of parameter format: {as_of}")
+                raise HTTPException(
+                    status_code=400,
+                    detail="Invalid as_of parameter format. Use ISO 8601 format (YYYY-MM-DDTHH:MM:SS)"
+                )
+            # Один перевод в часовой пояс сервера БД - и для проверки срока хранения, и для восстановления набора
+            as_of_dt = await to_db_local_time(as_of_dt)
+            retained_since = await history_retained_since(db=db)
+            if retained_since is not None and as_of_dt < retained_since:
+                logger.error(f"Signature history for {as_of} is no longer retained (since {retained_since})")
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Signature history before {retained_since.isoformat()} is no longer retained"
+                )
         
+        # Известный файл: вердикт из списка хэшей без сканирования сигнатурами и элементов архива
+        if settings.HASH_LIST_ENABLED and signature_uuid is None and as_of_dt is None:
+            known = await apply_hash_list_verdicts([file_uuid], db=db)
+            record_hash_list_lookups(1, known.values())
+            if file_uuid in known:
+                logger.info(f"File {file_id} found in hash list: {known[file_uuid]['hash_list']['verdict']}")
+                return ORJSONResponse(known[file_uuid])
+
         # Вызов функции сканирования
-        scan_result = scan_file_with_rabin_karp(file_uuid, signature_uuid)
+        if as_of_dt is not None:
+            scan_result = await scan_file_as_of(file_uuid, as_of_dt, signature_uuid, db=db)
+        else:
+            scan_result = await scan_file_with_rabin_karp(file_uuid, signature_uuid, db=db)
         
         if not scan_result:
+            # Содержимое, удалённое политикой хранения, - 410, как при скачивании файла
+            meta = await get_file_content_meta(file_uuid, db=db)
+            if meta is not None and meta["content_purged_at"] is not None:
+                logger.warning(f"Cannot scan file {file_id}: content purged by retention policy")
+                raise HTTPException(
+                    status_code=410,
+                    detail="File content was purged by retention policy"
+                )
             logger.error(f"Scan failed for file {file_id}")
             raise HTTPException(
                 status_code=404,
                 detail="File not found or scan failed"
             )
         
+        # Сканируем элементы архива, если файл является архивом
+        if expand_archives:
+            limits = ArchiveLimits(
+                max_depth=settings.ARCHIVE_MAX_DEPTH,
+                max_members=settings.ARCHIVE_MAX_MEMBERS,
+                max_member_size=settings.ARCHIVE_MAX_MEMBER_SIZE,
+                max_total_size=settings.ARCHIVE_MAX_TOTAL_SIZE
+            )
+            archive_result = await scan_archive_members(file_uuid, signature_uuid, limits, db=db, as_of=as_of_dt)
+            if archive_result is not None:
+                if archive_result["error"]:
+                    logger.warning(f"Archive scan stopped for file {file_id}: {archive_result['error']}")
+                logger.info(f"Scanned {len(archive_result['members'])} archive members for file {file_id}")
+                scan_result["archive_members"] = archive_result["members"]
+                scan_result["archive_error"] = archive_result["error"]
+                # Совпадения в элементах сохранены в файле: ответ совпадает с записанным результатом
+                if "scan_result" in archive_result:
+                    scan_result["scan_result"] = archive_result["scan_result"]
+                    scan_result["updated_at"] = archive_result["updated_at"]
+
         logger.info(f"Scan completed successfully for file {file_id}")
-        return scan_result
+        return ORJSONResponse(scan_result)
         
     except SQLAlchemyError as e:
         logger.error(f"Database error during scan: {str(e)}", exc_info=True)
@@ -423,15 +1129,18 @@ async def scan_file(
 Получает историю изменений сигнатур
 - **signature_id**: UUID сигнатуры для фильтрации (опциональный)
 - **limit**: Максимальное количество записей (опциональный, по умолчанию 100)
-Возвращает список объектов с историей изменений
+- **cursor**: Курсор страницы из заголовка X-Next-Cursor предыдущего ответа (опционально)
+Возвращает список объектов с историей изменений, отсортированный по (recorded_at, history_id) по убыванию
 """
 @app.get("/history", response_model=List[dict])
 async def get_history_signatures(
     signature_id: Optional[str] = None, 
-    limit: Optional[int] = Query(100, gt=0, le=1000)
+    limit: Optional[int] = Query(100, gt=0, le=1000),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_read_db)
 ):
     try:
-        logger.info(f"Request received for history. Signature ID: {signature_id}, Limit: {limit}")
+        logger.info(f"Request received for history. Signature ID: {signature_id}, Limit: {limit}, Cursor: {cursor}")
         
         # Валидация UUID если указан
         signature_uuid = None
@@ -445,12 +1154,17 @@ async def get_history_signatures(
                     detail="Invalid signature ID format"
                 )
         
+        after = decode_cursor(cursor, datetime, int) if cursor is not None else None
+
         # Получаем историю из БД
-        history = get_signatures_history(signature_uuid, limit)
+        history, row_count, last_key = await get_signatures_history(signature_uuid, limit, after, db=db)
         
-        logger.info(f"Successfully retrieved {len(history)} history entries")
-        return history
+        logger.info(f"Successfully retrieved {row_count} history entries")
+        return _json_list_response(history, next_page_cursor(row_count, limit, last_key))
         
+    except InvalidCursorError:
+        logger.error(f"Invalid cursor: {cursor}")
+        raise HTTPException(status_code=400, detail="Invalid cursor")
     except SQLAlchemyError as e:
         logger.error(f"Database error while fetching history: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail="Database operation failed")
@@ -465,26 +1179,34 @@ async def get_history_signatures(
 - **entity_type**: Фильтр по типу сущности (опционально)
 - **operation_type**: Фильтр по типу операции (CREATED/UPDATED/DELETED) (опционально)
 - **limit**: Максимальное количество записей (по умолчанию 100, максимум 1000)
-Возвращает список записей аудита
+- **cursor**: Курсор страницы из заголовка X-Next-Cursor предыдущего ответа (опционально)
+Возвращает список записей аудита, отсортированный по (recorded_at, audit_id) по убыванию
 """
 @app.get("/audit", response_model=List[dict])
 async def get_audit_signatures(
     entity_type: Optional[str] = None,
     operation_type: Optional[str] = None,
-    limit: int = Query(default=100, gt=0, le=1000)
+    limit: int = Query(default=100, gt=0, le=1000),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_read_db)
 ):
     try:
         logger.info(
             f"Request received for audit logs. Entity type: {entity_type}, "
-            f"Operation type: {operation_type}, Limit: {limit}"
+            f"Operation type: {operation_type}, Limit: {limit}, Cursor: {cursor}"
         )
+
+        after = decode_cursor(cursor, datetime, int) if cursor is not None else None
         
         # Получаем данные из БД
-        audit_logs = get_audit_logs(entity_type, operation_type, limit)
+        audit_logs, row_count, last_key = await get_audit_logs(entity_type, operation_type, limit, after, db=db)
         
-        logger.info(f"Successfully retrieved {len(audit_logs)} audit log entries")
-        return audit_logs
+        logger.info(f"Successfully retrieved {row_count} audit log entries")
+        return _json_list_response(audit_logs, next_page_cursor(row_count, limit, last_key))
         
+    except InvalidCursorError:
+        logger.error(f"Invalid cursor: {cursor}")
+        raise HTTPException(status_code=400, detail="Invalid cursor")
     except SQLAlchemyError as e:
         logger.error(f"Database error while fetching audit logs: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail="Database operation failed")
@@ -492,6 +1214,100 @@ async def get_audit_signatures(
         logger.critical(f"Unexpected error while fetching audit logs: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail="Internal server error")
         
+"""
+Полная выгрузка файлов (без содержимого) в формате NDJSON - одна JSON-строка на файл
+Записи читаются серверным курсором пачками по EXPORT_BATCH_SIZE и отправляются по мере чтения
+"""
+@app.get("/allfiles/export")
+async def export_files():
+    logger.info("Starting NDJSON export of files")
+    return StreamingResponse(
+        iter_files_ndjson(settings.EXPORT_BATCH_SIZE),
+        media_type="application/x-ndjson"
+    )
+
+"""
+Полная выгрузка актуальных сигнатур в формате NDJSON - одна JSON-строка на сигнатуру
+- **since**: Необязательный параметр в формате ISO 8601 (YYYY-MM-DDTHH:MM:SS) -
+             выгружаются только сигнатуры, обновленные после указанной даты
+"""
+@app.get("/signatures/export")
+async def export_signatures(since: Optional[str] = None):
+    logger.info(f"Starting NDJSON export of signatures. Since filter: {since}")
+    since_dt = None
+    if since is not None:
+        try:
+            since_dt = datetime.fromisoformat(since)
+        except ValueError as e:
+            logger.error(f"Invalid since parameter format: {since}. Error: {str(e)}")
+            raise HTTPException(
+                status_code=400,
+                detail="Invalid since parameter format. Use ISO 8601 format (YYYY-MM-DDTHH:MM:SS)"
+            )
+    return StreamingResponse(
+        iter_signatures_ndjson(since_dt, settings.EXPORT_BATCH_SIZE),
+        media_type="application/x-ndjson"
+    )
+
+"""
+Полная выгрузка записей аудита в формате NDJSON - одна JSON-строка на запись
+- **entity_type**: UUID сигнатуры для фильтрации (опционально)
+- **operation_type**: Фильтр по типу операции (CREATED/UPDATED/DELETED) (опционально)
+"""
+@app.get("/audit/export")
+async def export_audit(entity_type: Optional[str] = None, operation_type: Optional[str] = None):
+    logger.info(f"Starting NDJSON export of audit logs. Entity type: {entity_type}, Operation type: {operation_type}")
+    signature_uuid = None
+    if entity_type:
+        try:
+            signature_uuid = UUID(entity_type)
+        except ValueError:
+            logger.error(f"Invalid signature UUID format: {entity_type}")
+            raise HTTPException(status_code=400, detail="Invalid signature ID format")
+    return StreamingResponse(
+        iter_audit_ndjson(signature_uuid, operation_type, settings.EXPORT_BATCH_SIZE),
+        media_type="application/x-ndjson"
+    )
+
+"""
+Возвращает состояние пула соединений с БД и накопленные счётчики
+(выдачи/возвраты соединений, время ожидания соединения) для подбора размера пула
+"""
+@app.get("/metrics/db-pool")
+async def db_pool_metrics():
+    return ORJSONResponse(get_pool_stats())
+
+"""
+Возвращает состояние реплик для чтения (доступность, отставание) и счётчики
+сессий чтения, открытых на репликах и на основном сервере
+"""
+@app.get("/metrics/db-replicas")
+async def db_replica_metrics():
+    return ORJSONResponse(get_replica_stats())
+
+"""
+Возвращает состояние кэша сигнатур в памяти процесса (загружен ли, версия набора)
+и счётчики обращений (попадания, загрузки, обращения мимо кэша)
+"""
+@app.get("/metrics/signature-cache")
+async def signature_cache_metrics():
+    return ORJSONResponse(get_signature_cache_stats())
+
+"""
+Возвращает размер кэша ответов (ETag) и счётчики: ответы из памяти, построенные заново, 304
+"""
+@app.get("/metrics/response-cache")
+async def response_cache_metrics():
+    return ORJSONResponse(get_response_cache_stats())
+
+"""
+Возвращает счётчики проверок по списку известных хэшей: попадания по вердиктам, промахи, доля попаданий
+и объём файлов, не просканированных сигнатурами
+"""
+@app.get("/metrics/hash-list")
+async def hash_list_metrics():
+    return ORJSONResponse(get_hash_list_stats())
+
 @app.get("/health")
 async def health_check():
     return {
@@ -501,5 +1317,7 @@ async def health_check():
     }        
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # Несколько воркеров: миграции выполняет один под advisory-блокировкой,
+    # фоновая очистка безопасна в каждом воркере благодаря FOR UPDATE SKIP LOCKED
+    uvicorn.run("main:app", host=settings.API_HOST, port=settings.API_PORT, workers=settings.API_WORKERS)
     
\ No newline at end of file
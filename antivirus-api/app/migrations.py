@@ -0,0 +1,1804 @@
+"""
+Версионирование схемы базы данных
+Миграции применяются строго по порядку, номер каждой применённой миграции записывается в antivirus.schema_version.
+При тёплом старте выполняется один запрос проверки версии, DDL не повторяется.
+Новые изменения схемы добавляются новой миграцией в конец MIGRATIONS (sql.sql - полный справочный скрипт)
+"""
+
+import logging
+from typing import List, Tuple
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+# Миграция 1: исходная схема (расширения, таблицы, функции, триггеры)
+MIGRATION_0001 = [
+    """
+    -- Добавляем расширение работы с UUID
+    CREATE EXTENSION IF NOT EXISTS "uuid-ossp";
+    """,
+    """
+    -- Добавляем расширение криптографические функции
+    CREATE EXTENSION IF NOT EXISTS "pgcrypto";
+    """,
+    """
+    -- 1. Создание схемы (если не существует)
+    DO $$
+    BEGIN
+        IF NOT EXISTS (
+            SELECT 1 FROM information_schema.schemata
+            WHERE schema_name = 'antivirus'
+        ) THEN
+            CREATE SCHEMA antivirus;
+            COMMENT ON SCHEMA antivirus IS 'Схема для антивирусного API';
+            RAISE NOTICE 'Схема antivirus создана';
+        ELSE
+            RAISE NOTICE 'Схема antivirus уже существует';
+        END IF;
+    END
+    $$;
+    """,
+    """
+    -- 2. Создание таблицы файлов
+    CREATE TABLE IF NOT EXISTS antivirus.files (
+        id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+        name TEXT NOT NULL,
+        content BYTEA NOT NULL,
+        size INT NOT NULL,
+        content_hash BYTEA,
+        scan_result JSONB,
+        content_purged_at TIMESTAMP,
+        created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+        updated_at TIMESTAMP NOT NULL DEFAULT NOW()
+    );
+    COMMENT ON TABLE antivirus.files IS 'Загруженные файлы';
+    COMMENT ON COLUMN antivirus.files.id IS 'Id файла в формате UUID';
+    COMMENT ON COLUMN antivirus.files.name IS 'Имя файла';
+    COMMENT ON COLUMN antivirus.files.content IS 'Содержание файла';
+    COMMENT ON COLUMN antivirus.files.size IS 'Размер файла';
+    COMMENT ON COLUMN antivirus.files.scan_result IS 'Результат сканирования с разными сигнатурами';
+    COMMENT ON COLUMN antivirus.files.created_at IS 'Дата и время добавления файла';
+    COMMENT ON COLUMN antivirus.files.updated_at IS 'Дата и время изменения файла';
+    -- Содержимое храним без сжатия TOAST, чтобы substring() читал только нужные чанки (отдача по Range)
+    ALTER TABLE antivirus.files ALTER COLUMN content SET STORAGE EXTERNAL;
+    -- Хэш содержимого для таблиц, созданных до его появления
+    ALTER TABLE antivirus.files ADD COLUMN IF NOT EXISTS content_hash BYTEA;
+    UPDATE antivirus.files SET content_hash = digest(content, 'sha256') WHERE content_hash IS NULL;
+    COMMENT ON COLUMN antivirus.files.content_hash IS 'SHA-256 содержимого файла';
+    -- Отметка об удалении содержимого политикой хранения
+    ALTER TABLE antivirus.files ADD COLUMN IF NOT EXISTS content_purged_at TIMESTAMP;
+    COMMENT ON COLUMN antivirus.files.content_purged_at IS 'Дата и время удаления содержимого политикой хранения';
+    -- Кандидаты на очистку содержимого: просканированные файлы с ещё не удалённым содержимым
+    CREATE INDEX IF NOT EXISTS ix_files_purge_candidates ON antivirus.files (updated_at)
+        WHERE content_purged_at IS NULL AND scan_result IS NOT NULL;
+    """,
+    """
+    -- 3. Создание таблицы сигнатур
+    CREATE TABLE IF NOT EXISTS antivirus.signatures (
+        id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+        threat_name TEXT NOT NULL,
+        first_bytes VARCHAR(8) NOT NULL,
+        remainder_hash VARCHAR(64) NOT NULL,
+        remainder_length INT NOT NULL,
+        file_type TEXT NOT NULL,
+        offset_start INT,
+        offset_end INT,
+        digital_signature BYTEA DEFAULT NULL,
+        status TEXT NOT NULL DEFAULT 'ACTUAL',
+        updated_at TIMESTAMP NOT NULL DEFAULT NOW()
+    );
+    COMMENT ON TABLE antivirus.signatures IS 'Антивирусные сигнатуры';
+    COMMENT ON COLUMN antivirus.signatures.id IS 'id сигнатуры в формате UUID';
+    COMMENT ON COLUMN antivirus.signatures.threat_name IS 'Название угрозы';
+    COMMENT ON COLUMN antivirus.signatures.first_bytes IS 'Первые 8 байт';
+    COMMENT ON COLUMN antivirus.signatures.remainder_hash IS 'Хэш хвоста';
+    COMMENT ON COLUMN antivirus.signatures.remainder_length IS 'Длина хвоста';
+    COMMENT ON COLUMN antivirus.signatures.file_type IS 'Тип файла';
+    COMMENT ON COLUMN antivirus.signatures.offset_start IS 'Смещение начала сигнатуры';
+    COMMENT ON COLUMN antivirus.signatures.offset_end IS 'Смещение конца сигнатуры';
+    COMMENT ON COLUMN antivirus.signatures.digital_signature IS 'ЭЦП';
+    COMMENT ON COLUMN antivirus.signatures.status IS 'Статус записи';
+    COMMENT ON COLUMN antivirus.signatures.updated_at IS 'Время изменения записи';
+    """,
+    """
+    -- 4. Создаем таблицу history
+    CREATE TABLE IF NOT EXISTS antivirus.history (
+        history_id BIGSERIAL PRIMARY KEY,
+        version_created_at  TIMESTAMP NOT NULL
+    ) INHERITS (antivirus.signatures);
+    
+    COMMENT ON TABLE antivirus.history IS 'Изменения таблицы antivirus.signatures';
+    COMMENT ON COLUMN antivirus.history.history_id  IS 'Уникальный идентификатор записи в истории';
+    COMMENT ON COLUMN antivirus.history.version_created_at  IS 'Момент времени, когда появилась эта версия';
+    """,
+    """
+    -- 5. Создаем таблицу audit
+    CREATE TABLE IF NOT EXISTS antivirus.audit
+    (
+        audit_id SERIAL PRIMARY KEY,
+        signature_id UUID NOT NULL REFERENCES antivirus.signatures(id) MATCH SIMPLE ON UPDATE CASCADE ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED,
+        changed_by	TEXT NOT NULL DEFAULT SESSION_USER,
+        change_type	TEXT,
+        changed_at TIMESTAMP NOT NULL DEFAULT Now(),
+        fields_changed JSONB
+    );
+    COMMENT ON TABLE antivirus.audit IS 'Таблица аудита';
+    COMMENT ON COLUMN antivirus.audit.audit_id IS 'Уникальный идентификатор записи в аудите';
+    COMMENT ON COLUMN antivirus.audit.signature_id IS 'Ссылка на запись в таблице сигнатур';
+    COMMENT ON COLUMN antivirus.audit.changed_by IS 'Указатель на пользователя, совершившего изменение';
+    COMMENT ON COLUMN antivirus.audit.change_type IS 'Тип изменения (CREATED, UPDATED, DELETED, CORRUPTED и т.д.)';
+    COMMENT ON COLUMN antivirus.audit.changed_at IS 'Время, когда произошло изменение';
+    COMMENT ON COLUMN antivirus.audit.fields_changed IS 'Список изменённых полей, можно хранить в виде JSON';
+    """,
+    """
+    -- 6. Индексы для основных запросов чтения (проверка планов: python explain.py)
+    -- Список файлов: ORDER BY created_at DESC, id DESC и курсор страницы
+    CREATE INDEX IF NOT EXISTS ix_files_created_at_id ON antivirus.files (created_at DESC, id DESC);
+    -- Актуальные сигнатуры: WHERE status = ... ORDER BY updated_at DESC, id DESC
+    CREATE INDEX IF NOT EXISTS ix_signatures_status_updated_at_id ON antivirus.signatures (status, updated_at DESC, id DESC);
+    -- История одной сигнатуры: WHERE id = ... ORDER BY version_created_at DESC, history_id DESC
+    CREATE INDEX IF NOT EXISTS ix_history_id_version_created_at ON antivirus.history (id, version_created_at DESC, history_id DESC);
+    -- Вся история: ORDER BY version_created_at DESC, history_id DESC
+    CREATE INDEX IF NOT EXISTS ix_history_version_created_at ON antivirus.history (version_created_at DESC, history_id DESC);
+    -- Аудит по сигнатуре (заодно ускоряет каскадное удаление по внешнему ключу) и по типу операции
+    CREATE INDEX IF NOT EXISTS ix_audit_signature_id_audit_id ON antivirus.audit (signature_id, audit_id DESC);
+    CREATE INDEX IF NOT EXISTS ix_audit_change_type_audit_id ON antivirus.audit (change_type, audit_id DESC);
+    """,
+    """
+    CREATE OR REPLACE FUNCTION antivirus.files_iud( _name TEXT DEFAULT NULL, _content BYTEA DEFAULT NULL, _scan_result JSON DEFAULT NULL, _id UUID DEFAULT NULL)
+      RETURNS uuid AS
+    $BODY$
+        DECLARE
+        uid UUID;
+        v_content_hash BYTEA;
+    BEGIN
+            -- хэш нового содержимого: по нему определяем, изменилось ли содержимое, без сравнения BYTEA целиком
+            if _content notnull then
+                v_content_hash := digest(_content, 'sha256');
+            end if;
+
+            if _id isnull then
+                if _name isnull and _content isnull then
+                    raise exception 'Не указано имя файла или его содержимое';
+                end if;
+                insert into antivirus.files(name, content, size, content_hash)
+                    values(_name, _content, octet_length(_content), v_content_hash)
+                returning id into uid;
+                return uid;
+            end if;
+
+            if _name isnull and _content isnull and _scan_result isnull then
+                delete from antivirus.files where id = _id;
+                return _id;
+            end if;
+
+            -- одно обновление вместо отдельного на каждое поле;
+            -- строка не переписывается, если ничего не изменилось,
+            -- а неизменённое содержимое (совпал хэш) не перезаписывается в TOAST
+            update antivirus.files set
+                name = COALESCE(_name, name),
+                content = CASE
+                        WHEN v_content_hash isnull or (v_content_hash = content_hash and content_purged_at isnull) THEN content
+                        ELSE _content END,
+                size = CASE
+                        WHEN v_content_hash isnull or (v_content_hash = content_hash and content_purged_at isnull) THEN size
+                        ELSE octet_length(_content) END,
+                content_hash = COALESCE(v_content_hash, content_hash),
+                content_purged_at = CASE
+                        WHEN v_content_hash isnull THEN content_purged_at
+                        ELSE NULL END,
+                scan_result = COALESCE(_scan_result::jsonb, scan_result),
+                updated_at = NOW()
+            where id = _id
+              and (
+                    (_name notnull and _name is distinct from name)
+                 or (v_content_hash notnull and (v_content_hash is distinct from content_hash or content_purged_at notnull))
+                 or (_scan_result notnull and _scan_result::jsonb is distinct from scan_result)
+              );
+
+            return _id;
+    END
+    $BODY$
+    LANGUAGE plpgsql VOLATILE
+    COST 100;
+
+    COMMENT ON FUNCTION antivirus.files_iud(TEXT, BYTEA, JSON, UUID) IS 'Функция записи/обновления/удаления файла';
+    """,
+    """
+    -- DROP FUNCTION IF EXISTS antivirus.scan_content_with_rabin_karp(BYTEA,UUID);
+    CREATE OR REPLACE FUNCTION antivirus.scan_content_with_rabin_karp(
+        p_content BYTEA,                 -- содержимое для сканирования (файл или элемент архива)
+        p_signature_id UUID DEFAULT NULL -- id сигнатуры для сканирования, если NULL, то сканируем всеми сигнатурами
+    ) RETURNS JSONB AS $$
+    DECLARE
+        v_scan_result JSONB := '[]'::JSONB; -- Результаты сканирования
+        v_signature_record RECORD;          -- Данные текущей сигнатуры
+        v_base BIGINT := 256;               -- Основание для полиномиального хэша
+        v_mod BIGINT := 1000000007;         -- Модуль для хэш-функции
+        v_power BIGINT := 1;                -- base^(window_size-1) mod mod
+        v_target_hash BIGINT;               -- Хэш первых байт сигнатуры
+        v_window_size INT;                  -- Размер окна сравнения (определяется динамически)
+        v_match_found BOOLEAN;              -- Флаг совпадения
+        v_remainder_content BYTEA;          -- Хвост сигнатуры из файла
+        v_remainder_hash TEXT;              -- MD5 хэш хвоста
+        v_offset_start INT;                 -- Смещение начала сигнатуры
+        v_offset_end INT;                   -- Смещение конца сигнатуры
+        v_result_entry JSONB;               -- Запись результата
+        v_cursor CURSOR FOR                 -- Курсор для выборки сигнатур
+            SELECT * FROM ONLY antivirus.signatures
+            WHERE status = 'ACTUAL'
+            AND (p_signature_id IS NULL OR id = p_signature_id);
+    BEGIN
+        -- Перебираем все сигнатуры (или конкретную)
+        FOR v_signature_record IN v_cursor LOOP
+            -- Определяем размер окна по длине first_bytes
+            v_window_size := length(v_signature_record.first_bytes);
+
+            -- Пересчитываем power для текущего размера окна
+            v_power := 1;
+            FOR i IN 1..(v_window_size-1) LOOP
+                v_power := (v_power * v_base) % v_mod;
+            END LOOP;
+
+            -- Вычисляем хэш первых байт сигнатуры
+            v_target_hash := 0;
+            FOR i IN 1..v_window_size LOOP
+                IF i <= length(v_signature_record.first_bytes) THEN
+                    v_target_hash := (v_target_hash * v_base + ascii(substring(v_signature_record.first_bytes from i for 1))) % v_mod;
+                END IF;
+            END LOOP;
+
+            -- Ищем вхождение первых байт в содержимом
+            v_offset_start := position(v_signature_record.first_bytes::bytea in p_content);
+
+            IF v_offset_start > 0 THEN
+                -- Проверяем остаток сигнатуры
+                v_remainder_content := substring(p_content
+                    from v_offset_start + v_window_size
+                    for v_signature_record.remainder_length);
+
+                v_remainder_hash := md5(v_remainder_content);
+
+                -- Проверяем совпадение хэша остатка
+                v_match_found := (v_remainder_hash = v_signature_record.remainder_hash);
+
+                -- Проверяем смещения
+                IF v_match_found AND v_signature_record.offset_start IS NOT NULL THEN
+                    v_offset_start := v_offset_start - 1; -- преобразуем в 0-based индекс
+                    v_offset_end := v_offset_start + v_window_size + v_signature_record.remainder_length - 1;
+
+                    IF v_offset_start < v_signature_record.offset_start OR
+                       (v_signature_record.offset_end IS NOT NULL AND
+                        v_offset_end > v_signature_record.offset_end) THEN
+                        v_match_found := FALSE;
+                    END IF;
+                END IF;
+            ELSE
+                v_match_found := FALSE;
+            END IF;
+
+            -- Формируем запись результата
+            v_result_entry := jsonb_build_object(
+                'signatureId', v_signature_record.id,
+                'threatName', v_signature_record.threat_name,
+                'offsetFromStart', CASE WHEN v_match_found THEN (v_offset_start) ELSE NULL END,
+                'offsetFromEnd', CASE WHEN v_match_found THEN
+                    (v_offset_start + v_window_size + v_signature_record.remainder_length)
+                    ELSE NULL END,
+                'matched', v_match_found
+            );
+
+            -- Добавляем запись в результаты
+            v_scan_result := v_scan_result || v_result_entry;
+        END LOOP;
+
+        RETURN v_scan_result;
+    END;
+    $$ LANGUAGE plpgsql
+    COST 100;
+
+    COMMENT ON FUNCTION antivirus.scan_content_with_rabin_karp(BYTEA, UUID) IS 'Функция сканирования произвольного содержимого с алгоритмом Рабина-Карпа (без сохранения результата)';
+    """,
+    """
+    -- DROP FUNCTION IF EXISTS antivirus.scan_file_with_rabin_karp(UUID,UUID);
+    CREATE OR REPLACE FUNCTION antivirus.scan_file_with_rabin_karp(
+        p_file_id UUID,                  -- id файла для сканирования
+        p_signature_id UUID DEFAULT NULL -- id сигнатуры для сканирования, если NULL, то сканируем всеми сигнатурами
+    ) RETURNS JSONB AS $$
+    DECLARE
+        v_file_content BYTEA;               -- Содержимое файла в бинарном формате
+        v_purged_at TIMESTAMP;              -- Время удаления содержимого политикой хранения
+        v_scan_result JSONB;                -- Результаты сканирования
+        v_file_info_json JSONB;             -- Возврат результата
+    BEGIN
+        -- Получаем содержимое файла
+        SELECT content, content_purged_at INTO v_file_content, v_purged_at
+        FROM antivirus.files
+        WHERE id = p_file_id;
+
+        IF NOT FOUND THEN
+            RAISE EXCEPTION 'Файл с ID % не найден', p_file_id;
+        END IF;
+
+        IF v_purged_at IS NOT NULL THEN
+            RAISE EXCEPTION 'Содержимое файла с ID % удалено политикой хранения %', p_file_id, v_purged_at;
+        END IF;
+
+        -- Сканируем содержимое всеми сигнатурами (или конкретной)
+        v_scan_result := antivirus.scan_content_with_rabin_karp(v_file_content, p_signature_id);
+
+        -- Сохраняем результаты сканирования
+        UPDATE antivirus.files
+        SET scan_result = v_scan_result,
+            updated_at = NOW()
+        WHERE id = p_file_id;
+        -- Получения данных таблицы для возврата результата из функции
+        SELECT
+            json_build_object(
+                'id', id,
+                'name', name,
+                'size', size,
+                'scan_result', scan_result,
+                'created_at', created_at,
+                'updated_at', updated_at
+            ) as file_info INTO v_file_info_json
+        FROM antivirus.files
+        WHERE id = p_file_id;
+
+        RETURN v_file_info_json;
+    END;
+    $$ LANGUAGE plpgsql
+    COST 100;
+
+    COMMENT ON FUNCTION antivirus.scan_file_with_rabin_karp(UUID, UUID) IS 'Функция сканирования файлов с алгоритмом Рабина-Карпа';
+    """,
+    """
+    -- DROP FUNCTION IF EXISTS antivirus.files_purge_content(INTERVAL, INTERVAL, INT);
+    CREATE OR REPLACE FUNCTION antivirus.files_purge_content(
+        p_clean_after INTERVAL DEFAULT NULL,    -- через сколько после чистого сканирования удалять содержимое (NULL - не удалять)
+        p_infected_after INTERVAL DEFAULT NULL, -- через сколько после сканирования с совпадениями удалять содержимое (NULL - хранить)
+        p_limit INT DEFAULT 100                 -- размер пачки
+    ) RETURNS INT AS $$
+    DECLARE
+        v_count INT;
+    BEGIN
+        -- Берём небольшую пачку кандидатов, пропуская строки, заблокированные другими транзакциями,
+        -- чтобы очистка не вызывала долгих блокировок и массовых операций vacuum
+        WITH candidates AS (
+            SELECT id
+            FROM antivirus.files
+            WHERE content_purged_at IS NULL
+              AND scan_result IS NOT NULL
+              AND (
+                    (p_clean_after IS NOT NULL
+                     AND NOT scan_result @> '[{"matched": true}]'
+                     AND updated_at < NOW() - p_clean_after)
+                 OR (p_infected_after IS NOT NULL
+                     AND scan_result @> '[{"matched": true}]'
+                     AND updated_at < NOW() - p_infected_after)
+              )
+            ORDER BY updated_at
+            LIMIT p_limit
+            FOR UPDATE SKIP LOCKED
+        )
+        UPDATE antivirus.files f
+        SET content = ''::BYTEA,
+            content_purged_at = NOW()
+        FROM candidates c
+        WHERE f.id = c.id;
+
+        GET DIAGNOSTICS v_count = ROW_COUNT;
+        RETURN v_count;
+    END;
+    $$ LANGUAGE plpgsql
+    COST 100;
+
+    COMMENT ON FUNCTION antivirus.files_purge_content(INTERVAL, INTERVAL, INT) IS 'Функция удаления содержимого просканированных файлов по политике хранения (пачками)';
+    """,
+    """
+    -- DROP FUNCTION IF EXISTS antivirus.signatures_iud(JSON);
+    CREATE OR REPLACE FUNCTION antivirus.signatures_iud(p_data JSON)
+    RETURNS UUID AS $$
+    DECLARE
+        v_id UUID;
+        v_threat_name TEXT;
+        v_first_bytes VARCHAR(8);
+        v_remainder_hash VARCHAR(64);
+        v_remainder_length INT;
+        v_file_type TEXT;
+        v_offset_start INT;
+        v_offset_end INT;
+        v_digital_signature BYTEA;
+        v_status TEXT;
+        v_record_exists BOOLEAN;
+        v_keys TEXT[];
+    BEGIN
+        -- Извлекаем ID из JSON (может быть NULL для новой записи)
+        v_id := (p_data->>'id')::UUID;
+
+        -- Проверяем, существует ли запись с таким ID
+        IF v_id IS NOT NULL THEN
+            SELECT EXISTS(SELECT 1 FROM ONLY antivirus.signatures WHERE id = v_id) INTO v_record_exists;
+        ELSE
+            v_record_exists := FALSE;
+        END IF;
+
+        -- Получаем ключи JSON как массив
+        SELECT array_agg(key) INTO v_keys FROM jsonb_object_keys(p_data::jsonb) AS key;
+
+        -- Если ID не указан или запись не существует - создаем новую
+        IF v_id IS NULL OR NOT v_record_exists THEN
+            -- Проверяем обязательные поля для создания новой записи
+            IF NOT (p_data::jsonb ? 'threat_name' AND
+                    p_data::jsonb ? 'first_bytes' AND
+                    p_data::jsonb ? 'remainder_hash' AND
+                    p_data::jsonb ? 'remainder_length' AND
+                    p_data::jsonb ? 'file_type') THEN
+                RAISE EXCEPTION 'Для создания новой сигнатуры необходимо указать threat_name, first_bytes, remainder_hash, remainder_length и file_type';
+            END IF;
+
+            -- Извлекаем значения из JSON
+            v_threat_name := p_data->>'threat_name';
+            v_first_bytes := p_data->>'first_bytes';
+            v_remainder_hash := p_data->>'remainder_hash';
+            v_remainder_length := (p_data->>'remainder_length')::INT;
+            v_file_type := p_data->>'file_type';
+            v_offset_start := (p_data->>'offset_start')::INT;
+            v_offset_end := (p_data->>'offset_end')::INT;
+            v_status := COALESCE(p_data->>'status', 'ACTUAL');
+
+            -- Вставляем новую запись
+            INSERT INTO antivirus.signatures (
+                id,
+                threat_name,
+                first_bytes,
+                remainder_hash,
+                remainder_length,
+                file_type,
+                offset_start,
+                offset_end,
+                status,
+                updated_at
+            ) VALUES (
+                COALESCE(v_id, gen_random_uuid()),
+                v_threat_name,
+                v_first_bytes,
+                v_remainder_hash,
+                v_remainder_length,
+                v_file_type,
+                v_offset_start,
+                v_offset_end,
+                v_status,
+                NOW()
+            ) RETURNING id INTO v_id;
+
+        -- Если указан только ID - удаляем запись
+        ELSEIF array_length(v_keys, 1) = 1 AND v_keys[1] = 'id' THEN
+            DELETE FROM ONLY antivirus.signatures WHERE id = v_id;
+
+        -- Если запись существует и есть поля для обновления
+        ELSE
+            -- Формируем динамический UPDATE с учетом только переданных полей
+            EXECUTE format('
+                UPDATE ONLY antivirus.signatures SET
+                    threat_name = COALESCE(%L, threat_name),
+                    first_bytes = COALESCE(%L, first_bytes),
+                    remainder_hash = COALESCE(%L, remainder_hash),
+                    remainder_length = COALESCE(%L, remainder_length),
+                    file_type = COALESCE(%L, file_type),
+                    offset_start = COALESCE(%L, offset_start),
+                    offset_end = COALESCE(%L, offset_end),
+                    status = COALESCE(%L, status),
+                    updated_at = NOW()
+                WHERE id = %L
+                RETURNING id',
+                p_data->>'threat_name',
+                p_data->>'first_bytes',
+                p_data->>'remainder_hash',
+                (p_data->>'remainder_length')::INT,
+                p_data->>'file_type',
+                (p_data->>'offset_start')::INT,
+                (p_data->>'offset_end')::INT,
+                p_data->>'status',
+                v_id
+            ) INTO v_id;
+        END IF;
+
+        RETURN v_id;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    COMMENT ON FUNCTION antivirus.signatures_iud(JSON) IS 'Функция для добавления/изменения/удаления записей в таблице signatures на основе входного JSON';
+    """,
+    """
+    --DROP FUNCTION IF EXISTS antivirus.trf_signatures_history_biud() CASCADE;
+    CREATE OR REPLACE FUNCTION antivirus.trf_signatures_history_biud()
+      RETURNS trigger AS
+    $BODY$
+    DECLARE
+    BEGIN
+
+    IF TG_OP = 'DELETE' THEN
+        -- при удалении не удаляем запись, а обновляем status на DELETED, пишем новое время действия
+        UPDATE ONLY antivirus.signatures
+            SET status = 'DELETED',
+                updated_at = clock_timestamp()
+        WHERE id = OLD.id;
+        -- с текущей записью больше ничего не делаем
+        RETURN NULL;
+    ELSIF TG_OP = 'UPDATE' THEN
+        IF NEW.status = 'DELETED' AND OLD.status = 'DELETED' THEN
+            RAISE EXCEPTION 'Невозможно обновить удалённую запись без восстановления.';
+        END IF;
+        -- предотвращаем срабатывание триггера на пустые обновления
+        IF  NEW.id IS DISTINCT FROM OLD.id OR
+            NEW.threat_name IS DISTINCT FROM OLD.threat_name OR
+            NEW.first_bytes IS DISTINCT FROM OLD.first_bytes OR
+            NEW.remainder_hash IS DISTINCT FROM OLD.remainder_hash OR
+            NEW.remainder_length IS DISTINCT FROM OLD.remainder_length OR
+            NEW.file_type IS DISTINCT FROM OLD.file_type OR
+            NEW.offset_start IS DISTINCT FROM OLD.offset_start OR
+            NEW.offset_end IS DISTINCT FROM OLD.offset_end OR
+            NEW.digital_signature IS DISTINCT FROM OLD.digital_signature OR
+            NEW.status IS DISTINCT FROM OLD.status
+        THEN
+            -- при обновлении пишем новое время действия
+            NEW.updated_at := clock_timestamp();
+            -- вставляем в history предыдущее состояние
+            -- поле version_created_at - время предыдущего действия, поэтому берём его из OLD.updated_at
+            INSERT INTO antivirus.history (id, threat_name, first_bytes, remainder_hash, remainder_length, file_type
+                                    , offset_start, offset_end, digital_signature, status, updated_at, version_created_at)
+            SELECT OLD.id, OLD.threat_name, OLD.first_bytes, OLD.remainder_hash, OLD.remainder_length, OLD.file_type
+                 , OLD.offset_start, OLD.offset_end, OLD.digital_signature, OLD.status, OLD.updated_at, OLD.updated_at;
+            -- записываем новое состояние
+            RETURN NEW;
+        END IF;
+
+        RETURN NULL;
+    ELSIF TG_OP = 'INSERT' THEN
+        -- при вставке предыдущего значения нет в history ничего не пишем
+        RETURN NEW;
+    END IF;
+
+    END;
+    $BODY$
+      LANGUAGE plpgsql VOLATILE
+      COST 100;
+
+    COMMENT ON FUNCTION antivirus.trf_signatures_history_biud() IS 'Триггерная функция версионировании записей таблицы antivirus.signatures';
+    """,
+    """
+    DROP TRIGGER IF EXISTS tr_signatures_history_biud ON antivirus.signatures;
+    CREATE TRIGGER tr_signatures_history_biud
+      BEFORE INSERT OR UPDATE OR DELETE
+      ON antivirus.signatures
+      FOR EACH ROW
+      EXECUTE PROCEDURE antivirus.trf_signatures_history_biud();
+      
+    COMMENT ON TRIGGER tr_signatures_history_biud ON antivirus.signatures IS 'Триггер версионировании записей таблицы antivirus.signatures';
+    """,
+    """
+    --DROP FUNCTION IF EXISTS antivirus.trf_signatures_history_biud() CASCADE;
+    CREATE OR REPLACE FUNCTION antivirus.trf_audit_aiu()
+      RETURNS trigger AS
+    $BODY$
+    DECLARE
+        new_row jsonb := '{}';
+        old_row jsonb := '{}';
+    BEGIN
+
+    IF TG_OP = 'UPDATE' THEN
+        -- обрабатываем удаление записи
+        IF NEW.status = 'DELETED' THEN
+            INSERT INTO antivirus.audit (signature_id, changed_by, change_type, changed_at, fields_changed)
+            VALUES (NEW.id, DEFAULT, 'DELETED', NEW.updated_at, json_build_object('NEW', null, 'OLD', row_to_json(NEW)));
+        ELSE
+            -- добавляем только изменённые поля
+            IF NEW.id IS DISTINCT FROM OLD.id THEN
+                SELECT old_row || jsonb_build_object('id', OLD.id), new_row || jsonb_build_object('id', NEW.id) INTO old_row, new_row;
+            END IF;
+            IF NEW.threat_name IS DISTINCT FROM OLD.threat_name THEN
+                SELECT old_row || jsonb_build_object('threat_name', OLD.threat_name), new_row || jsonb_build_object('threat_name', NEW.threat_name) INTO old_row, new_row;
+            END IF;
+            IF NEW.first_bytes IS DISTINCT FROM OLD.first_bytes THEN
+                SELECT old_row || jsonb_build_object('first_bytes', OLD.first_bytes), new_row || jsonb_build_object('first_bytes', NEW.first_bytes) INTO old_row, new_row;
+            END IF;
+            IF NEW.remainder_hash IS DISTINCT FROM OLD.remainder_hash THEN
+                SELECT old_row || jsonb_build_object('remainder_hash', OLD.remainder_hash), new_row || jsonb_build_object('remainder_hash', NEW.remainder_hash) INTO old_row, new_row;
+            END IF;
+            IF NEW.remainder_length IS DISTINCT FROM OLD.remainder_length THEN
+                SELECT old_row || jsonb_build_object('remainder_length', OLD.remainder_length), new_row || jsonb_build_object('remainder_length', NEW.remainder_length) INTO old_row, new_row;
+            END IF;
+            IF NEW.file_type IS DISTINCT FROM OLD.file_type THEN
+                SELECT old_row || jsonb_build_object('file_type', OLD.file_type), new_row || jsonb_build_object('file_type', NEW.file_type) INTO old_row, new_row;
+            END IF;
+            IF NEW.offset_start IS DISTINCT FROM OLD.offset_start THEN
+                SELECT old_row || jsonb_build_object('offset_start', OLD.offset_start), new_row || jsonb_build_object('offset_start', NEW.offset_start) INTO old_row, new_row;
+            END IF;
+            IF NEW.offset_end IS DISTINCT FROM OLD.offset_end THEN
+                SELECT old_row || jsonb_build_object('offset_end', OLD.offset_end), new_row || jsonb_build_object('offset_end', NEW.offset_end) INTO old_row, new_row;
+            END IF;
+            IF NEW.digital_signature IS DISTINCT FROM OLD.digital_signature THEN
+                SELECT old_row || jsonb_build_object('digital_signature', OLD.digital_signature), new_row || jsonb_build_object('digital_signature', NEW.digital_signature) INTO old_row, new_row;
+            END IF;
+            IF NEW.status IS DISTINCT FROM OLD.status THEN
+                SELECT old_row || jsonb_build_object('status', OLD.status), new_row || jsonb_build_object('status', NEW.status) INTO old_row, new_row;
+            END IF;
+            IF NEW.updated_at IS DISTINCT FROM OLD.updated_at THEN
+                SELECT old_row || jsonb_build_object('updated_at', OLD.updated_at), new_row || jsonb_build_object('updated_at', NEW.updated_at) INTO old_row, new_row;
+            END IF;
+            -- обрали изменённые данные, пишем в audit
+            INSERT INTO antivirus.audit (signature_id, changed_by, change_type, changed_at, fields_changed)
+            VALUES (OLD.id, DEFAULT, 'UPDATED', OLD.updated_at, json_build_object('NEW', new_row, 'OLD', old_row));
+        END IF;
+
+    ELSIF TG_OP = 'INSERT' THEN
+        -- пишем audit
+        INSERT INTO antivirus.audit (signature_id, changed_by, change_type, changed_at, fields_changed)
+        VALUES (NEW.id, DEFAULT, 'CREATED', NEW.updated_at, json_build_object('NEW', row_to_json(NEW), 'OLD', null));
+        -- обрабатываем вставку удалённой записи
+        IF NEW.status = 'DELETED' THEN
+            INSERT INTO antivirus.audit (signature_id, changed_by, change_type, changed_at, fields_changed)
+            VALUES (NEW.id, DEFAULT, 'DELETED', NEW.updated_at, json_build_object('NEW', null, 'OLD', row_to_json(NEW)));
+        END IF;
+    END IF;
+
+    RETURN NEW;
+    END;
+    $BODY$
+      LANGUAGE plpgsql VOLATILE
+      COST 100;
+
+    COMMENT ON FUNCTION antivirus.trf_audit_aiu() IS 'Триггерная функция аудита записей таблицы antivirus.signatures';
+    """,
+    """
+    DROP TRIGGER IF EXISTS tr_audit_aiu ON antivirus.signatures;
+    CREATE TRIGGER tr_audit_aiu
+      AFTER INSERT OR UPDATE
+      ON antivirus.signatures
+      FOR EACH ROW
+      EXECUTE PROCEDURE antivirus.trf_audit_aiu();
+
+    COMMENT ON TRIGGER tr_audit_aiu ON antivirus.signatures IS 'Триггер аудита записей таблицы antivirus.signatures';
+    """
+]
+
+# Массовый импорт сигнатур: построчные триггеры пропускают транзакцию импорта,
+# history и audit пишет signatures_import одним запросом на весь набор
+MIGRATION_0002 = [
+    """
+    --DROP FUNCTION IF EXISTS antivirus.trf_signatures_history_biud() CASCADE;
+    CREATE OR REPLACE FUNCTION antivirus.trf_signatures_history_biud()
+      RETURNS trigger AS
+    $BODY$
+    DECLARE
+    BEGIN
+
+    -- массовый импорт (signatures_import) пишет history одним запросом на весь набор
+    IF TG_OP <> 'DELETE' AND current_setting('antivirus.bulk_import', true) = 'on' THEN
+        RETURN NEW;
+    END IF;
+
+    IF TG_OP = 'DELETE' THEN
+        -- при удалении не удаляем запись, а обновляем status на DELETED, пишем новое время действия
+        UPDATE ONLY antivirus.signatures
+            SET status = 'DELETED',
+                updated_at = clock_timestamp()
+        WHERE id = OLD.id;
+        -- с текущей записью больше ничего не делаем
+        RETURN NULL;
+    ELSIF TG_OP = 'UPDATE' THEN
+        IF NEW.status = 'DELETED' AND OLD.status = 'DELETED' THEN
+            RAISE EXCEPTION 'Невозможно обновить удалённую запись без восстановления.';
+        END IF;
+        -- предотвращаем срабатывание триггера на пустые обновления
+        IF  NEW.id IS DISTINCT FROM OLD.id OR
+            NEW.threat_name IS DISTINCT FROM OLD.threat_name OR
+            NEW.first_bytes IS DISTINCT FROM OLD.first_bytes OR
+            NEW.remainder_hash IS DISTINCT FROM OLD.remainder_hash OR
+            NEW.remainder_length IS DISTINCT FROM OLD.remainder_length OR
+            NEW.file_type IS DISTINCT FROM OLD.file_type OR
+            NEW.offset_start IS DISTINCT FROM OLD.offset_start OR
+            NEW.offset_end IS DISTINCT FROM OLD.offset_end OR
+            NEW.digital_signature IS DISTINCT FROM OLD.digital_signature OR
+            NEW.status IS DISTINCT FROM OLD.status
+        THEN
+            -- при обновлении пишем новое время действия
+            NEW.updated_at := clock_timestamp();
+            -- вставляем в history предыдущее состояние
+            -- поле version_created_at - время предыдущего действия, поэтому берём его из OLD.updated_at
+            INSERT INTO antivirus.history (id, threat_name, first_bytes, remainder_hash, remainder_length, file_type
+                                    , offset_start, offset_end, digital_signature, status, updated_at, version_created_at)
+            SELECT OLD.id, OLD.threat_name, OLD.first_bytes, OLD.remainder_hash, OLD.remainder_length, OLD.file_type
+                 , OLD.offset_start, OLD.offset_end, OLD.digital_signature, OLD.status, OLD.updated_at, OLD.updated_at;
+            -- записываем новое состояние
+            RETURN NEW;
+        END IF;
+
+        RETURN NULL;
+    ELSIF TG_OP = 'INSERT' THEN
+        -- при вставке предыдущего значения нет в history ничего не пишем
+        RETURN NEW;
+    END IF;
+
+    END;
+    $BODY$
+      LANGUAGE plpgsql VOLATILE
+      COST 100;
+
+    COMMENT ON FUNCTION antivirus.trf_signatures_history_biud() IS 'Триггерная функция версионировании записей таблицы antivirus.signatures';
+    """,
+    """
+    --DROP FUNCTION IF EXISTS antivirus.trf_signatures_history_biud() CASCADE;
+    CREATE OR REPLACE FUNCTION antivirus.trf_audit_aiu()
+      RETURNS trigger AS
+    $BODY$
+    DECLARE
+        new_row jsonb := '{}';
+        old_row jsonb := '{}';
+    BEGIN
+
+    -- массовый импорт (signatures_import) пишет audit одним запросом на весь набор
+    IF current_setting('antivirus.bulk_import', true) = 'on' THEN
+        RETURN NEW;
+    END IF;
+
+    IF TG_OP = 'UPDATE' THEN
+        -- обрабатываем удаление записи
+        IF NEW.status = 'DELETED' THEN
+            INSERT INTO antivirus.audit (signature_id, changed_by, change_type, changed_at, fields_changed)
+            VALUES (NEW.id, DEFAULT, 'DELETED', NEW.updated_at, json_build_object('NEW', null, 'OLD', row_to_json(NEW)));
+        ELSE
+            -- добавляем только изменённые поля
+            IF NEW.id IS DISTINCT FROM OLD.id THEN
+                SELECT old_row || jsonb_build_object('id', OLD.id), new_row || jsonb_build_object('id', NEW.id) INTO old_row, new_row;
+            END IF;
+            IF NEW.threat_name IS DISTINCT FROM OLD.threat_name THEN
+                SELECT old_row || jsonb_build_object('threat_name', OLD.threat_name), new_row || jsonb_build_object('threat_name', NEW.threat_name) INTO old_row, new_row;
+            END IF;
+            IF NEW.first_bytes IS DISTINCT FROM OLD.first_bytes THEN
+                SELECT old_row || jsonb_build_object('first_bytes', OLD.first_bytes), new_row || jsonb_build_object('first_bytes', NEW.first_bytes) INTO old_row, new_row;
+            END IF;
+            IF NEW.remainder_hash IS DISTINCT FROM OLD.remainder_hash THEN
+                SELECT old_row || jsonb_build_object('remainder_hash', OLD.remainder_hash), new_row || jsonb_build_object('remainder_hash', NEW.remainder_hash) INTO old_row, new_row;
+            END IF;
+            IF NEW.remainder_length IS DISTINCT FROM OLD.remainder_length THEN
+                SELECT old_row || jsonb_build_object('remainder_length', OLD.remainder_length), new_row || jsonb_build_object('remainder_length', NEW.remainder_length) INTO old_row, new_row;
+            END IF;
+            IF NEW.file_type IS DISTINCT FROM OLD.file_type THEN
+                SELECT old_row || jsonb_build_object('file_type', OLD.file_type), new_row || jsonb_build_object('file_type', NEW.file_type) INTO old_row, new_row;
+            END IF;
+            IF NEW.offset_start IS DISTINCT FROM OLD.offset_start THEN
+                SELECT old_row || jsonb_build_object('offset_start', OLD.offset_start), new_row || jsonb_build_object('offset_start', NEW.offset_start) INTO old_row, new_row;
+            END IF;
+            IF NEW.offset_end IS DISTINCT FROM OLD.offset_end THEN
+                SELECT old_row || jsonb_build_object('offset_end', OLD.offset_end), new_row || jsonb_build_object('offset_end', NEW.offset_end) INTO old_row, new_row;
+            END IF;
+            IF NEW.digital_signature IS DISTINCT FROM OLD.digital_signature THEN
+                SELECT old_row || jsonb_build_object('digital_signature', OLD.digital_signature), new_row || jsonb_build_object('digital_signature', NEW.digital_signature) INTO old_row, new_row;
+            END IF;
+            IF NEW.status IS DISTINCT FROM OLD.status THEN
+                SELECT old_row || jsonb_build_object('status', OLD.status), new_row || jsonb_build_object('status', NEW.status) INTO old_row, new_row;
+            END IF;
+            IF NEW.updated_at IS DISTINCT FROM OLD.updated_at THEN
+                SELECT old_row || jsonb_build_object('updated_at', OLD.updated_at), new_row || jsonb_build_object('updated_at', NEW.updated_at) INTO old_row, new_row;
+            END IF;
+            -- обрали изменённые данные, пишем в audit
+            INSERT INTO antivirus.audit (signature_id, changed_by, change_type, changed_at, fields_changed)
+            VALUES (OLD.id, DEFAULT, 'UPDATED', OLD.updated_at, json_build_object('NEW', new_row, 'OLD', old_row));
+        END IF;
+
+    ELSIF TG_OP = 'INSERT' THEN
+        -- пишем audit
+        INSERT INTO antivirus.audit (signature_id, changed_by, change_type, changed_at, fields_changed)
+        VALUES (NEW.id, DEFAULT, 'CREATED', NEW.updated_at, json_build_object('NEW', row_to_json(NEW), 'OLD', null));
+        -- обрабатываем вставку удалённой записи
+        IF NEW.status = 'DELETED' THEN
+            INSERT INTO antivirus.audit (signature_id, changed_by, change_type, changed_at, fields_changed)
+            VALUES (NEW.id, DEFAULT, 'DELETED', NEW.updated_at, json_build_object('NEW', null, 'OLD', row_to_json(NEW)));
+        END IF;
+    END IF;
+
+    RETURN NEW;
+    END;
+    $BODY$
+      LANGUAGE plpgsql VOLATILE
+      COST 100;
+
+    COMMENT ON FUNCTION antivirus.trf_audit_aiu() IS 'Триггерная функция аудита записей таблицы antivirus.signatures';
+    """,
+    """
+    -- DROP FUNCTION IF EXISTS antivirus.signatures_import();
+    CREATE OR REPLACE FUNCTION antivirus.signatures_import()
+    RETURNS TABLE (created INT, updated INT, deleted INT, unchanged INT) AS $$
+    DECLARE
+        v_now TIMESTAMP := clock_timestamp();
+        v_ord INT;
+    BEGIN
+        -- Набор загружается вызывающей стороной (COPY) во временную таблицу pg_temp.signatures_import_stage
+        ANALYZE pg_temp.signatures_import_stage;
+
+        -- Построчные триггеры истории и аудита пропускают изменения этой транзакции
+        PERFORM set_config('antivirus.bulk_import', 'on', true);
+
+        -- Блокируем существующие записи из набора до конца транзакции
+        PERFORM 1
+        FROM ONLY antivirus.signatures sig
+        JOIN pg_temp.signatures_import_stage st ON st.id = sig.id
+        FOR UPDATE OF sig;
+
+        -- Запись существует: передан только id - удаление, иначе изменение
+        -- (непереданные поля сохраняют текущее значение, как в signatures_iud); остальные строки - вставка
+        UPDATE pg_temp.signatures_import_stage st SET
+            action = CASE WHEN st.only_id THEN 'DELETE' ELSE 'UPDATE' END,
+            threat_name = COALESCE(st.threat_name, sig.threat_name),
+            first_bytes = COALESCE(st.first_bytes, sig.first_bytes),
+            remainder_hash = COALESCE(st.remainder_hash, sig.remainder_hash),
+            remainder_length = COALESCE(st.remainder_length, sig.remainder_length),
+            file_type = COALESCE(st.file_type, sig.file_type),
+            offset_start = COALESCE(st.offset_start, sig.offset_start),
+            offset_end = COALESCE(st.offset_end, sig.offset_end),
+            status = CASE WHEN st.only_id THEN 'DELETED' ELSE COALESCE(st.status, sig.status) END,
+            old_status = sig.status
+        FROM ONLY antivirus.signatures sig
+        WHERE sig.id = st.id;
+
+        -- Пустые изменения и повторное удаление пропускаем
+        UPDATE pg_temp.signatures_import_stage st SET
+            changed = (st.threat_name, st.first_bytes, st.remainder_hash, st.remainder_length, st.file_type,
+                       st.offset_start, st.offset_end, st.status)
+                      IS DISTINCT FROM
+                      (sig.threat_name, sig.first_bytes, sig.remainder_hash, sig.remainder_length, sig.file_type,
+                       sig.offset_start, sig.offset_end, sig.status)
+        FROM ONLY antivirus.signatures sig
+        WHERE sig.id = st.id;
+
+        SELECT st.ord INTO v_ord
+        FROM pg_temp.signatures_import_stage st
+        WHERE st.action = 'INSERT' AND (st.threat_name IS NULL OR st.first_bytes IS NULL OR st.remainder_hash IS NULL OR
+                                        st.remainder_length IS NULL OR st.file_type IS NULL)
+        ORDER BY st.ord
+        LIMIT 1;
+        IF FOUND THEN
+            RAISE EXCEPTION 'Элемент %: для создания новой сигнатуры необходимо указать threat_name, first_bytes, remainder_hash, remainder_length и file_type', v_ord
+                USING ERRCODE = 'invalid_parameter_value';
+        END IF;
+
+        SELECT st.ord INTO v_ord
+        FROM pg_temp.signatures_import_stage st
+        WHERE st.action = 'UPDATE' AND st.changed AND st.old_status = 'DELETED' AND st.status = 'DELETED'
+        ORDER BY st.ord
+        LIMIT 1;
+        IF FOUND THEN
+            RAISE EXCEPTION 'Элемент %: невозможно обновить удалённую запись без восстановления', v_ord
+                USING ERRCODE = 'invalid_parameter_value';
+        END IF;
+
+        -- history: предыдущее состояние изменяемых записей
+        INSERT INTO antivirus.history (id, threat_name, first_bytes, remainder_hash, remainder_length, file_type
+                                     , offset_start, offset_end, digital_signature, status, updated_at, version_created_at)
+        SELECT sig.id, sig.threat_name, sig.first_bytes, sig.remainder_hash, sig.remainder_length, sig.file_type
+             , sig.offset_start, sig.offset_end, sig.digital_signature, sig.status, sig.updated_at, sig.updated_at
+        FROM ONLY antivirus.signatures sig
+        JOIN pg_temp.signatures_import_stage st ON st.id = sig.id
+        WHERE st.action IN ('UPDATE', 'DELETE') AND st.changed;
+
+        -- Изменение и удаление (перевод в статус DELETED) одним UPDATE,
+        -- audit строится по состояниям записей до и после изменения (как в trf_audit_aiu)
+        WITH before_rows AS (
+            SELECT sig.*
+            FROM ONLY antivirus.signatures sig
+            JOIN pg_temp.signatures_import_stage st ON st.id = sig.id
+            WHERE st.action IN ('UPDATE', 'DELETE') AND st.changed
+        ), after_rows AS (
+            UPDATE ONLY antivirus.signatures sig SET
+                threat_name = st.threat_name,
+                first_bytes = st.first_bytes,
+                remainder_hash = st.remainder_hash,
+                remainder_length = st.remainder_length,
+                file_type = st.file_type,
+                offset_start = st.offset_start,
+                offset_end = st.offset_end,
+                status = st.status,
+                updated_at = v_now
+            FROM pg_temp.signatures_import_stage st
+            WHERE st.id = sig.id AND st.action IN ('UPDATE', 'DELETE') AND st.changed
+            RETURNING sig.*
+        )
+        INSERT INTO antivirus.audit (signature_id, change_type, changed_at, fields_changed)
+        SELECT a.id,
+               CASE WHEN a.status = 'DELETED' THEN 'DELETED' ELSE 'UPDATED' END,
+               CASE WHEN a.status = 'DELETED' THEN a.updated_at ELSE b.updated_at END,
+               CASE WHEN a.status = 'DELETED' THEN jsonb_build_object('NEW', NULL, 'OLD', to_jsonb(a))
+                    ELSE (
+                        -- только изменённые поля
+                        SELECT jsonb_build_object('NEW', jsonb_object_agg(n.key, n.value), 'OLD', jsonb_object_agg(o.key, o.value))
+                        FROM jsonb_each(to_jsonb(a)) n
+                        JOIN jsonb_each(to_jsonb(b)) o ON o.key = n.key
+                        WHERE n.value IS DISTINCT FROM o.value
+                    )
+               END
+        FROM after_rows a
+        JOIN before_rows b ON b.id = a.id;
+
+        -- Вставка новых записей с audit CREATED (и DELETED для записей, вставленных удалёнными)
+        WITH inserted AS (
+            INSERT INTO antivirus.signatures (id, threat_name, first_bytes, remainder_hash, remainder_length, file_type
+                                            , offset_start, offset_end, status, updated_at)
+            SELECT st.id, st.threat_name, st.first_bytes, st.remainder_hash, st.remainder_length, st.file_type
+                 , st.offset_start, st.offset_end, COALESCE(st.status, 'ACTUAL'), v_now
+            FROM pg_temp.signatures_import_stage st
+            WHERE st.action = 'INSERT'
+            RETURNING *
+        )
+        INSERT INTO antivirus.audit (signature_id, change_type, changed_at, fields_changed)
+        SELECT i.id, 'CREATED', i.updated_at, jsonb_build_object('NEW', to_jsonb(i), 'OLD', NULL)
+        FROM inserted i
+        UNION ALL
+        SELECT i.id, 'DELETED', i.updated_at, jsonb_build_object('NEW', NULL, 'OLD', to_jsonb(i))
+        FROM inserted i
+        WHERE i.status = 'DELETED';
+
+        RETURN QUERY
+        SELECT count(*) FILTER (WHERE st.action = 'INSERT')::INT,
+               count(*) FILTER (WHERE st.action = 'UPDATE' AND st.changed)::INT,
+               count(*) FILTER (WHERE st.action = 'DELETE' AND st.changed)::INT,
+               count(*) FILTER (WHERE st.action <> 'INSERT' AND NOT st.changed)::INT
+        FROM pg_temp.signatures_import_stage st;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    COMMENT ON FUNCTION antivirus.signatures_import() IS 'Функция массового импорта сигнатур из временной таблицы signatures_import_stage (вставка, изменение и удаление набором)';
+    """
+]
+
+# Триггеры истории и аудита уровня оператора: построчно остаётся только лёгкая проверка (tr_signatures_bud),
+# history и audit пишутся одним INSERT на оператор по таблицам переходов (REFERENCING OLD/NEW TABLE)
+MIGRATION_0003 = [
+    """
+    DROP TRIGGER IF EXISTS tr_signatures_history_biud ON antivirus.signatures;
+    DROP TRIGGER IF EXISTS tr_audit_aiu ON antivirus.signatures;
+    DROP FUNCTION IF EXISTS antivirus.trf_signatures_history_biud();
+    DROP FUNCTION IF EXISTS antivirus.trf_audit_aiu();
+    """,
+    """
+    -- DROP FUNCTION IF EXISTS antivirus.trf_signatures_bud() CASCADE;
+    CREATE OR REPLACE FUNCTION antivirus.trf_signatures_bud()
+      RETURNS trigger AS
+    $BODY$
+    BEGIN
+
+    IF TG_OP = 'DELETE' THEN
+        -- при удалении не удаляем запись, а обновляем status на DELETED, пишем новое время действия
+        UPDATE ONLY antivirus.signatures
+            SET status = 'DELETED',
+                updated_at = clock_timestamp()
+        WHERE id = OLD.id;
+        -- с текущей записью больше ничего не делаем
+        RETURN NULL;
+    END IF;
+
+    IF NEW.status = 'DELETED' AND OLD.status = 'DELETED' THEN
+        RAISE EXCEPTION 'Невозможно обновить удалённую запись без восстановления.';
+    END IF;
+    -- history и audit сопоставляют состояния до и после изменения по id
+    IF NEW.id IS DISTINCT FROM OLD.id THEN
+        RAISE EXCEPTION 'Изменение id сигнатуры не поддерживается.';
+    END IF;
+    -- пустые обновления отбрасываем: они не попадают ни в history, ни в audit
+    IF  (NEW.threat_name, NEW.first_bytes, NEW.remainder_hash, NEW.remainder_length, NEW.file_type,
+         NEW.offset_start, NEW.offset_end, NEW.digital_signature, NEW.status)
+        IS DISTINCT FROM
+        (OLD.threat_name, OLD.first_bytes, OLD.remainder_hash, OLD.remainder_length, OLD.file_type,
+         OLD.offset_start, OLD.offset_end, OLD.digital_signature, OLD.status)
+    THEN
+        -- при обновлении пишем новое время действия
+        NEW.updated_at := clock_timestamp();
+        RETURN NEW;
+    END IF;
+
+    RETURN NULL;
+    END;
+    $BODY$
+      LANGUAGE plpgsql VOLATILE
+      COST 100;
+
+    COMMENT ON FUNCTION antivirus.trf_signatures_bud() IS 'Триггерная функция проверки изменений и удаления записей таблицы antivirus.signatures (до изменения строки)';
+
+    CREATE TRIGGER tr_signatures_bud
+      BEFORE UPDATE OR DELETE
+      ON antivirus.signatures
+      FOR EACH ROW
+      EXECUTE PROCEDURE antivirus.trf_signatures_bud();
+
+    COMMENT ON TRIGGER tr_signatures_bud ON antivirus.signatures IS 'Триггер проверки изменений и удаления записей таблицы antivirus.signatures';
+    """,
+    """
+    -- DROP FUNCTION IF EXISTS antivirus.trf_signatures_history_au() CASCADE;
+    CREATE OR REPLACE FUNCTION antivirus.trf_signatures_history_au()
+      RETURNS trigger AS
+    $BODY$
+    BEGIN
+
+    -- вставляем в history предыдущее состояние всех изменённых оператором записей
+    -- поле version_created_at - время предыдущего действия, поэтому берём его из updated_at старой версии
+    INSERT INTO antivirus.history (id, threat_name, first_bytes, remainder_hash, remainder_length, file_type
+                            , offset_start, offset_end, digital_signature, status, updated_at, version_created_at)
+    SELECT o.id, o.threat_name, o.first_bytes, o.remainder_hash, o.remainder_length, o.file_type
+         , o.offset_start, o.offset_end, o.digital_signature, o.status, o.updated_at, o.updated_at
+    FROM old_rows o;
+
+    RETURN NULL;
+    END;
+    $BODY$
+      LANGUAGE plpgsql VOLATILE
+      COST 100;
+
+    COMMENT ON FUNCTION antivirus.trf_signatures_history_au() IS 'Триггерная функция версионировании записей таблицы antivirus.signatures (на оператор)';
+
+    CREATE TRIGGER tr_signatures_history_au
+      AFTER UPDATE
+      ON antivirus.signatures
+      REFERENCING OLD TABLE AS old_rows
+      FOR EACH STATEMENT
+      EXECUTE PROCEDURE antivirus.trf_signatures_history_au();
+
+    COMMENT ON TRIGGER tr_signatures_history_au ON antivirus.signatures IS 'Триггер версионировании записей таблицы antivirus.signatures';
+    """,
+    """
+    -- DROP FUNCTION IF EXISTS antivirus.trf_audit_ai() CASCADE;
+    CREATE OR REPLACE FUNCTION antivirus.trf_audit_ai()
+      RETURNS trigger AS
+    $BODY$
+    BEGIN
+
+    -- пишем audit CREATED и, для вставки удалённой записи, DELETED
+    INSERT INTO antivirus.audit (signature_id, change_type, changed_at, fields_changed)
+    SELECT n.id, 'CREATED', n.updated_at, jsonb_build_object('NEW', to_jsonb(n), 'OLD', NULL)
+    FROM new_rows n
+    UNION ALL
+    SELECT n.id, 'DELETED', n.updated_at, jsonb_build_object('NEW', NULL, 'OLD', to_jsonb(n))
+    FROM new_rows n
+    WHERE n.status = 'DELETED';
+
+    RETURN NULL;
+    END;
+    $BODY$
+      LANGUAGE plpgsql VOLATILE
+      COST 100;
+
+    COMMENT ON FUNCTION antivirus.trf_audit_ai() IS 'Триггерная функция аудита вставки записей таблицы antivirus.signatures (на оператор)';
+
+    CREATE TRIGGER tr_audit_ai
+      AFTER INSERT
+      ON antivirus.signatures
+      REFERENCING NEW TABLE AS new_rows
+      FOR EACH STATEMENT
+      EXECUTE PROCEDURE antivirus.trf_audit_ai();
+
+    COMMENT ON TRIGGER tr_audit_ai ON antivirus.signatures IS 'Триггер аудита вставки записей таблицы antivirus.signatures';
+    """,
+    """
+    -- DROP FUNCTION IF EXISTS antivirus.trf_audit_au() CASCADE;
+    CREATE OR REPLACE FUNCTION antivirus.trf_audit_au()
+      RETURNS trigger AS
+    $BODY$
+    BEGIN
+
+    -- удаление (перевод в статус DELETED) пишем целиком, для остальных изменений - только изменённые поля
+    INSERT INTO antivirus.audit (signature_id, change_type, changed_at, fields_changed)
+    SELECT n.id,
+           CASE WHEN n.status = 'DELETED' THEN 'DELETED' ELSE 'UPDATED' END,
+           CASE WHEN n.status = 'DELETED' THEN n.updated_at ELSE o.updated_at END,
+           CASE WHEN n.status = 'DELETED' THEN jsonb_build_object('NEW', NULL, 'OLD', to_jsonb(n))
+                ELSE jsonb_build_object(
+                    'NEW',
+                    CASE WHEN n.threat_name IS DISTINCT FROM o.threat_name THEN jsonb_build_object('threat_name', n.threat_name) ELSE '{}' END
+                 || CASE WHEN n.first_bytes IS DISTINCT FROM o.first_bytes THEN jsonb_build_object('first_bytes', n.first_bytes) ELSE '{}' END
+                 || CASE WHEN n.remainder_hash IS DISTINCT FROM o.remainder_hash THEN jsonb_build_object('remainder_hash', n.remainder_hash) ELSE '{}' END
+                 || CASE WHEN n.remainder_length IS DISTINCT FROM o.remainder_length THEN jsonb_build_object('remainder_length', n.remainder_length) ELSE '{}' END
+                 || CASE WHEN n.file_type IS DISTINCT FROM o.file_type THEN jsonb_build_object('file_type', n.file_type) ELSE '{}' END
+                 || CASE WHEN n.offset_start IS DISTINCT FROM o.offset_start THEN jsonb_build_object('offset_start', n.offset_start) ELSE '{}' END
+                 || CASE WHEN n.offset_end IS DISTINCT FROM o.offset_end THEN jsonb_build_object('offset_end', n.offset_end) ELSE '{}' END
+                 || CASE WHEN n.digital_signature IS DISTINCT FROM o.digital_signature THEN jsonb_build_object('digital_signature', n.digital_signature) ELSE '{}' END
+                 || CASE WHEN n.status IS DISTINCT FROM o.status THEN jsonb_build_object('status', n.status) ELSE '{}' END
+                 || CASE WHEN n.updated_at IS DISTINCT FROM o.updated_at THEN jsonb_build_object('updated_at', n.updated_at) ELSE '{}' END,
+                    'OLD',
+                    CASE WHEN n.threat_name IS DISTINCT FROM o.threat_name THEN jsonb_build_object('threat_name', o.threat_name) ELSE '{}' END
+                 || CASE WHEN n.first_bytes IS DISTINCT FROM o.first_bytes THEN jsonb_build_object('first_bytes', o.first_bytes) ELSE '{}' END
+                 || CASE WHEN n.remainder_hash IS DISTINCT FROM o.remainder_hash THEN jsonb_build_object('remainder_hash', o.remainder_hash) ELSE '{}' END
+                 || CASE WHEN n.remainder_length IS DISTINCT FROM o.remainder_length THEN jsonb_build_object('remainder_length', o.remainder_length) ELSE '{}' END
+                 || CASE WHEN n.file_type IS DISTINCT FROM o.file_type THEN jsonb_build_object('file_type', o.file_type) ELSE '{}' END
+                 || CASE WHEN n.offset_start IS DISTINCT FROM o.offset_start THEN jsonb_build_object('offset_start', o.offset_start) ELSE '{}' END
+                 || CASE WHEN n.offset_end IS DISTINCT FROM o.offset_end THEN jsonb_build_object('offset_end', o.offset_end) ELSE '{}' END
+                 || CASE WHEN n.digital_signature IS DISTINCT FROM o.digital_signature THEN jsonb_build_object('digital_signature', o.digital_signature) ELSE '{}' END
+                 || CASE WHEN n.status IS DISTINCT FROM o.status THEN jsonb_build_object('status', o.status) ELSE '{}' END
+                 || CASE WHEN n.updated_at IS DISTINCT FROM o.updated_at THEN jsonb_build_object('updated_at', o.updated_at) ELSE '{}' END
+                )
+           END
+    FROM new_rows n
+    JOIN old_rows o ON o.id = n.id;
+
+    RETURN NULL;
+    END;
+    $BODY$
+      LANGUAGE plpgsql VOLATILE
+      COST 100;
+
+    COMMENT ON FUNCTION antivirus.trf_audit_au() IS 'Триггерная функция аудита изменения записей таблицы antivirus.signatures (на оператор)';
+
+    CREATE TRIGGER tr_audit_au
+      AFTER UPDATE
+      ON antivirus.signatures
+      REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+      FOR EACH STATEMENT
+      EXECUTE PROCEDURE antivirus.trf_audit_au();
+
+    COMMENT ON TRIGGER tr_audit_au ON antivirus.signatures IS 'Триггер аудита изменения записей таблицы antivirus.signatures';
+    """,
+    """
+    -- DROP FUNCTION IF EXISTS antivirus.signatures_import();
+    CREATE OR REPLACE FUNCTION antivirus.signatures_import()
+    RETURNS TABLE (created INT, updated INT, deleted INT, unchanged INT) AS $$
+    DECLARE
+        v_now TIMESTAMP := clock_timestamp();
+        v_ord INT;
+    BEGIN
+        -- Набор загружается вызывающей стороной (COPY) во временную таблицу pg_temp.signatures_import_stage
+        ANALYZE pg_temp.signatures_import_stage;
+
+        -- Блокируем существующие записи из набора до конца транзакции
+        PERFORM 1
+        FROM ONLY antivirus.signatures sig
+        JOIN pg_temp.signatures_import_stage st ON st.id = sig.id
+        FOR UPDATE OF sig;
+
+        -- Запись существует: передан только id - удаление, иначе изменение
+        -- (непереданные поля сохраняют текущее значение, как в signatures_iud); остальные строки - вставка
+        UPDATE pg_temp.signatures_import_stage st SET
+            action = CASE WHEN st.only_id THEN 'DELETE' ELSE 'UPDATE' END,
+            threat_name = COALESCE(st.threat_name, sig.threat_name),
+            first_bytes = COALESCE(st.first_bytes, sig.first_bytes),
+            remainder_hash = COALESCE(st.remainder_hash, sig.remainder_hash),
+            remainder_length = COALESCE(st.remainder_length, sig.remainder_length),
+            file_type = COALESCE(st.file_type, sig.file_type),
+            offset_start = COALESCE(st.offset_start, sig.offset_start),
+            offset_end = COALESCE(st.offset_end, sig.offset_end),
+            status = CASE WHEN st.only_id THEN 'DELETED' ELSE COALESCE(st.status, sig.status) END,
+            old_status = sig.status
+        FROM ONLY antivirus.signatures sig
+        WHERE sig.id = st.id;
+
+        -- Пустые изменения и повторное удаление пропускаем
+        UPDATE pg_temp.signatures_import_stage st SET
+            changed = (st.threat_name, st.first_bytes, st.remainder_hash, st.remainder_length, st.file_type,
+                       st.offset_start, st.offset_end, st.status)
+                      IS DISTINCT FROM
+                      (sig.threat_name, sig.first_bytes, sig.remainder_hash, sig.remainder_length, sig.file_type,
+                       sig.offset_start, sig.offset_end, sig.status)
+        FROM ONLY antivirus.signatures sig
+        WHERE sig.id = st.id;
+
+        SELECT st.ord INTO v_ord
+        FROM pg_temp.signatures_import_stage st
+        WHERE st.action = 'INSERT' AND (st.threat_name IS NULL OR st.first_bytes IS NULL OR st.remainder_hash IS NULL OR
+                                        st.remainder_length IS NULL OR st.file_type IS NULL)
+        ORDER BY st.ord
+        LIMIT 1;
+        IF FOUND THEN
+            RAISE EXCEPTION 'Элемент %: для создания новой сигнатуры необходимо указать threat_name, first_bytes, remainder_hash, remainder_length и file_type', v_ord
+                USING ERRCODE = 'invalid_parameter_value';
+        END IF;
+
+        SELECT st.ord INTO v_ord
+        FROM pg_temp.signatures_import_stage st
+        WHERE st.action = 'UPDATE' AND st.changed AND st.old_status = 'DELETED' AND st.status = 'DELETED'
+        ORDER BY st.ord
+        LIMIT 1;
+        IF FOUND THEN
+            RAISE EXCEPTION 'Элемент %: невозможно обновить удалённую запись без восстановления', v_ord
+                USING ERRCODE = 'invalid_parameter_value';
+        END IF;
+
+        -- Изменение и удаление (перевод в статус DELETED) одним UPDATE;
+        -- history и audit пишут триггеры уровня оператора (tr_signatures_history_au, tr_audit_au)
+        UPDATE ONLY antivirus.signatures sig SET
+            threat_name = st.threat_name,
+            first_bytes = st.first_bytes,
+            remainder_hash = st.remainder_hash,
+            remainder_length = st.remainder_length,
+            file_type = st.file_type,
+            offset_start = st.offset_start,
+            offset_end = st.offset_end,
+            status = st.status
+        FROM pg_temp.signatures_import_stage st
+        WHERE st.id = sig.id AND st.action IN ('UPDATE', 'DELETE') AND st.changed;
+
+        -- Вставка новых записей одним INSERT (audit CREATED пишет tr_audit_ai)
+        INSERT INTO antivirus.signatures (id, threat_name, first_bytes, remainder_hash, remainder_length, file_type
+                                        , offset_start, offset_end, status, updated_at)
+        SELECT st.id, st.threat_name, st.first_bytes, st.remainder_hash, st.remainder_length, st.file_type
+             , st.offset_start, st.offset_end, COALESCE(st.status, 'ACTUAL'), v_now
+        FROM pg_temp.signatures_import_stage st
+        WHERE st.action = 'INSERT';
+
+        RETURN QUERY
+        SELECT count(*) FILTER (WHERE st.action = 'INSERT')::INT,
+               count(*) FILTER (WHERE st.action = 'UPDATE' AND st.changed)::INT,
+               count(*) FILTER (WHERE st.action = 'DELETE' AND st.changed)::INT,
+               count(*) FILTER (WHERE st.action <> 'INSERT' AND NOT st.changed)::INT
+        FROM pg_temp.signatures_import_stage st;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    COMMENT ON FUNCTION antivirus.signatures_import() IS 'Функция массового импорта сигнатур из временной таблицы signatures_import_stage (вставка, изменение и удаление набором)';
+    """
+]
+
+# Секционирование history и audit по месяцам: ключ секционирования - время записи recorded_at
+# (version_created_at и changed_at могут содержать время предыдущей версии и попасть в уже выгруженный месяц),
+# старые секции отсоединяются и выгружаются целиком (partitions.py)
+MIGRATION_0004 = [
+    """
+    -- DROP FUNCTION IF EXISTS antivirus.create_monthly_partitions(TEXT, DATE, DATE);
+    CREATE OR REPLACE FUNCTION antivirus.create_monthly_partitions(p_table TEXT, p_from DATE, p_to DATE)
+    RETURNS INT AS $$
+    DECLARE
+        v_month DATE := date_trunc('month', p_from)::DATE;
+        v_name TEXT;
+        v_created INT := 0;
+    BEGIN
+        -- По секции на каждый месяц диапазона: antivirus.<таблица>_pYYYY_MM, границы [начало месяца, начало следующего)
+        WHILE v_month <= p_to LOOP
+            v_name := p_table || '_p' || to_char(v_month, 'YYYY_MM');
+            IF to_regclass('antivirus.' || quote_ident(v_name)) IS NULL THEN
+                EXECUTE format('CREATE TABLE antivirus.%I PARTITION OF antivirus.%I FOR VALUES FROM (%L) TO (%L)',
+                               v_name, p_table, v_month, (v_month + INTERVAL '1 month')::DATE);
+                v_created := v_created + 1;
+            END IF;
+            v_month := (v_month + INTERVAL '1 month')::DATE;
+        END LOOP;
+        RETURN v_created;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    COMMENT ON FUNCTION antivirus.create_monthly_partitions(TEXT, DATE, DATE) IS 'Создание недостающих месячных секций таблицы antivirus.history или antivirus.audit';
+    """,
+    """
+    -- DROP FUNCTION IF EXISTS antivirus.detach_expired_partitions(TEXT, INT);
+    CREATE OR REPLACE FUNCTION antivirus.detach_expired_partitions(p_table TEXT, p_keep_months INT)
+    RETURNS SETOF TEXT AS $$
+    DECLARE
+        v_name TEXT;
+    BEGIN
+        -- Хранятся текущий месяц и p_keep_months предыдущих, более старые секции отсоединяются целиком
+        FOR v_name IN
+            SELECT c.relname
+            FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = ('antivirus.' || quote_ident(p_table))::REGCLASS
+              AND c.relname ~ ('^' || p_table || '_p[0-9]{4}_[0-9]{2}$')
+              AND to_date(right(c.relname, 7), 'YYYY_MM') < date_trunc('month', now()) - make_interval(months => p_keep_months)
+            ORDER BY c.relname
+        LOOP
+            EXECUTE format('ALTER TABLE antivirus.%I DETACH PARTITION antivirus.%I', p_table, v_name);
+            RETURN NEXT v_name;
+        END LOOP;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    COMMENT ON FUNCTION antivirus.detach_expired_partitions(TEXT, INT) IS 'Отсоединение секций antivirus.history или antivirus.audit старше срока хранения';
+    """,
+    """
+    -- 4. Таблица history: прежняя таблица (наследник signatures) переносится в секционированную
+    ALTER TABLE antivirus.history RENAME TO history_legacy;
+    ALTER TABLE antivirus.history_legacy NO INHERIT antivirus.signatures;
+    ALTER INDEX antivirus.history_pkey RENAME TO history_legacy_pkey;
+    DROP INDEX IF EXISTS antivirus.ix_history_id_version_created_at;
+    DROP INDEX IF EXISTS antivirus.ix_history_version_created_at;
+    ALTER TABLE antivirus.history_legacy ALTER COLUMN history_id DROP DEFAULT;
+    ALTER SEQUENCE antivirus.history_history_id_seq OWNED BY NONE;
+
+    CREATE TABLE antivirus.history (
+        id UUID NOT NULL,
+        threat_name TEXT NOT NULL,
+        first_bytes VARCHAR(8) NOT NULL,
+        remainder_hash VARCHAR(64) NOT NULL,
+        remainder_length INT NOT NULL,
+        file_type TEXT NOT NULL,
+        offset_start INT,
+        offset_end INT,
+        digital_signature BYTEA DEFAULT NULL,
+        status TEXT NOT NULL,
+        updated_at TIMESTAMP NOT NULL,
+        history_id BIGINT NOT NULL DEFAULT nextval('antivirus.history_history_id_seq'),
+        version_created_at TIMESTAMP NOT NULL,
+        recorded_at TIMESTAMP NOT NULL DEFAULT Now(),
+        PRIMARY KEY (history_id, recorded_at)
+    ) PARTITION BY RANGE (recorded_at);
+    ALTER SEQUENCE antivirus.history_history_id_seq OWNED BY antivirus.history.history_id;
+
+    COMMENT ON TABLE antivirus.history IS 'Изменения таблицы antivirus.signatures (секции по месяцам recorded_at)';
+    COMMENT ON COLUMN antivirus.history.history_id  IS 'Уникальный идентификатор записи в истории';
+    COMMENT ON COLUMN antivirus.history.version_created_at  IS 'Момент времени, когда появилась эта версия';
+    COMMENT ON COLUMN antivirus.history.recorded_at  IS 'Время записи версии в историю (ключ секционирования)';
+
+    -- Версия записывалась в историю, когда её сменила следующая: время следующей версии или текущей записи
+    CREATE TEMP TABLE history_migration ON COMMIT DROP AS
+    SELECT h.*,
+           COALESCE(lead(h.version_created_at) OVER w, sig.updated_at, h.version_created_at) AS recorded_at
+    FROM antivirus.history_legacy h
+    LEFT JOIN ONLY antivirus.signatures sig ON sig.id = h.id
+    WINDOW w AS (PARTITION BY h.id ORDER BY h.version_created_at, h.history_id);
+
+    SELECT antivirus.create_monthly_partitions('history',
+        COALESCE((SELECT min(recorded_at) FROM history_migration), Now())::DATE,
+        GREATEST((SELECT max(recorded_at) FROM history_migration), Now() + INTERVAL '3 months')::DATE);
+
+    INSERT INTO antivirus.history (id, threat_name, first_bytes, remainder_hash, remainder_length, file_type
+                                 , offset_start, offset_end, digital_signature, status, updated_at
+                                 , history_id, version_created_at, recorded_at)
+    SELECT id, threat_name, first_bytes, remainder_hash, remainder_length, file_type
+         , offset_start, offset_end, digital_signature, status, updated_at
+         , history_id, version_created_at, recorded_at
+    FROM history_migration;
+
+    DROP TABLE antivirus.history_legacy;
+    """,
+    """
+    -- 5. Таблица audit: перенос в секционированную таблицу
+    ALTER TABLE antivirus.audit RENAME TO audit_legacy;
+    ALTER INDEX antivirus.audit_pkey RENAME TO audit_legacy_pkey;
+    DROP INDEX IF EXISTS antivirus.ix_audit_signature_id_audit_id;
+    DROP INDEX IF EXISTS antivirus.ix_audit_change_type_audit_id;
+    ALTER TABLE antivirus.audit_legacy ALTER COLUMN audit_id DROP DEFAULT;
+    ALTER SEQUENCE antivirus.audit_audit_id_seq OWNED BY NONE;
+
+    CREATE TABLE antivirus.audit
+    (
+        audit_id INT NOT NULL DEFAULT nextval('antivirus.audit_audit_id_seq'),
+        signature_id UUID NOT NULL REFERENCES antivirus.signatures(id) MATCH SIMPLE ON UPDATE CASCADE ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED,
+        changed_by	TEXT NOT NULL DEFAULT SESSION_USER,
+        change_type	TEXT,
+        changed_at TIMESTAMP NOT NULL DEFAULT Now(),
+        fields_changed JSONB,
+        recorded_at TIMESTAMP NOT NULL DEFAULT Now(),
+        PRIMARY KEY (audit_id, recorded_at)
+    ) PARTITION BY RANGE (recorded_at);
+    ALTER SEQUENCE antivirus.audit_audit_id_seq OWNED BY antivirus.audit.audit_id;
+
+    COMMENT ON TABLE antivirus.audit IS 'Таблица аудита (секции по месяцам recorded_at)';
+    COMMENT ON COLUMN antivirus.audit.audit_id IS 'Уникальный идентификатор записи в аудите';
+    COMMENT ON COLUMN antivirus.audit.signature_id IS 'Ссылка на запись в таблице сигнатур';
+    COMMENT ON COLUMN antivirus.audit.changed_by IS 'Указатель на пользователя, совершившего изменение';
+    COMMENT ON COLUMN antivirus.audit.change_type IS 'Тип изменения (CREATED, UPDATED, DELETED, CORRUPTED и т.д.)';
+    COMMENT ON COLUMN antivirus.audit.changed_at IS 'Время, когда произошло изменение';
+    COMMENT ON COLUMN antivirus.audit.fields_changed IS 'Список изменённых полей, можно хранить в виде JSON';
+    COMMENT ON COLUMN antivirus.audit.recorded_at IS 'Время записи в аудит (ключ секционирования)';
+
+    -- Для изменений changed_at - время предыдущей версии, время записи берём из нового updated_at
+    CREATE TEMP TABLE audit_migration ON COMMIT DROP AS
+    SELECT a.*,
+           CASE WHEN a.change_type = 'UPDATED'
+                THEN COALESCE((a.fields_changed->'NEW'->>'updated_at')::TIMESTAMP, a.changed_at)
+                ELSE a.changed_at
+           END AS recorded_at
+    FROM antivirus.audit_legacy a;
+
+    SELECT antivirus.create_monthly_partitions('audit',
+        COALESCE((SELECT min(recorded_at) FROM audit_migration), Now())::DATE,
+        GREATEST((SELECT max(recorded_at) FROM audit_migration), Now() + INTERVAL '3 months')::DATE);
+
+    -- Внешний ключ проверяем сразу: отложенные проверки не дают построить индексы в этой же транзакции
+    SET CONSTRAINTS ALL IMMEDIATE;
+    INSERT INTO antivirus.audit (audit_id, signature_id, changed_by, change_type, changed_at, fields_changed, recorded_at)
+    SELECT audit_id, signature_id, changed_by, change_type, changed_at, fields_changed, recorded_at
+    FROM audit_migration;
+
+    DROP TABLE antivirus.audit_legacy;
+    """,
+    """
+    -- 6. Индексы history и audit: сортировка (recorded_at, id) по убыванию читает секции от последней,
+    -- запрос с LIMIT останавливается на последних секциях
+    -- История одной сигнатуры: WHERE id = ... ORDER BY recorded_at DESC, history_id DESC
+    CREATE INDEX IF NOT EXISTS ix_history_id_recorded_at ON antivirus.history (id, recorded_at DESC, history_id DESC);
+    -- Вся история: ORDER BY recorded_at DESC, history_id DESC
+    CREATE INDEX IF NOT EXISTS ix_history_recorded_at ON antivirus.history (recorded_at DESC, history_id DESC);
+    -- Аудит по сигнатуре (заодно ускоряет каскадное удаление по внешнему ключу), по типу операции и весь аудит
+    CREATE INDEX IF NOT EXISTS ix_audit_signature_id_recorded_at ON antivirus.audit (signature_id, recorded_at DESC, audit_id DESC);
+    CREATE INDEX IF NOT EXISTS ix_audit_change_type_recorded_at ON antivirus.audit (change_type, recorded_at DESC, audit_id DESC);
+    CREATE INDEX IF NOT EXISTS ix_audit_recorded_at ON antivirus.audit (recorded_at DESC, audit_id DESC);
+    """
+]
+
+# Версия набора сигнатур: каждое изменение записи получает следующий номер последовательности,
+# писатели сериализуются advisory-блокировкой транзакции, поэтому номера становятся видимыми строго по возрастанию
+# и клиент, получивший версию N, уже получил все изменения с меньшими номерами (GET /signatures/delta)
+MIGRATION_0005 = [
+    """
+    CREATE SEQUENCE IF NOT EXISTS antivirus.signatures_version_seq;
+    -- существующие записи нумеруются при добавлении колонки, дальше номер присваивает триггер
+    ALTER TABLE antivirus.signatures ADD COLUMN IF NOT EXISTS version BIGINT NOT NULL DEFAULT nextval('antivirus.signatures_version_seq');
+    ALTER TABLE antivirus.signatures ALTER COLUMN version DROP DEFAULT;
+    ALTER SEQUENCE antivirus.signatures_version_seq OWNED BY antivirus.signatures.version;
+    COMMENT ON COLUMN antivirus.signatures.version IS 'Версия набора сигнатур, в которой запись изменилась последней';
+
+    -- Изменения после версии: WHERE version > ... ORDER BY version; текущая версия: max(version)
+    CREATE UNIQUE INDEX IF NOT EXISTS ix_signatures_version ON antivirus.signatures (version);
+    """,
+    """
+    -- DROP FUNCTION IF EXISTS antivirus.trf_signatures_version_lock_bs() CASCADE;
+    CREATE OR REPLACE FUNCTION antivirus.trf_signatures_version_lock_bs()
+      RETURNS trigger AS
+    $BODY$
+    BEGIN
+
+    -- транзакции, изменяющие сигнатуры, выполняются по одной: номера версий фиксируются в порядке выдачи
+    PERFORM pg_advisory_xact_lock(7262415375);
+
+    RETURN NULL;
+    END;
+    $BODY$
+      LANGUAGE plpgsql VOLATILE
+      COST 100;
+
+    COMMENT ON FUNCTION antivirus.trf_signatures_version_lock_bs() IS 'Триггерная функция сериализации изменений таблицы antivirus.signatures (на оператор)';
+
+    CREATE TRIGGER tr_signatures_version_lock_bs
+      BEFORE INSERT OR UPDATE
+      ON antivirus.signatures
+      FOR EACH STATEMENT
+      EXECUTE PROCEDURE antivirus.trf_signatures_version_lock_bs();
+
+    COMMENT ON TRIGGER tr_signatures_version_lock_bs ON antivirus.signatures IS 'Триггер сериализации изменений таблицы antivirus.signatures';
+    """,
+    """
+    -- DROP FUNCTION IF EXISTS antivirus.trf_signatures_version_biu() CASCADE;
+    CREATE OR REPLACE FUNCTION antivirus.trf_signatures_version_biu()
+      RETURNS trigger AS
+    $BODY$
+    BEGIN
+
+    -- срабатывает после tr_signatures_bud (триггеры BEFORE выполняются по имени),
+    -- отброшенные пустые обновления номер версии не получают
+    NEW.version := nextval('antivirus.signatures_version_seq');
+
+    RETURN NEW;
+    END;
+    $BODY$
+      LANGUAGE plpgsql VOLATILE
+      COST 100;
+
+    COMMENT ON FUNCTION antivirus.trf_signatures_version_biu() IS 'Триггерная функция присвоения версии записям таблицы antivirus.signatures';
+
+    CREATE TRIGGER tr_signatures_version_biu
+      BEFORE INSERT OR UPDATE
+      ON antivirus.signatures
+      FOR EACH ROW
+      EXECUTE PROCEDURE antivirus.trf_signatures_version_biu();
+
+    COMMENT ON TRIGGER tr_signatures_version_biu ON antivirus.signatures IS 'Триггер присвоения версии записям таблицы antivirus.signatures';
+    """
+]
+
+# Уведомление об изменении набора сигнатур: кэши сигнатур в процессах API (signature_cache.py)
+# слушают канал antivirus_signatures и сбрасываются, получив версию новее загруженной
+MIGRATION_0006 = [
+    """
+    -- DROP FUNCTION IF EXISTS antivirus.trf_signatures_notify_aiu() CASCADE;
+    CREATE OR REPLACE FUNCTION antivirus.trf_signatures_notify_aiu()
+      RETURNS trigger AS
+    $BODY$
+    DECLARE
+        v_version BIGINT;
+    BEGIN
+
+    -- изменения сериализованы (tr_signatures_version_lock_bs), поэтому наибольшая версия - версия этой транзакции;
+    -- уведомление доставляется слушателям только после фиксации транзакции
+    SELECT max(version) INTO v_version FROM ONLY antivirus.signatures;
+    PERFORM pg_notify('antivirus_signatures', COALESCE(v_version, 0)::text);
+
+    RETURN NULL;
+    END;
+    $BODY$
+      LANGUAGE plpgsql VOLATILE
+      COST 100;
+
+    COMMENT ON FUNCTION antivirus.trf_signatures_notify_aiu() IS 'Триггерная функция уведомления об изменении набора сигнатур (на оператор)';
+
+    CREATE TRIGGER tr_signatures_notify_aiu
+      AFTER INSERT OR UPDATE
+      ON antivirus.signatures
+      FOR EACH STATEMENT
+      EXECUTE PROCEDURE antivirus.trf_signatures_notify_aiu();
+
+    COMMENT ON TRIGGER tr_signatures_notify_aiu ON antivirus.signatures IS 'Триггер уведомления об изменении набора сигнатур (канал antivirus_signatures)';
+    """
+]
+
+# Набор сигнатур на момент времени для воспроизводимого повторного сканирования (POST /files/scan?as_of=...)
+MIGRATION_0007 = [
+    """
+    -- Версия сигнатуры на момент времени: WHERE id = ... AND updated_at <= ... ORDER BY updated_at DESC LIMIT 1
+    CREATE INDEX IF NOT EXISTS ix_history_id_updated_at ON antivirus.history (id, updated_at DESC, history_id DESC);
+
+    -- DROP FUNCTION IF EXISTS antivirus.signatures_as_of(TIMESTAMP);
+    CREATE OR REPLACE FUNCTION antivirus.signatures_as_of(
+        p_as_of TIMESTAMP                -- момент времени, на который восстанавливается набор
+    ) RETURNS TABLE (
+        id UUID,
+        threat_name TEXT,
+        first_bytes VARCHAR(8),
+        remainder_hash VARCHAR(64),
+        remainder_length INT,
+        file_type TEXT,
+        offset_start INT,
+        offset_end INT,
+        status TEXT,
+        updated_at TIMESTAMP
+    ) AS
+    $BODY$
+    -- записи, не изменявшиеся после p_as_of, берутся из signatures как есть
+    SELECT s.id, s.threat_name, s.first_bytes, s.remainder_hash, s.remainder_length, s.file_type
+         , s.offset_start, s.offset_end, s.status, s.updated_at
+    FROM ONLY antivirus.signatures AS s
+    WHERE s.updated_at <= p_as_of
+    UNION ALL
+    -- для изменённых позже - последняя версия из history, появившаяся не позже p_as_of
+    -- (поиск по индексу ix_history_id_updated_at); созданные позже p_as_of версий до p_as_of не имеют
+    SELECT h.id, h.threat_name, h.first_bytes, h.remainder_hash, h.remainder_length, h.file_type
+         , h.offset_start, h.offset_end, h.status, h.updated_at
+    FROM ONLY antivirus.signatures AS s
+    CROSS JOIN LATERAL (
+        SELECT *
+        FROM antivirus.history AS hv
+        WHERE hv.id = s.id
+          AND hv.updated_at <= p_as_of
+        ORDER BY hv.updated_at DESC, hv.history_id DESC
+        LIMIT 1
+    ) AS h
+    WHERE s.updated_at > p_as_of
+    $BODY$
+      LANGUAGE sql STABLE;
+
+    COMMENT ON FUNCTION antivirus.signatures_as_of(TIMESTAMP) IS 'Набор сигнатур (все статусы) по состоянию на момент времени; точен, пока секции history за этот период не удалены';
+    """
+]
+
+# Отпечаток сигнатуры (first_bytes, remainder_hash, remainder_length): одинаковые шаблоны ищутся в содержимом один раз
+MIGRATION_0008 = [
+    """
+    -- Дубликаты и одинаковые шаблоны среди актуальных сигнатур: GROUP BY / поиск по отпечатку
+    CREATE INDEX IF NOT EXISTS ix_signatures_fingerprint ON antivirus.signatures (first_bytes, remainder_hash, remainder_length)
+        WHERE status = 'ACTUAL';
+
+    -- DROP FUNCTION IF EXISTS antivirus.scan_content_with_rabin_karp(BYTEA, UUID);
+    CREATE OR REPLACE FUNCTION antivirus.scan_content_with_rabin_karp(
+        p_content BYTEA,                 -- содержимое для сканирования (файл или элемент архива)
+        p_signature_id UUID DEFAULT NULL -- id сигнатуры для сканирования, если NULL, то сканируем всеми сигнатурами
+    ) RETURNS JSONB AS $$
+    WITH sigs AS (
+        SELECT s.id, s.threat_name, s.first_bytes, s.remainder_hash, s.remainder_length, s.offset_start, s.offset_end
+        FROM ONLY antivirus.signatures AS s
+        WHERE s.status = 'ACTUAL'
+          AND (p_signature_id IS NULL OR s.id = p_signature_id)
+    ),
+    -- каждый различный шаблон ищется в содержимом один раз: позиция первых байт (с 1, 0 - не найдено)
+    -- и проверка MD5 хвоста после них
+    patterns AS (
+        SELECT p.first_bytes, p.remainder_hash, p.remainder_length, p.window_size, p.found_at,
+               p.found_at > 0
+               AND md5(substring(p_content from p.found_at + p.window_size for p.remainder_length)) = p.remainder_hash AS hash_matched
+        FROM (
+            SELECT d.first_bytes, d.remainder_hash, d.remainder_length,
+                   length(d.first_bytes) AS window_size,
+                   position(d.first_bytes::bytea in p_content) AS found_at
+            FROM (SELECT DISTINCT first_bytes, remainder_hash, remainder_length FROM sigs) AS d
+        ) AS p
+    ),
+    -- результат шаблона раздаётся всем его сигнатурам, смещения проверяются для каждой сигнатуры отдельно
+    -- (смещение 0-based, если у сигнатуры задан offset_start, иначе позиция с 1 - как и раньше)
+    results AS (
+        SELECT s.id, s.threat_name, p.window_size, s.remainder_length,
+               CASE WHEN s.offset_start IS NULL THEN p.found_at ELSE p.found_at - 1 END AS found_offset,
+               p.hash_matched
+               AND (s.offset_start IS NULL
+                    OR (p.found_at - 1 >= s.offset_start
+                        AND (s.offset_end IS NULL
+                             OR p.found_at - 1 + p.window_size + s.remainder_length - 1 <= s.offset_end))) AS matched
+        FROM sigs AS s
+        JOIN patterns AS p USING (first_bytes, remainder_hash, remainder_length)
+    )
+    SELECT COALESCE(jsonb_agg(jsonb_build_object(
+        'signatureId', r.id,
+        'threatName', r.threat_name,
+        'offsetFromStart', CASE WHEN r.matched THEN r.found_offset ELSE NULL END,
+        'offsetFromEnd', CASE WHEN r.matched THEN r.found_offset + r.window_size + r.remainder_length ELSE NULL END,
+        'matched', r.matched
+    )), '[]'::JSONB)
+    FROM results AS r
+    $$ LANGUAGE sql STABLE
+    COST 100;
+
+    COMMENT ON FUNCTION antivirus.scan_content_with_rabin_karp(BYTEA, UUID) IS 'Функция сканирования произвольного содержимого с алгоритмом Рабина-Карпа (без сохранения результата)';
+    """
+]
+
+# Список известных хэшей файлов: вердикт по SHA-256 содержимого выдаётся без сканирования сигнатурами
+MIGRATION_0009 = [
+    """
+    CREATE TABLE IF NOT EXISTS antivirus.hash_list (
+        sha256 BYTEA PRIMARY KEY,
+        verdict TEXT NOT NULL,
+        threat_name TEXT,
+        source TEXT,
+        hit_count BIGINT NOT NULL DEFAULT 0,
+        last_hit_at TIMESTAMP,
+        created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+        updated_at TIMESTAMP NOT NULL DEFAULT NOW()
+    );
+    COMMENT ON TABLE antivirus.hash_list IS 'Известные файлы: вердикт по SHA-256 содержимого';
+    COMMENT ON COLUMN antivirus.hash_list.sha256 IS 'SHA-256 содержимого файла (сравнивается с files.content_hash)';
+    COMMENT ON COLUMN antivirus.hash_list.verdict IS 'Вердикт (CLEAN, MALICIOUS)';
+    COMMENT ON COLUMN antivirus.hash_list.threat_name IS 'Название угрозы для MALICIOUS';
+    COMMENT ON COLUMN antivirus.hash_list.source IS 'Источник записи (фид, ручное добавление и т.д.)';
+    COMMENT ON COLUMN antivirus.hash_list.hit_count IS 'Количество вердиктов, выданных по записи без сканирования';
+    COMMENT ON COLUMN antivirus.hash_list.last_hit_at IS 'Время последнего вердикта по записи (с точностью до интервала записи счётчиков)';
+    COMMENT ON COLUMN antivirus.hash_list.created_at IS 'Дата и время добавления записи';
+    COMMENT ON COLUMN antivirus.hash_list.updated_at IS 'Дата и время изменения записи';
+    """
+]
+
+# DEFAULT-секции history и audit: изменения сигнатур не зависят от того, создал ли partition_worker секцию месяца
+MIGRATION_0010 = [
+    """
+    -- DEFAULT-секции: если секция месяца не создана заранее (обслуживание остановлено или отстало),
+    -- запись истории и аудита попадает сюда, а не прерывает изменение сигнатур ошибкой маршрутизации.
+    -- create_monthly_partitions переносит такие строки в месячные секции
+    CREATE TABLE IF NOT EXISTS antivirus.history_default PARTITION OF antivirus.history DEFAULT;
+    CREATE TABLE IF NOT EXISTS antivirus.audit_default PARTITION OF antivirus.audit DEFAULT;
+    COMMENT ON TABLE antivirus.history_default IS 'Записи истории за месяцы без секции (переносятся create_monthly_partitions)';
+    COMMENT ON TABLE antivirus.audit_default IS 'Записи аудита за месяцы без секции (переносятся create_monthly_partitions)';
+    """,
+    """
+    -- DROP FUNCTION IF EXISTS antivirus.create_monthly_partitions(TEXT, DATE, DATE);
+    CREATE OR REPLACE FUNCTION antivirus.create_monthly_partitions(p_table TEXT, p_from DATE, p_to DATE)
+    RETURNS INT AS $$
+    DECLARE
+        v_default TEXT := p_table || '_default';
+        v_oldest TIMESTAMP;
+        v_month DATE;
+        v_next DATE;
+        v_name TEXT;
+        v_moved BOOLEAN;
+        v_created INT := 0;
+    BEGIN
+        -- Строки, попавшие в DEFAULT-секцию (секция месяца не была создана заранее), получают свои месячные секции:
+        -- диапазон расширяется до самой старой такой строки
+        IF to_regclass('antivirus.' || quote_ident(v_default)) IS NOT NULL THEN
+            EXECUTE format('SELECT min(recorded_at) FROM antivirus.%I', v_default) INTO v_oldest;
+        END IF;
+        v_month := date_trunc('month', LEAST(p_from, v_oldest::DATE))::DATE;
+
+        -- По секции на каждый месяц диапазона: antivirus.<таблица>_pYYYY_MM, границы [начало месяца, начало следующего)
+        WHILE v_month <= p_to LOOP
+            v_name := p_table || '_p' || to_char(v_month, 'YYYY_MM');
+            v_next := (v_month + INTERVAL '1 month')::DATE;
+            IF to_regclass('antivirus.' || quote_ident(v_name)) IS NULL THEN
+                v_moved := FALSE;
+                IF v_oldest IS NOT NULL THEN
+                    EXECUTE format('SELECT EXISTS (SELECT 1 FROM antivirus.%I WHERE recorded_at >= %L AND recorded_at < %L)',
+                                   v_default, v_month, v_next) INTO v_moved;
+                END IF;
+                IF v_moved THEN
+                    -- Секция не создаётся поверх строк DEFAULT-секции: строки месяца переносятся в новую таблицу,
+                    -- и она присоединяется секцией
+                    EXECUTE format('CREATE TABLE antivirus.%I (LIKE antivirus.%I)', v_name, p_table);
+                    EXECUTE format('WITH moved AS (DELETE FROM antivirus.%I WHERE recorded_at >= %L AND recorded_at < %L RETURNING *) '
+                                   'INSERT INTO antivirus.%I SELECT * FROM moved',
+                                   v_default, v_month, v_next, v_name);
+                    EXECUTE format('ALTER TABLE antivirus.%I ATTACH PARTITION antivirus.%I FOR VALUES FROM (%L) TO (%L)',
+                                   p_table, v_name, v_month, v_next);
+                ELSE
+                    EXECUTE format('CREATE TABLE antivirus.%I PARTITION OF antivirus.%I FOR VALUES FROM (%L) TO (%L)',
+                                   v_name, p_table, v_month, v_next);
+                END IF;
+                v_created := v_created + 1;
+            END IF;
+            v_month := v_next;
+        END LOOP;
+        RETURN v_created;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    COMMENT ON FUNCTION antivirus.create_monthly_partitions(TEXT, DATE, DATE) IS 'Создание недостающих месячных секций таблицы antivirus.history или antivirus.audit (с переносом строк из DEFAULT-секции)';
+    """
+]
+
+# Упорядоченный список миграций: (версия, описание, SQL-команды)
+MIGRATIONS: List[Tuple[int, str, List[str]]] = [
+    (1, "Исходная схема antivirus", MIGRATION_0001),
+    (2, "Массовый импорт сигнатур", MIGRATION_0002),
+    (3, "Триггеры истории и аудита уровня оператора", MIGRATION_0003),
+    (4, "Секционирование history и audit по месяцам", MIGRATION_0004),
+    (5, "Версия набора сигнатур", MIGRATION_0005),
+    (6, "Уведомление об изменении набора сигнатур", MIGRATION_0006),
+    (7, "Набор сигнатур на момент времени", MIGRATION_0007),
+    (8, "Отпечатки сигнатур и сканирование по различным шаблонам", MIGRATION_0008),
+    (9, "Список известных хэшей файлов", MIGRATION_0009),
+    (10, "DEFAULT-секции history и audit", MIGRATION_0010),
+]
+
+# Ключ advisory-блокировки миграций, общий для всех процессов приложения
+MIGRATION_LOCK_ID = 7262415373
+
+# Таблица версий создаётся до первой миграции, поэтому схема antivirus создаётся и здесь
+SCHEMA_VERSION_SQL = """
+CREATE SCHEMA IF NOT EXISTS antivirus;
+CREATE TABLE IF NOT EXISTS antivirus.schema_version (
+    version INT PRIMARY KEY,
+    description TEXT NOT NULL,
+    applied_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
+COMMENT ON TABLE antivirus.schema_version IS 'Применённые миграции схемы';
+"""
+
+
+"""
+Возвращает номер последней применённой миграции (0 - схема ещё не версионирована)
+:param conn: Соединение SQLAlchemy (синхронное)
+"""
+def get_schema_version(conn) -> int:
+    exists = conn.execute(text("SELECT to_regclass('antivirus.schema_version') IS NOT NULL")).scalar()
+    if not exists:
+        return 0
+    return conn.execute(text("SELECT COALESCE(MAX(version), 0) FROM antivirus.schema_version")).scalar()
+
+"""
+Применяет недостающие миграции, каждую в отдельной транзакции
+При запуске нескольких процессов миграции выполняет один из них под advisory-блокировкой,
+остальные ждут её освобождения и перечитывают версию (уже актуальную)
+:param engine: Синхронный engine SQLAlchemy
+:return: Номер версии схемы после применения
+"""
+def apply_migrations(engine) -> int:
+    latest = MIGRATIONS[-1][0]
+    with engine.connect() as conn:
+        # Быстрая проверка без блокировки: на тёплом старте больше ничего не выполняется
+        current = get_schema_version(conn)
+        conn.commit()
+        if current >= latest:
+            logger.info(f"Схема БД актуальна, версия {current}")
+            return current
+
+        # Блокировка уровня сессии: переживает commit отдельных миграций и снимается при закрытии соединения
+        conn.execute(text("SELECT pg_advisory_lock(:lock_id)"), {"lock_id": MIGRATION_LOCK_ID})
+        conn.commit()
+        try:
+            current = get_schema_version(conn)
+            conn.commit()
+            pending = [migration for migration in MIGRATIONS if migration[0] > current]
+            if not pending:
+                logger.info(f"Схема БД обновлена другим процессом, версия {current}")
+                return current
+
+            conn.execute(text(SCHEMA_VERSION_SQL))
+            conn.commit()
+            for version, description, statements in pending:
+                logger.info(f"Применение миграции {version}: {description}")
+                for sql in statements:
+                    conn.execute(text(sql))
+                conn.execute(
+                    text("INSERT INTO antivirus.schema_version (version, description) VALUES (:version, :description)"),
+                    {"version": version, "description": description}
+                )
+                conn.commit()
+                current = version
+        finally:
+            conn.rollback()
+            conn.execute(text("SELECT pg_advisory_unlock(:lock_id)"), {"lock_id": MIGRATION_LOCK_ID})
+            conn.commit()
+    return current
+
+
+__all__ = ['MIGRATIONS', 'MIGRATION_LOCK_ID', 'get_schema_version', 'apply_migrations']
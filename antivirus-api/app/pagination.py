@@ -0,0 +1,75 @@
+"""
+Курсорная (keyset) пагинация списков
+Курсор - непрозрачная для клиента строка base64url с ключом сортировки последней записи страницы.
+Следующая страница читается условием "ключ меньше курсора" по индексу, без OFFSET,
+поэтому стоимость страницы не зависит от её номера
+"""
+
+import base64
+import binascii
+import json
+from datetime import datetime
+from typing import Optional, Sequence
+from uuid import UUID
+
+
+class InvalidCursorError(ValueError):
+    """Курсор повреждён или относится к другому списку"""
+
+
+"""
+Кодирует ключ сортировки в непрозрачный курсор
+:param values: Значения ключа (строки, числа, datetime, UUID)
+:return: Курсор в виде строки base64url без выравнивания
+"""
+def encode_cursor(*values) -> str:
+    raw = json.dumps([
+        value.isoformat() if isinstance(value, datetime) else str(value) if isinstance(value, UUID) else value
+        for value in values
+    ], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+"""
+Декодирует курсор и приводит значения ключа к указанным типам
+:param cursor: Курсор, полученный от encode_cursor
+:param types: Типы значений ключа (datetime, UUID, int, str)
+:return: Кортеж значений ключа
+:raises InvalidCursorError: Курсор не удалось разобрать
+"""
+def decode_cursor(cursor: str, *types) -> tuple:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw.decode("utf-8"))
+        if not isinstance(values, list) or len(values) != len(types):
+            raise InvalidCursorError("Invalid cursor")
+        result = []
+        for value, value_type in zip(values, types):
+            if value_type is datetime:
+                result.append(datetime.fromisoformat(value))
+            elif value_type is int:
+                # true/false в JSON - тоже int в Python
+                if not isinstance(value, int) or isinstance(value, bool):
+                    raise InvalidCursorError("Invalid cursor")
+                result.append(value)
+            else:
+                result.append(value_type(value))
+        return tuple(result)
+    except InvalidCursorError:
+        raise
+    except (binascii.Error, UnicodeDecodeError, TypeError, ValueError):
+        raise InvalidCursorError("Invalid cursor")
+
+"""
+Формирует курсор следующей страницы по ключу последней записи
+:param row_count: Количество записей на текущей странице
+:param limit: Размер страницы (None - список без пагинации)
+:param last_key: Значения ключа сортировки последней записи
+:return: Курсор или None, если страница неполная и дальше записей нет
+"""
+def next_page_cursor(row_count: int, limit: Optional[int], last_key: Optional[Sequence]) -> Optional[str]:
+    if not limit or not last_key or row_count < limit:
+        return None
+    return encode_cursor(*last_key)
+
+
+__all__ = ['InvalidCursorError', 'encode_cursor', 'decode_cursor', 'next_page_cursor']
@@ -0,0 +1,83 @@
+"""
+Фоновое обслуживание месячных секций history и audit
+Секции создаются заранее (PARTITION_PREMAKE_MONTHS), секции старше срока хранения (*_RETENTION_MONTHS)
+отсоединяются, выгружаются в PARTITION_ARCHIVE_DIR (<секция>.csv.gz) и удаляются целиком
+"""
+
+import asyncio
+import logging
+import os
+from datetime import datetime
+from typing import Optional
+from sqlalchemy.ext.asyncio import AsyncSession
+from config import settings
+from dbengine import maintain_partitions, get_partition_retention_start, list_detached_partitions, archive_partition
+
+logger = logging.getLogger(__name__)
+
+# Ключ advisory-блокировки обслуживания секций, общий для всех процессов приложения
+PARTITION_LOCK_ID = 7262415374
+
+
+"""
+Выполняет один проход обслуживания: создание секций, отсоединение старых, выгрузка и удаление отсоединённых
+:return: Словарь {"created": количество созданных секций, "detached": [...], "archived": [...]}
+"""
+async def run_partition_maintenance() -> dict:
+    keep_months = {
+        "history": settings.HISTORY_RETENTION_MONTHS,
+        "audit": settings.AUDIT_RETENTION_MONTHS
+    }
+    result = await maintain_partitions(settings.PARTITION_PREMAKE_MONTHS, keep_months, PARTITION_LOCK_ID)
+    if result is None:
+        # Обслуживание выполняет другой процесс
+        return {"created": 0, "detached": [], "archived": []}
+
+    archived = []
+    # Выгружаются и отсоединённые ранее секции, выгрузка которых была прервана
+    for name in await list_detached_partitions():
+        archive_path = None
+        if settings.PARTITION_ARCHIVE_DIR:
+            archive_path = os.path.join(settings.PARTITION_ARCHIVE_DIR, f"{name}.csv.gz")
+        if await archive_partition(name, archive_path):
+            archived.append(name)
+    return {**result, "archived": archived}
+
+"""
+Начало периода, за который history хранится полностью (начало самой старой сохраняемой месячной секции)
+Набор сигнатур на более ранний момент восстановить нельзя: версии, заменённые до этого периода, удалены.
+Граница считается по времени сервера БД (как при отсоединении секций), а не хоста API
+:param db: Сессия запроса (None - открыть собственную сессию)
+:return: Момент времени (локальное время сервера БД) или None, если срок хранения истории не задан
+"""
+async def history_retained_since(db: Optional[AsyncSession] = None) -> Optional[datetime]:
+    if settings.HISTORY_RETENTION_MONTHS is None:
+        return None
+    return await get_partition_retention_start(settings.HISTORY_RETENTION_MONTHS, db=db)
+
+"""
+Бесконечный цикл обслуживания секций, запускается из startup_event
+Первый проход выполняется сразу при старте
+"""
+async def partition_worker():
+    logger.info(
+        f"Partition maintenance started. Premake months: {settings.PARTITION_PREMAKE_MONTHS}, "
+        f"history retention months: {settings.HISTORY_RETENTION_MONTHS}, "
+        f"audit retention months: {settings.AUDIT_RETENTION_MONTHS}, archive dir: {settings.PARTITION_ARCHIVE_DIR}"
+    )
+    while True:
+        try:
+            result = await run_partition_maintenance()
+            if result["created"] or result["detached"] or result["archived"]:
+                logger.info(
+                    f"Partition maintenance: created {result['created']}, "
+                    f"detached {result['detached']}, archived {result['archived']}"
+                )
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Partition maintenance error: {str(e)}", exc_info=True)
+        await asyncio.sleep(settings.PARTITION_MAINTENANCE_INTERVAL)
+
+
+__all__ = ['PARTITION_LOCK_ID', 'run_partition_maintenance', 'partition_worker']
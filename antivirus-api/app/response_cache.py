@@ -0,0 +1,96 @@
+"""
+Кэш готовых ответов API в памяти процесса для условных GET (ETag / If-None-Match)
+Запись хранит тело и заголовки ответа вместе с ETag, при котором ответ был построен:
+пока ETag ресурса не изменился, ответ отдаётся из памяти без запроса к БД и повторной сериализации.
+Устаревшие записи не удаляются явно - они заменяются при следующем построении ответа или вытесняются (LRU)
+"""
+
+from collections import OrderedDict
+from typing import Hashable, Optional, Tuple
+from config import settings
+
+# ключ запроса -> (ETag, тело, заголовки); порядок - от давно использованных к недавним
+_responses = OrderedDict()
+_cached_bytes = 0
+
+_response_cache_stats = {
+    "hits": 0,            # Ответов из памяти
+    "misses": 0,          # Ответов, построенных заново
+    "not_modified": 0,    # Ответов 304 по If-None-Match
+    "evictions": 0        # Вытесненных записей
+}
+
+"""
+Проверяет заголовок If-None-Match (слабое сравнение, как требует RFC 9110 для GET)
+:param if_none_match: Значение заголовка If-None-Match или None
+:param etag: Текущий ETag ресурса
+:return: True - клиент уже имеет эту версию, можно ответить 304
+"""
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if (tag[2:] if tag.startswith("W/") else tag) == opaque:
+            return True
+    return False
+
+"""
+Учитывает ответ 304 в счётчиках
+"""
+def count_not_modified():
+    _response_cache_stats["not_modified"] += 1
+
+"""
+Возвращает ответ из кэша, если он построен при том же ETag
+:param key: Ключ запроса (путь и параметры)
+:param etag: Текущий ETag ресурса
+:return: (тело, заголовки) или None
+"""
+def get_cached_response(key: Hashable, etag: str) -> Optional[Tuple[bytes, dict]]:
+    entry = _responses.get(key)
+    if entry is None or entry[0] != etag:
+        _response_cache_stats["misses"] += 1
+        return None
+    _responses.move_to_end(key)
+    _response_cache_stats["hits"] += 1
+    return entry[1], entry[2]
+
+"""
+Сохраняет ответ в кэше; ответы больше RESPONSE_CACHE_MAX_ENTRY_BYTES не кэшируются
+:param key: Ключ запроса (путь и параметры)
+:param etag: ETag, при котором построен ответ
+:param body: Тело ответа
+:param headers: Заголовки ответа (кроме ETag)
+"""
+def store_cached_response(key: Hashable, etag: str, body: bytes, headers: Optional[dict] = None):
+    global _cached_bytes
+    if not settings.RESPONSE_CACHE_ENABLED or len(body) > settings.RESPONSE_CACHE_MAX_ENTRY_BYTES:
+        return
+    previous = _responses.pop(key, None)
+    if previous is not None:
+        _cached_bytes -= len(previous[1])
+    _responses[key] = (etag, body, dict(headers or {}))
+    _cached_bytes += len(body)
+    while len(_responses) > settings.RESPONSE_CACHE_MAX_ITEMS or _cached_bytes > settings.RESPONSE_CACHE_MAX_BYTES:
+        _, (_, evicted_body, _) = _responses.popitem(last=False)
+        _cached_bytes -= len(evicted_body)
+        _response_cache_stats["evictions"] += 1
+
+"""
+Возвращает размер кэша ответов и счётчики обращений
+"""
+def get_response_cache_stats() -> dict:
+    return {
+        **_response_cache_stats,
+        "enabled": settings.RESPONSE_CACHE_ENABLED,
+        "items": len(_responses),
+        "bytes": _cached_bytes
+    }
+
+
+__all__ = ['etag_matches', 'count_not_modified', 'get_cached_response', 'store_cached_response',
+           'get_response_cache_stats']
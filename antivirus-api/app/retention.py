@@ -0,0 +1,52 @@
+"""
+Фоновая очистка содержимого просканированных файлов по политике хранения
+Правила задаются в config.Settings (RETENTION_*), очистка идёт небольшими пачками с паузами
+"""
+
+import asyncio
+import logging
+from config import settings
+from dbengine import purge_file_contents
+
+logger = logging.getLogger(__name__)
+
+
+"""
+Выполняет один проход очистки: пачки повторяются, пока находятся кандидаты
+:return: Общее количество очищенных файлов
+"""
+async def run_retention_pass() -> int:
+    total = 0
+    while True:
+        purged = await purge_file_contents(
+            settings.RETENTION_CLEAN_DAYS,
+            settings.RETENTION_INFECTED_DAYS,
+            settings.RETENTION_BATCH_SIZE
+        )
+        total += purged
+        if purged < settings.RETENTION_BATCH_SIZE:
+            return total
+        # Пауза между пачками даёт autovacuum и другим транзакциям работать без конкуренции
+        await asyncio.sleep(settings.RETENTION_BATCH_PAUSE)
+
+"""
+Бесконечный цикл фоновой очистки, запускается из startup_event
+"""
+async def retention_worker():
+    logger.info(
+        f"Retention purger started. Clean after days: {settings.RETENTION_CLEAN_DAYS}, "
+        f"infected after days: {settings.RETENTION_INFECTED_DAYS}"
+    )
+    while True:
+        try:
+            purged = await run_retention_pass()
+            if purged:
+                logger.info(f"Retention purger removed content of {purged} files")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Retention purger error: {str(e)}", exc_info=True)
+        await asyncio.sleep(settings.RETENTION_INTERVAL)
+
+
+__all__ = ['run_retention_pass', 'retention_worker']
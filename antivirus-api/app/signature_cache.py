@@ -0,0 +1,413 @@
+"""
+Кэш набора сигнатур в памяти процесса API
+Набор меняется редко, поэтому загружается целиком с основного сервера и используется до уведомления
+об изменении: триггер tr_signatures_notify_aiu отправляет NOTIFY antivirus_signatures с новой версией набора,
+кэш с меньшей версией перезагружается при следующем обращении.
+Пока соединение LISTEN не установлено, кэш не используется и чтение идёт из БД
+"""
+
+import asyncio
+import bisect
+from collections import OrderedDict
+import hashlib
+import logging
+import re
+import threading
+from datetime import datetime
+from typing import List, Optional, Tuple
+from uuid import UUID
+import asyncpg
+from sqlalchemy import text
+from config import settings
+from database import new_async_session, get_db_url
+
+logger = logging.getLogger(__name__)
+
+# Канал уведомлений об изменении набора сигнатур
+SIGNATURES_CHANNEL = "antivirus_signatures"
+
+# Все сигнатуры одним запросом (один снимок данных): запись списка в том же JSON, что и в dbengine,
+# и поля для сканирования; порядок (updated_at, id) по возрастанию
+SIGNATURE_CACHE_SQL = """
+    SELECT
+        id,
+        status,
+        updated_at,
+        version,
+        threat_name,
+        first_bytes,
+        remainder_hash,
+        remainder_length,
+        offset_start,
+        offset_end,
+        json_build_object(
+            'id', id::text,
+            'threat_name', threat_name,
+            'first_bytes', first_bytes,
+            'remainder_hash', remainder_hash,
+            'remainder_length', remainder_length,
+            'file_type', file_type,
+            'offset_start', offset_start,
+            'offset_end', offset_end,
+            'status', status,
+            'updated_at', updated_at
+        )::text AS item
+    FROM ONLY antivirus.signatures
+    ORDER BY updated_at, id
+    LIMIT :limit
+"""
+
+# Набор на момент времени для сканирования: поля те же, что у SIGNATURE_CACHE_SQL
+SIGNATURE_AS_OF_SQL = """
+    SELECT
+        a.id,
+        a.status,
+        a.updated_at,
+        a.threat_name,
+        a.first_bytes,
+        a.remainder_hash,
+        a.remainder_length,
+        a.offset_start,
+        a.offset_end
+    FROM antivirus.signatures_as_of(CAST(:as_of AS TIMESTAMP)) AS a
+    WHERE a.status = 'ACTUAL'
+    ORDER BY a.updated_at, a.id
+"""
+# Момент старше минуты: набор на него уже не изменится (транзакции того времени завершены)
+SIGNATURE_AS_OF_SETTLED_SQL = "SELECT CAST(:as_of AS TIMESTAMP) <= localtimestamp - interval '1 minute'"
+
+# Снимок набора: {"version", "size", "by_status": {статус: (ключи (updated_at, id), JSON записей)},
+# "scan": записи ACTUAL для сканирования, "scan_by_id"}; None - кэш не загружен
+_snapshot = None
+# Наибольшая версия набора из полученных уведомлений
+_notified_version = 0
+# Соединение LISTEN установлено: только тогда кэш получает уведомления и может использоваться
+_listening = False
+# Номер подключения LISTEN: снимок, загрузка которого началась до переподключения, не сохраняется
+_generation = 0
+_reload_lock = None
+# Наборы на момент времени: момент -> снимок для сканирования (LRU)
+_as_of_snapshots = OrderedDict()
+_as_of_lock = None
+
+_cache_stats_lock = threading.Lock()
+_cache_stats = {
+    "hits": 0,            # Обращений, обслуженных из памяти
+    "misses": 0,          # Обращений, потребовавших загрузки набора
+    "bypass": 0,          # Обращений мимо кэша (кэш выключен или нет соединения LISTEN)
+    "reloads": 0,         # Загрузок набора из БД
+    "notifications": 0,   # Полученных уведомлений об изменении набора
+    "as_of_hits": 0,      # Сканирований на момент времени по готовому набору
+    "as_of_loads": 0      # Восстановлений набора на момент времени из history
+}
+
+def _increment_cache_stat(name: str):
+    with _cache_stats_lock:
+        _cache_stats[name] += 1
+
+"""
+Преобразует first_bytes так же, как приведение TEXT к BYTEA в scan_content_with_rabin_karp
+(формат \\x... - шестнадцатеричный, иначе escape-формат с \\\\ и \\ooo)
+"""
+def _text_to_bytea(value: str) -> bytes:
+    if value.startswith("\\x"):
+        return bytes.fromhex(value[2:])
+    if "\\" not in value:
+        return value.encode("utf-8")
+    return re.sub(
+        rb"\\(\\|[0-7]{3})",
+        lambda m: b"\\" if m.group(1) == b"\\" else bytes([int(m.group(1), 8)]),
+        value.encode("utf-8")
+    )
+
+"""
+Загружает набор сигнатур с основного сервера и строит снимок
+:return: Снимок; если сигнатур больше SIGNATURE_CACHE_MAX_ITEMS, by_status = None (набор не кэшируется)
+"""
+async def _load_snapshot() -> dict:
+    _increment_cache_stat("reloads")
+    async with new_async_session() as db:
+        result = await db.execute(text(SIGNATURE_CACHE_SQL), {"limit": settings.SIGNATURE_CACHE_MAX_ITEMS + 1})
+        rows = result.all()
+
+    version = max((row.version for row in rows), default=0)
+    if len(rows) > settings.SIGNATURE_CACHE_MAX_ITEMS:
+        logger.warning(f"Signature cache disabled: more than {settings.SIGNATURE_CACHE_MAX_ITEMS} signatures")
+        return {"version": version, "size": len(rows), "by_status": None, "scan": None, "scan_by_id": None}
+
+    by_status = {}
+    for row in rows:
+        keys, items = by_status.setdefault(row.status, ([], []))
+        keys.append((row.updated_at, row.id))
+        items.append(row.item)
+    scan = _scan_entries(row for row in rows if row.status == "ACTUAL")
+    logger.info(f"Signature cache loaded: {len(rows)} signatures, version {version}")
+    return {
+        "version": version,
+        "size": len(rows),
+        "by_status": by_status,
+        "scan": scan,
+        "scan_by_id": {entry[0]: entry for entry in scan}
+    }
+
+"""
+Готовит сигнатуры для scan_content_cached: первые байты переводятся в bytes один раз при загрузке
+:param rows: Строки сигнатур ACTUAL
+:return: Список записей для сканирования
+"""
+def _scan_entries(rows) -> list:
+    return [
+        (
+            row.id, str(row.id), row.threat_name, _text_to_bytea(row.first_bytes), len(row.first_bytes),
+            row.remainder_hash, row.remainder_length, row.offset_start, row.offset_end
+        )
+        for row in rows
+    ]
+
+"""
+Переводит момент времени с часовым поясом в локальное время сервера БД (timestamp без пояса)
+Время в history хранится без часового пояса в часовом поясе сервера БД, поэтому перевод выполняет сам сервер,
+а не часовой пояс хоста API
+:param as_of: Момент времени (без часового пояса - возвращается как есть)
+:return: Момент времени без часового пояса
+"""
+async def to_db_local_time(as_of: datetime) -> datetime:
+    if as_of.tzinfo is None:
+        return as_of
+    async with new_async_session() as db:
+        result = await db.execute(text("SELECT CAST(CAST(:as_of AS TIMESTAMPTZ) AS TIMESTAMP)"), {"as_of": as_of})
+        return result.scalar()
+
+"""
+Возвращает набор сигнатур ACTUAL на момент времени для scan_content_cached
+Набор восстанавливается функцией antivirus.signatures_as_of на основном сервере один раз и хранится
+в памяти (до SIGNATURE_AS_OF_CACHE_SIZE моментов), поэтому повторные сканирования на тот же момент
+не обращаются к history. Моменты моложе минуты не кэшируются: транзакции того времени могли ещё не завершиться
+:param as_of: Момент времени (с часовым поясом - переводится в часовой пояс сервера БД, см. to_db_local_time)
+:return: Снимок с полями scan и scan_by_id
+"""
+async def get_signature_snapshot_as_of(as_of: datetime) -> dict:
+    global _as_of_lock
+    as_of = await to_db_local_time(as_of)
+    snapshot = _as_of_snapshots.get(as_of)
+    if snapshot is not None:
+        _as_of_snapshots.move_to_end(as_of)
+        _increment_cache_stat("as_of_hits")
+        return snapshot
+
+    if _as_of_lock is None:
+        _as_of_lock = asyncio.Lock()
+    async with _as_of_lock:
+        snapshot = _as_of_snapshots.get(as_of)
+        if snapshot is not None:
+            _increment_cache_stat("as_of_hits")
+            return snapshot
+        _increment_cache_stat("as_of_loads")
+        async with new_async_session() as db:
+            result = await db.execute(text(SIGNATURE_AS_OF_SETTLED_SQL), {"as_of": as_of})
+            settled = result.scalar()
+            result = await db.execute(text(SIGNATURE_AS_OF_SQL), {"as_of": as_of})
+            rows = result.all()
+        scan = _scan_entries(rows)
+        snapshot = {"as_of": as_of, "size": len(scan), "scan": scan, "scan_by_id": {entry[0]: entry for entry in scan}}
+        logger.info(f"Signature set as of {as_of} restored: {len(scan)} signatures")
+        if settled and settings.SIGNATURE_AS_OF_CACHE_SIZE > 0:
+            _as_of_snapshots[as_of] = snapshot
+            while len(_as_of_snapshots) > settings.SIGNATURE_AS_OF_CACHE_SIZE:
+                _as_of_snapshots.popitem(last=False)
+        return snapshot
+
+"""
+Возвращает актуальный снимок набора сигнатур, при необходимости загружая его
+Одновременные обращения ждут одной загрузки
+:return: Снимок или None - кэш не используется, читать из БД
+"""
+async def get_signature_snapshot() -> Optional[dict]:
+    global _snapshot, _reload_lock
+    if not settings.SIGNATURE_CACHE_ENABLED or not _listening:
+        _increment_cache_stat("bypass")
+        return None
+    snapshot = _snapshot
+    if snapshot is not None and snapshot["version"] >= _notified_version:
+        if snapshot["by_status"] is None:
+            _increment_cache_stat("bypass")
+            return None
+        _increment_cache_stat("hits")
+        return snapshot
+
+    _increment_cache_stat("misses")
+    if _reload_lock is None:
+        _reload_lock = asyncio.Lock()
+    async with _reload_lock:
+        snapshot = _snapshot
+        if snapshot is None or snapshot["version"] < _notified_version:
+            generation = _generation
+            snapshot = await _load_snapshot()
+            if generation == _generation:
+                _snapshot = snapshot
+    return snapshot if snapshot["by_status"] is not None else None
+
+"""
+Версия набора, известная без запроса к БД: есть соединение LISTEN и загруженный снимок, из которого строятся списки
+Снимок с меньшей версией, чем в уведомлении, перезагружается при обращении, поэтому список не старше этой версии
+:return: Версия набора или None - версию нужно прочитать из БД
+"""
+def get_known_signature_version() -> Optional[int]:
+    snapshot = _snapshot
+    if not settings.SIGNATURE_CACHE_ENABLED or not _listening or snapshot is None or snapshot["by_status"] is None:
+        return None
+    return max(snapshot["version"], _notified_version)
+
+"""
+Проверяет, что значения можно сравнивать с updated_at снимка (в БД хранится TIMESTAMP без часового пояса)
+"""
+def _naive(*values) -> bool:
+    return all(value is None or value.tzinfo is None for value in values)
+
+"""
+Список сигнатур со статусом из снимка, в порядке (updated_at, id) по убыванию
+Аналог запросов get_actual_signatures_json / get_signatures_by_status, результат в том же формате
+:param snapshot: Снимок из get_signature_snapshot
+:param status: Статус сигнатур
+:param since: Только сигнатуры с updated_at >= since (опционально)
+:param limit: Размер страницы (None - все)
+:param after: Ключ (updated_at, id) последней записи предыдущей страницы
+:return: (JSON-массив текстом, количество строк, ключ последней строки или None)
+         или None, если фильтр нельзя применить к снимку (метка времени с часовым поясом)
+"""
+def cached_signatures_json(
+    snapshot: dict,
+    status: str,
+    since: Optional[datetime] = None,
+    limit: Optional[int] = None,
+    after: Optional[Tuple[datetime, UUID]] = None
+) -> Optional[Tuple[str, int, Optional[list]]]:
+    if not _naive(since, after[0] if after else None):
+        return None
+    keys, items = snapshot["by_status"].get(status, ([], []))
+    # Записи хранятся по возрастанию ключа: страница - диапазон [start, end), выдаётся с конца
+    end = bisect.bisect_left(keys, tuple(after)) if after is not None else len(keys)
+    start = bisect.bisect_left(keys, (since, UUID(int=0))) if since is not None else 0
+    if limit is not None:
+        start = max(start, end - limit)
+    if start >= end:
+        return "[]", 0, None
+    page = items[start:end]
+    page.reverse()
+    updated_at, signature_id = keys[start]
+    return "[" + ", ".join(page) + "]", end - start, [updated_at.isoformat(), str(signature_id)]
+
+"""
+Сканирует содержимое сигнатурами ACTUAL из снимка - тот же алгоритм и формат результата,
+что у antivirus.scan_content_with_rabin_karp (поиск первых байт, проверка MD5 хвоста и смещений)
+Каждый различный шаблон ищется один раз, результат раздаётся всем сигнатурам с этим шаблоном
+Выполняется в пуле потоков: сканирование большого содержимого занимает процессор
+:param snapshot: Снимок из get_signature_snapshot
+:param content: Содержимое для сканирования
+:param signature_id: UUID сигнатуры (None - все сигнатуры ACTUAL)
+:return: Список результатов по сигнатурам
+"""
+def scan_content_cached(snapshot: dict, content: bytes, signature_id: Optional[UUID] = None) -> List[dict]:
+    if signature_id is None:
+        entries = snapshot["scan"]
+    else:
+        entry = snapshot["scan_by_id"].get(signature_id)
+        entries = [entry] if entry is not None else []
+
+    # Одинаковые шаблоны (первые байты, MD5 и длина хвоста) ищутся в содержимом один раз,
+    # смещения проверяются для каждой сигнатуры отдельно
+    patterns = {}
+    results = []
+    for _, sig_id, threat_name, first_bytes, window, remainder_hash, remainder_length, offset_start, offset_end in entries:
+        pattern_key = (first_bytes, window, remainder_hash, remainder_length)
+        found = patterns.get(pattern_key)
+        if found is None:
+            # position() в PostgreSQL: позиция с 1, 0 - не найдено
+            found_at = content.find(first_bytes) + 1
+            hash_matched = False
+            if found_at > 0:
+                remainder_start = found_at - 1 + window
+                remainder = content[remainder_start:remainder_start + remainder_length]
+                hash_matched = hashlib.md5(remainder).hexdigest() == remainder_hash
+            found = patterns[pattern_key] = (found_at, hash_matched)
+        position, matched = found
+        if matched and offset_start is not None:
+            position -= 1  # преобразуем в 0-based индекс
+            position_end = position + window + remainder_length - 1
+            if position < offset_start or (offset_end is not None and position_end > offset_end):
+                matched = False
+        results.append({
+            "signatureId": sig_id,
+            "threatName": threat_name,
+            "offsetFromStart": position if matched else None,
+            "offsetFromEnd": position + window + remainder_length if matched else None,
+            "matched": matched
+        })
+    return results
+
+"""
+Обработчик уведомления: запоминает версию, кэш с меньшей версией перезагрузится при обращении
+"""
+def _on_signatures_changed(connection, pid, channel, payload):
+    global _notified_version, _snapshot
+    _increment_cache_stat("notifications")
+    try:
+        _notified_version = max(_notified_version, int(payload))
+    except ValueError:
+        _snapshot = None
+
+"""
+Бесконечный цикл подписки на уведомления, запускается из startup_event
+Соединение проверяется каждые SIGNATURE_CACHE_CHECK_INTERVAL секунд; после обрыва кэш не используется
+до переподключения, а после переподключения загружается заново (уведомления за время обрыва потеряны)
+"""
+async def signature_listener():
+    global _listening, _snapshot, _generation
+    logger.info(f"Signature cache listener started. Channel: {SIGNATURES_CHANNEL}")
+    while True:
+        connection = None
+        try:
+            connection = await asyncpg.connect(get_db_url())
+            closed = asyncio.Event()
+            connection.add_termination_listener(lambda _: closed.set())
+            await connection.add_listener(SIGNATURES_CHANNEL, _on_signatures_changed)
+            _generation += 1
+            _snapshot = None
+            _listening = True
+            while not closed.is_set():
+                try:
+                    await asyncio.wait_for(closed.wait(), settings.SIGNATURE_CACHE_CHECK_INTERVAL)
+                except asyncio.TimeoutError:
+                    await asyncio.wait_for(connection.execute("SELECT 1"), settings.SIGNATURE_CACHE_CHECK_INTERVAL)
+            logger.warning("Signature cache listener connection closed")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Signature cache listener error: {str(e)}")
+        finally:
+            _listening = False
+            if connection is not None:
+                connection.terminate()
+        await asyncio.sleep(settings.SIGNATURE_CACHE_CHECK_INTERVAL)
+
+"""
+Возвращает состояние кэша и счётчики обращений
+"""
+def get_signature_cache_stats() -> dict:
+    with _cache_stats_lock:
+        stats = dict(_cache_stats)
+    snapshot = _snapshot
+    stats.update({
+        "enabled": settings.SIGNATURE_CACHE_ENABLED,
+        "listening": _listening,
+        "loaded": snapshot is not None and snapshot["by_status"] is not None,
+        "version": snapshot["version"] if snapshot is not None else None,
+        "notified_version": _notified_version,
+        "size": snapshot["size"] if snapshot is not None else 0,
+        "as_of_sets": len(_as_of_snapshots)
+    })
+    return stats
+
+
+__all__ = ['SIGNATURES_CHANNEL', 'get_signature_snapshot', 'get_signature_snapshot_as_of', 'to_db_local_time', 'get_known_signature_version', 'cached_signatures_json', 'scan_content_cached',
+           'signature_listener', 'get_signature_cache_stats']
@@ -0,0 +1,21 @@
+"""
+Общая настройка тестов: модули приложения импортируются из app/ так же, как при запуске main.py
+Тесты, которым нужна БД, подключаются к ANTIVIRUS_TEST_DATABASE_URL и пропускаются, если она не задана
+"""
+
+import os
+import sys
+
+APP_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app")
+sys.path.insert(0, APP_DIR)
+
+# config.Settings требует параметры подключения; модульным тестам сервер БД не нужен
+for name, value in (
+    ("DB_USER", "postgres"),
+    ("DB_PASSWORD", ""),
+    ("DB_HOST", "127.0.0.1"),
+    ("DB_PORT", "5432"),
+    ("DB_NAME", "antivirus_test"),
+    ("DB_NAME_TMP", "postgres"),
+):
+    os.environ.setdefault(name, value)
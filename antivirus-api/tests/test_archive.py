@@ -0,0 +1,188 @@
+"""
+Обход архивов (archive.py): определение типа, лимиты распаковки walk_archive, нечитаемые элементы zip
+"""
+
+import gzip
+import io
+import tarfile
+import zipfile
+
+import pytest
+
+from archive import ArchiveLimitError, ArchiveLimits, archive_type, iter_archive_members, walk_archive
+
+
+def make_zip(members: dict, compression=zipfile.ZIP_DEFLATED) -> bytes:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", compression) as archive:
+        for name, content in members.items():
+            archive.writestr(name, content)
+    return buffer.getvalue()
+
+
+def make_tar(members: dict, mode: str = "w") -> bytes:
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode=mode) as archive:
+        for name, content in members.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            archive.addfile(info, io.BytesIO(content))
+    return buffer.getvalue()
+
+
+"""
+Вложенные zip: уровень 1 содержит a.txt и level2.zip, уровень 2 - b.txt и level3.zip, уровень 3 - c.txt
+"""
+def nested_zip() -> bytes:
+    level3 = make_zip({"c.txt": b"third"})
+    level2 = make_zip({"b.txt": b"second", "level3.zip": level3})
+    return make_zip({"a.txt": b"first", "level2.zip": level2})
+
+
+def walk(data: bytes, **limits) -> dict:
+    return dict(walk_archive(data, ArchiveLimits(**limits)))
+
+
+@pytest.mark.parametrize("data, expected", [
+    (make_zip({"a.txt": b"a"}), "zip"),
+    (make_tar({"a.txt": b"a"}), "tar"),
+    (make_tar({"a.txt": b"a"}, "w:gz"), "tar"),
+    (make_tar({"a.txt": b"a"}, "w:bz2"), "tar"),
+    (make_tar({"a.txt": b"a"}, "w:xz"), "tar"),
+    (gzip.compress(b"plain text"), "gzip"),
+    (b"MZ\x90\x00" + b"\x00" * 2000 + make_zip({"a.txt": b"a"}), "zip"),   # самораспаковывающийся архив
+    (b"\x00" * 10240, None),
+    (b"just some text" * 100, None),
+    (b"", None),
+])
+def test_archive_type(data, expected):
+    assert archive_type(data) == expected
+
+
+def test_walk_nested_within_depth():
+    assert walk(nested_zip(), max_depth=3) == {
+        "a.txt": b"first",
+        "level2.zip": make_zip({"b.txt": b"second", "level3.zip": make_zip({"c.txt": b"third"})}),
+        "level2.zip/b.txt": b"second",
+        "level2.zip/level3.zip": make_zip({"c.txt": b"third"}),
+        "level2.zip/level3.zip/c.txt": b"third",
+    }
+
+
+@pytest.mark.parametrize("max_depth, paths", [
+    (1, {"a.txt", "level2.zip"}),
+    (2, {"a.txt", "level2.zip", "level2.zip/b.txt", "level2.zip/level3.zip"}),
+])
+def test_walk_stops_at_max_depth(max_depth, paths):
+    # Вложенный архив глубже лимита возвращается как обычный элемент, но не раскрывается
+    assert set(walk(nested_zip(), max_depth=max_depth)) == paths
+
+
+def test_max_members_counts_all_levels():
+    data = nested_zip()
+    assert len(walk(data, max_depth=3, max_members=5)) == 5
+    with pytest.raises(ArchiveLimitError):
+        walk(data, max_depth=3, max_members=4)
+
+
+def make_header_bomb(count: int, kind=tarfile.DIRTYPE) -> bytes:
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz") as archive:
+        for i in range(count):
+            info = tarfile.TarInfo(f"d{i}")
+            info.type = kind
+            info.linkname = "target" if kind == tarfile.SYMTYPE else ""
+            archive.addfile(info)
+    return buffer.getvalue()
+
+
+@pytest.mark.parametrize("kind", [tarfile.DIRTYPE, tarfile.SYMTYPE, tarfile.FIFOTYPE])
+def test_max_members_counts_tar_headers_without_files(kind):
+    # Заголовки без содержимого тоже считаются: иначе обход идёт по всем без ошибки и без результата
+    data = make_header_bomb(1000, kind)
+    assert walk(data, max_members=1000) == {}
+    with pytest.raises(ArchiveLimitError):
+        walk(data, max_members=10)
+
+
+def test_max_members_counts_zip_directories():
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        for i in range(20):
+            archive.writestr(f"d{i}/", b"")
+        archive.writestr("a.txt", b"a")
+    assert walk(buffer.getvalue(), max_members=21) == {"a.txt": b"a"}
+    with pytest.raises(ArchiveLimitError):
+        walk(buffer.getvalue(), max_members=20)
+
+
+def test_max_member_size():
+    data = make_zip({"small.txt": b"x" * 100, "big.txt": b"x" * 1000})
+    assert set(walk(data, max_member_size=1000)) == {"small.txt", "big.txt"}
+    with pytest.raises(ArchiveLimitError):
+        walk(data, max_member_size=999)
+
+
+def test_max_member_size_does_not_trust_header():
+    # Архив-бомба: сжатый размер мал, распакованный превышает лимит - чтение прерывается по факту
+    data = make_tar({"bomb.bin": b"\x00" * (1024 * 1024)}, "w:gz")
+    assert len(data) < 10 * 1024
+    with pytest.raises(ArchiveLimitError):
+        walk(data, max_member_size=64 * 1024)
+
+
+def test_max_total_size_counts_all_levels():
+    data = make_zip({"a.bin": b"a" * 300, "inner.zip": make_zip({"b.bin": b"b" * 300}, zipfile.ZIP_STORED)})
+    inner_size = len(make_zip({"b.bin": b"b" * 300}, zipfile.ZIP_STORED))
+    assert len(walk(data, max_depth=2, max_total_size=600 + inner_size)) == 3
+    with pytest.raises(ArchiveLimitError):
+        walk(data, max_depth=2, max_total_size=600 + inner_size - 1)
+
+
+def test_limit_error_is_value_error():
+    assert issubclass(ArchiveLimitError, ValueError)
+
+
+def test_gzip_member_has_placeholder_name():
+    assert walk(gzip.compress(b"payload")) == {"<gzip>": b"payload"}
+
+
+def test_not_an_archive():
+    with pytest.raises(ValueError):
+        list(iter_archive_members(b"not an archive"))
+
+
+"""
+Zip с зашифрованным элементом secret.exe: zipfile не пишет шифрование, поэтому флаг ставится в заголовках вручную
+"""
+def encrypted_zip() -> bytes:
+    data = bytearray(make_zip({"readme.txt": b"hello", "secret.exe": b"MZ payload"}, zipfile.ZIP_STORED))
+    with zipfile.ZipFile(io.BytesIO(bytes(data))) as archive:
+        local_header = archive.getinfo("secret.exe").header_offset
+    # Запись центрального каталога: сигнатура PK\x01\x02, флаги со смещения 8, имя со смещения 46
+    central_header = bytes(data).index(b"PK\x01\x02")
+    while bytes(data[central_header + 46:central_header + 56]) != b"secret.exe":
+        central_header = bytes(data).index(b"PK\x01\x02", central_header + 4)
+    data[local_header + 6] |= 0x1
+    data[central_header + 8] |= 0x1
+    return bytes(data)
+
+
+def test_encrypted_member_is_skipped_and_reported():
+    skipped = []
+    members = dict(walk_archive(encrypted_zip(), ArchiveLimits(), skipped=skipped))
+    assert members == {"readme.txt": b"hello"}
+    assert skipped == [("secret.exe", "encrypted")]
+
+
+def test_encrypted_nested_member_reported_with_full_path():
+    skipped = []
+    data = make_zip({"outer.txt": b"x", "inner.zip": encrypted_zip()}, zipfile.ZIP_STORED)
+    members = dict(walk_archive(data, ArchiveLimits(max_depth=2), skipped=skipped))
+    assert set(members) == {"outer.txt", "inner.zip", "inner.zip/readme.txt"}
+    assert skipped == [("inner.zip/secret.exe", "encrypted")]
+
+
+def test_encrypted_member_without_skipped_list_raises():
+    with pytest.raises(ValueError):
+        list(iter_archive_members(encrypted_zip()))
@@ -0,0 +1,60 @@
+"""
+Разбор заголовка Range (byte_range.py): корректные диапазоны, игнорируемые заголовки (200) и неудовлетворимые (416)
+"""
+
+import pytest
+
+from byte_range import parse_range
+
+
+@pytest.mark.parametrize("header, size, expected", [
+    ("bytes=0-9", 100, (0, 9)),
+    ("bytes=10-19", 100, (10, 19)),
+    ("bytes=0-0", 100, (0, 0)),
+    ("bytes=90-", 100, (90, 99)),
+    ("bytes=90-1000", 100, (90, 99)),
+    ("bytes=-5", 100, (95, 99)),
+    ("bytes=-1000", 100, (0, 99)),
+    ("bytes=99-99", 100, (99, 99)),
+    (" bytes=1-2 ", 100, (1, 2)),
+])
+def test_satisfiable(header, size, expected):
+    assert parse_range(header, size) == expected
+
+
+@pytest.mark.parametrize("header", [
+    None,
+    "",
+    "bytes=5-3",        # конец раньше начала
+    "bytes=5-x",
+    "bytes=x-5",
+    "bytes=abc",
+    "bytes=-",
+    "bytes=",
+    "bytes=+5-10",
+    "bytes=5_0-60",
+    "bytes=0-1,5-6",    # несколько диапазонов не поддерживаются
+    "items=0-9",
+    "bytes 0-9",
+    "bytes=١-٥",        # цифры не ASCII
+])
+def test_invalid_header_ignored(header):
+    assert parse_range(header, 100) is None
+
+
+@pytest.mark.parametrize("header, size", [
+    ("bytes=100-", 100),
+    ("bytes=100-200", 100),
+    ("bytes=-0", 100),
+    ("bytes=0-", 0),
+    ("bytes=0-0", 0),
+    ("bytes=-5", 0),
+])
+def test_not_satisfiable(header, size):
+    with pytest.raises(ValueError):
+        parse_range(header, size)
+
+
+def test_invalid_header_ignored_for_empty_content():
+    assert parse_range("bytes=5-3", 0) is None
+    assert parse_range("bytes=5-x", 0) is None
@@ -0,0 +1,73 @@
+"""
+Курсоры keyset-пагинации (pagination.py): кодирование, разбор и отказ на повреждённых курсорах
+"""
+
+import base64
+import json
+from datetime import datetime
+from uuid import UUID
+
+import pytest
+
+from pagination import InvalidCursorError, decode_cursor, encode_cursor, next_page_cursor
+
+UPDATED_AT = datetime(2024, 5, 17, 13, 45, 9, 123456)
+SIGNATURE_ID = UUID("6f1c2a5e-0d7b-4b8e-9a41-3c2f7d9e8b10")
+
+
+def raw_cursor(value) -> str:
+    return base64.urlsafe_b64encode(json.dumps(value).encode("utf-8")).decode("ascii").rstrip("=")
+
+
+@pytest.mark.parametrize("values, types", [
+    ((UPDATED_AT, SIGNATURE_ID), (datetime, UUID)),
+    ((UPDATED_AT, 42), (datetime, int)),
+    (("\\x4d5a", "0cc175b9c0f1b6a831c399e269772661", 3), (str, str, int)),
+    (("Вирус/путь?", 0), (str, int)),
+])
+def test_round_trip(values, types):
+    cursor = encode_cursor(*values)
+    assert decode_cursor(cursor, *types) == values
+
+
+def test_cursor_is_url_safe_without_padding():
+    cursor = encode_cursor(UPDATED_AT, SIGNATURE_ID, "?&/+=")
+    assert "=" not in cursor and "+" not in cursor and "/" not in cursor
+
+
+@pytest.mark.parametrize("cursor", [
+    "",
+    "garbage",
+    "!!!",
+    "e30",                                  # {}
+    raw_cursor("2024-05-17T13:45:09"),      # не список
+    raw_cursor(["2024-05-17T13:45:09"]),    # не хватает значения ключа
+    raw_cursor(["2024-05-17T13:45:09", str(SIGNATURE_ID), 1]),
+    raw_cursor(["not a date", str(SIGNATURE_ID)]),
+    raw_cursor(["2024-05-17T13:45:09", "not-a-uuid"]),
+    raw_cursor([None, str(SIGNATURE_ID)]),
+    base64.urlsafe_b64encode(b"\xff\xfe[]").decode("ascii"),
+])
+def test_malformed_cursor_rejected(cursor):
+    with pytest.raises(InvalidCursorError):
+        decode_cursor(cursor, datetime, UUID)
+
+
+@pytest.mark.parametrize("value", ["42", 4.2, True, None])
+def test_integer_key_must_be_integer(value):
+    with pytest.raises(InvalidCursorError):
+        decode_cursor(raw_cursor(["2024-05-17T13:45:09", value]), datetime, int)
+
+
+def test_invalid_cursor_is_value_error():
+    # Обработчики API отвечают 400 на ValueError при разборе параметров
+    assert issubclass(InvalidCursorError, ValueError)
+
+
+def test_next_page_cursor():
+    assert next_page_cursor(10, 10, [UPDATED_AT.isoformat(), str(SIGNATURE_ID)]) is not None
+    assert decode_cursor(next_page_cursor(10, 10, [UPDATED_AT.isoformat(), str(SIGNATURE_ID)]), datetime, UUID) \
+        == (UPDATED_AT, SIGNATURE_ID)
+    assert next_page_cursor(9, 10, [UPDATED_AT.isoformat(), str(SIGNATURE_ID)]) is None
+    assert next_page_cursor(10, None, [UPDATED_AT.isoformat(), str(SIGNATURE_ID)]) is None
+    assert next_page_cursor(0, 10, None) is None
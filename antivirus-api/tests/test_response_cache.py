@@ -0,0 +1,107 @@
+"""
+Кэш ответов (response_cache.py): сравнение If-None-Match и вытеснение записей по количеству и объёму (LRU)
+"""
+
+from collections import OrderedDict
+
+import pytest
+
+import response_cache
+from config import settings
+from response_cache import etag_matches, get_cached_response, get_response_cache_stats, store_cached_response
+
+
+@pytest.fixture(autouse=True)
+def empty_cache(monkeypatch):
+    monkeypatch.setattr(response_cache, "_responses", OrderedDict())
+    monkeypatch.setattr(response_cache, "_cached_bytes", 0)
+    monkeypatch.setattr(response_cache, "_response_cache_stats", dict.fromkeys(response_cache._response_cache_stats, 0))
+    monkeypatch.setattr(settings, "RESPONSE_CACHE_ENABLED", True)
+    monkeypatch.setattr(settings, "RESPONSE_CACHE_MAX_ITEMS", 100)
+    monkeypatch.setattr(settings, "RESPONSE_CACHE_MAX_BYTES", 100)
+    monkeypatch.setattr(settings, "RESPONSE_CACHE_MAX_ENTRY_BYTES", 60)
+
+
+@pytest.mark.parametrize("if_none_match, etag, expected", [
+    (None, '"v1"', False),
+    ("", '"v1"', False),
+    ('"v1"', '"v1"', True),
+    ('"v2"', '"v1"', False),
+    ("*", '"v1"', True),
+    (" * ", '"v1"', True),
+    # Слабое сравнение: префикс W/ у любой из сторон не учитывается
+    ('W/"v1"', '"v1"', True),
+    ('"v1"', 'W/"v1"', True),
+    ('W/"v1"', 'W/"v1"', True),
+    ('W/"v2"', '"v1"', False),
+    # Список ETag
+    ('"v0", "v1"', '"v1"', True),
+    ('"v0",W/"v1" ,"v2"', '"v1"', True),
+    ('"v0", "v2"', '"v1"', False),
+    # ETag сравнивается целиком, с кавычками
+    ("v1", '"v1"', False),
+    ('"v1-old"', '"v1"', False),
+])
+def test_etag_matches(if_none_match, etag, expected):
+    assert etag_matches(if_none_match, etag) is expected
+
+
+def test_hit_only_for_same_etag():
+    store_cached_response("/signatures", '"v1"', b"[1]", {"X-Next-Cursor": "c"})
+    assert get_cached_response("/signatures", '"v1"') == (b"[1]", {"X-Next-Cursor": "c"})
+    assert get_cached_response("/signatures", '"v2"') is None
+    assert get_cached_response("/other", '"v1"') is None
+    stats = get_response_cache_stats()
+    assert (stats["hits"], stats["misses"]) == (1, 2)
+
+
+def test_eviction_by_bytes_is_lru():
+    for key in ("a", "b", "c"):
+        store_cached_response(key, '"v"', key.encode() * 30)
+    assert get_response_cache_stats()["bytes"] == 90
+    # Обращение к "a" делает её недавней: вытесняется давно использованная "b"
+    assert get_cached_response("a", '"v"') is not None
+    store_cached_response("d", '"v"', b"d" * 30)
+    assert get_cached_response("b", '"v"') is None
+    assert all(get_cached_response(key, '"v"') is not None for key in ("a", "c", "d"))
+    stats = get_response_cache_stats()
+    assert (stats["items"], stats["bytes"], stats["evictions"]) == (3, 90, 1)
+
+
+def test_large_entry_evicts_several():
+    for key in ("a", "b", "c", "d", "e"):
+        store_cached_response(key, '"v"', b"x" * 20)
+    store_cached_response("big", '"v"', b"x" * 60)
+    assert [key for key in ("a", "b", "c", "d", "e", "big") if get_cached_response(key, '"v"') is not None] \
+        == ["d", "e", "big"]
+    assert get_response_cache_stats()["bytes"] == 100
+
+
+def test_replacing_entry_updates_bytes():
+    store_cached_response("a", '"v1"', b"x" * 50)
+    store_cached_response("a", '"v2"', b"x" * 10)
+    stats = get_response_cache_stats()
+    assert (stats["items"], stats["bytes"], stats["evictions"]) == (1, 10, 0)
+    assert get_cached_response("a", '"v2"') == (b"x" * 10, {})
+
+
+def test_eviction_by_item_count(monkeypatch):
+    monkeypatch.setattr(settings, "RESPONSE_CACHE_MAX_ITEMS", 2)
+    for key in ("a", "b", "c"):
+        store_cached_response(key, '"v"', b"x")
+    assert get_cached_response("a", '"v"') is None
+    assert get_response_cache_stats()["items"] == 2
+
+
+def test_oversized_entry_not_cached():
+    store_cached_response("a", '"v"', b"x" * 30)
+    store_cached_response("huge", '"v"', b"x" * 61)
+    assert get_cached_response("huge", '"v"') is None
+    assert get_cached_response("a", '"v"') is not None
+    assert get_response_cache_stats()["bytes"] == 30
+
+
+def test_disabled_cache_stores_nothing(monkeypatch):
+    monkeypatch.setattr(settings, "RESPONSE_CACHE_ENABLED", False)
+    store_cached_response("a", '"v"', b"x")
+    assert get_response_cache_stats()["items"] == 0